@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import glob
+import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import ase.io
+from ase.data import chemical_symbols
+from ase.calculators.calculator import PropertyNotImplementedError
+
+from coreStore import is_store, read_store, iread_store
+
+"""
+Author: Jiayan Xu
+Description:
+    Shared evaluation of potentials against reference data. A dataset is
+    kept as flat arrays (energies and natoms per frame, atomic numbers and
+    forces of all atoms), predictions are made in batches of frames and
+    cached next to the dataset keyed by the hashes of the model files and the
+    dataset, so regenerating a parity plot does not rerun the potential.
+    Batches can be sharded over a process pool, each worker builds the
+    potential once and results are merged in the frame order.
+    Errors per element are reduced by np.bincount over atomic numbers.
+"""
+
+CACHE_VERSION = 1
+
+BATCH = 100 # frames predicted at once
+
+HASH_CHUNK = 2**20
+
+
+def hash_files(fnames):
+    """sha1 of the contents of files"""
+    sha = hashlib.sha1()
+    for fname in fnames:
+        with open(fname, 'rb') as fopen:
+            for block in iter(lambda: fopen.read(HASH_CHUNK), b''):
+                sha.update(block)
+
+    return sha.hexdigest()
+
+
+def model_files(model):
+    """model file and its companions like GAP.xml.sparseGAP_xxx"""
+    return [model] + sorted(glob.glob(glob.escape(model) + '.*'))
+
+
+def dataset_files(dataset):
+    """files defining a dataset, column files of a frame store"""
+    if is_store(dataset):
+        return [os.path.join(dataset, name) for name in \
+                ['meta.json', 'species.bin', 'positions.bin', 'cells.bin', \
+                'pbc.bin', 'natoms.bin']]
+    return [dataset]
+
+
+def cache_name(dataset, key):
+    dirname, basename = os.path.split(os.path.abspath(dataset))
+    return os.path.join(dirname, '.%s.%s.eval.npz' %(basename, key[:16]))
+
+
+def get_free_energy(atoms):
+    """electronic free energy, energy if the calculator has no free energy"""
+    try:
+        return atoms.get_potential_energy(force_consistent=True)
+    except PropertyNotImplementedError:
+        return atoms.get_potential_energy()
+
+
+def iread_dataset(dataset):
+    """yield atoms of an extended xyz or a frame store"""
+    if is_store(dataset):
+        return iread_store(dataset)
+    return ase.io.iread(dataset, ':')
+
+
+def concatenate_results(energies, natoms, numbers, forces):
+    results = {
+        'energies': np.array(energies, dtype=float),
+        'natoms': np.array(natoms, dtype=int),
+        'numbers': np.concatenate(numbers) if numbers else np.zeros(0, int),
+        'forces': np.concatenate(forces) if forces else np.zeros((0,3))
+    }
+
+    return results
+
+
+def read_references(dataset, free_energy=True):
+    """
+    reference data of a dataset, columns of a store are used directly,
+    energies are electronic free energies or potential energies
+    """
+    if is_store(dataset):
+        store = read_store(dataset)
+        return {
+            'energies': np.array(store['free_energies' if free_energy \
+                    else 'energies']),
+            'natoms': np.array(store['natoms'], dtype=int),
+            'numbers': np.array(store['species'], dtype=int),
+            'forces': np.array(store['forces'])
+        }
+
+    return collect_results(iread_dataset(dataset), free_energy)
+
+
+def collect_results(frames, free_energy=True):
+    """energies and forces from calculators attached to frames"""
+    energies, natoms, numbers, forces = [], [], [], []
+    for atoms in frames:
+        if free_energy:
+            energies.append(get_free_energy(atoms))
+        else:
+            energies.append(atoms.get_potential_energy())
+        natoms.append(len(atoms))
+        numbers.append(atoms.get_atomic_numbers())
+        forces.append(atoms.get_forces())
+
+    return concatenate_results(energies, natoms, numbers, forces)
+
+
+def calculator_predictor(calc):
+    """predictor of a batch by an ase calculator frame by frame"""
+    def predict(batch):
+        energies, forces = [], []
+        for atoms in batch:
+            atoms = atoms.copy()
+            calc.reset()
+            atoms.calc = calc
+            energies.append(get_free_energy(atoms))
+            forces.append(atoms.get_forces())
+        return energies, forces
+
+    return predict
+
+
+def deepmd_predictor(graph):
+    """predictor of a batch by one DeepPot call per composition"""
+    from deepmd.infer import DeepPot
+    dp = DeepPot(graph)
+    type_map = dp.get_type_map()
+
+    def predict(batch):
+        energies, forces = [None]*len(batch), [None]*len(batch)
+        groups = {}
+        for i, atoms in enumerate(batch):
+            key = tuple(atoms.get_chemical_symbols())
+            groups.setdefault(key, []).append(i)
+        for symbols, indices in groups.items():
+            atypes = [type_map.index(s) for s in symbols]
+            coords = np.array([batch[i].get_positions().ravel() \
+                    for i in indices])
+            cells = np.array([batch[i].get_cell()[:].ravel() \
+                    for i in indices])
+            e, f, v = dp.eval(coords, cells, atypes)
+            for j, i in enumerate(indices):
+                energies[i] = float(np.ravel(e[j])[0])
+                forces[i] = np.reshape(f[j], (-1,3))
+        return energies, forces
+
+    return predict
+
+
+def iread_batches(dataset, batchsize=BATCH):
+    """yield lists of batchsize atoms"""
+    batch = []
+    for atoms in iread_dataset(dataset):
+        batch.append(atoms)
+        if len(batch) == batchsize:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# predictor of each worker, built once by the pool initializer
+worker_predictor = None
+
+
+def init_worker(make_predictor, args):
+    global worker_predictor
+    worker_predictor = make_predictor(*args)
+
+
+def predict_shard(batch):
+    """predict a batch in a worker, with its pid and time for throughput"""
+    start = time.time()
+    energies, forces = worker_predictor(batch)
+
+    return energies, forces, os.getpid(), time.time() - start
+
+
+def print_throughput(stats):
+    """frames per second of each worker"""
+    for i, (pid, (nframes, seconds)) in enumerate(sorted(stats.items())):
+        print('Worker %d (pid %d) predicted %d frames in %.2f s, %.2f frames/s.' \
+                %(i, pid, nframes, seconds, nframes/max(seconds,1e-12)))
+
+    return
+
+
+def predict_dataset(dataset, make_predictor, args=(), batchsize=BATCH, \
+        njobs=1):
+    """
+    predictions of all frames, batchsize frames per predictor call,
+    batches are sharded over njobs workers and merged in the frame order,
+    make_predictor(*args) must be picklable for njobs > 1
+    """
+    energies, natoms, numbers, forces = [], [], [], []
+    stats = {}
+
+    def collect(batch, results):
+        batch_energies, batch_forces, pid, seconds = results
+        energies.extend(batch_energies)
+        forces.extend(batch_forces)
+        nframes, total = stats.get(pid, (0, 0.))
+        stats[pid] = (nframes+len(batch), total+seconds)
+        for atoms in batch:
+            natoms.append(len(atoms))
+            numbers.append(atoms.get_atomic_numbers())
+
+    if njobs > 1:
+        with ProcessPoolExecutor(max_workers=njobs, initializer=init_worker, \
+                initargs=(make_predictor, args)) as executor:
+            # a few batches per worker in flight, frames are not all loaded
+            futures = deque()
+            for batch in iread_batches(dataset, batchsize):
+                futures.append((batch, executor.submit(predict_shard, batch)))
+                if len(futures) >= 2*njobs:
+                    batch, future = futures.popleft()
+                    collect(batch, future.result())
+            while futures:
+                batch, future = futures.popleft()
+                collect(batch, future.result())
+    else:
+        init_worker(make_predictor, args)
+        for batch in iread_batches(dataset, batchsize):
+            collect(batch, predict_shard(batch))
+    print_throughput(stats)
+
+    return concatenate_results(energies, natoms, numbers, forces)
+
+
+def load_predictions(cache):
+    try:
+        with np.load(cache, allow_pickle=False) as data:
+            if int(data['version']) != CACHE_VERSION:
+                return None
+            return {key: data[key] for key in \
+                    ['energies', 'natoms', 'numbers', 'forces']}
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_predictions(cache, predictions):
+    """write the cache atomically, silently skip read-only directories"""
+    tmpname = cache + '.tmp'
+    try:
+        with open(tmpname, 'wb') as writer:
+            np.savez(writer, version=np.array(CACHE_VERSION), **predictions)
+        os.replace(tmpname, cache)
+    except OSError:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+
+    return
+
+
+def evaluate_dataset(dataset, model, make_predictor, args=(), \
+        batchsize=BATCH, use_cache=True, njobs=1, free_energy=True):
+    """
+    references and predictions of a dataset, predictions are cached by
+    the hashes of model files and the dataset, make_predictor(*args) is
+    only called when the cache misses
+    """
+    references = read_references(dataset, free_energy)
+
+    cache = None
+    if use_cache:
+        key = hash_files(model_files(model)) + hash_files(dataset_files(dataset))
+        cache = cache_name(dataset, hashlib.sha1(key.encode()).hexdigest())
+        if os.path.exists(cache):
+            predictions = load_predictions(cache)
+            if predictions is not None:
+                return references, predictions
+
+    predictions = predict_dataset(dataset, make_predictor, args, batchsize, \
+            njobs)
+    if cache is not None:
+        save_predictions(cache, predictions)
+
+    return references, predictions
+
+
+def error_metrics(references, predictions):
+    """
+    energy per atom errors and force component errors of each element,
+    {'energy': {'rmse', 'mae'}, 'forces': {symbol: {'rmse', 'mae', 'n'}}}
+    """
+    natoms = references['natoms']
+    de = (predictions['energies'] - references['energies']) / natoms
+    metrics = {
+        'energy': {'rmse': np.sqrt(np.mean(de**2)), 'mae': np.mean(np.fabs(de))}
+    }
+
+    numbers = references['numbers']
+    df = predictions['forces'] - references['forces']
+    counts = 3*np.bincount(numbers)
+    squares = np.bincount(numbers, weights=np.sum(df**2, axis=1))
+    absolutes = np.bincount(numbers, weights=np.sum(np.fabs(df), axis=1))
+
+    metrics['forces'] = {}
+    for z in np.flatnonzero(counts):
+        metrics['forces'][chemical_symbols[z]] = {
+            'rmse': np.sqrt(squares[z]/counts[z]),
+            'mae': absolutes[z]/counts[z], 'n': int(counts[z])
+        }
+    metrics['forces']['all'] = {
+        'rmse': np.sqrt(np.sum(squares)/np.sum(counts)),
+        'mae': np.sum(absolutes)/np.sum(counts), 'n': int(np.sum(counts))
+    }
+
+    return metrics
+
+
+def print_metrics(metrics, title=''):
+    content = '%s\n' %title if title else ''
+    content += 'Energy  RMSE %.6f  MAE %.6f  eV/atom\n' \
+            %(metrics['energy']['rmse'], metrics['energy']['mae'])
+    for symbol, res in metrics['forces'].items():
+        content += 'Force {:<4s} RMSE {:.6f}  MAE {:.6f}  eV/Å  ({:d} components)\n'.format(
+            symbol, res['rmse'], res['mae'], res['n']
+        )
+    print(content, end='')
+
+    return
+
+
+def group_forces(data):
+    """force components of each element, {symbol: (ncomponents,)}"""
+    forces = {}
+    for z in np.unique(data['numbers']):
+        forces[chemical_symbols[z]] = data['forces'][data['numbers']==z].ravel()
+
+    return forces
+
+
+def rms_dict(x_ref, x_pred):
+    """ Takes two datasets of the same shape and returns a dictionary containing RMS error data"""
+
+    x_ref = np.array(x_ref)
+    x_pred = np.array(x_pred)
+
+    if np.shape(x_pred) != np.shape(x_ref):
+        raise ValueError('WARNING: not matching shapes in rms')
+
+    error_2 = (x_ref - x_pred) ** 2
+
+    average = np.sqrt(np.average(error_2))
+    std_ = np.sqrt(np.var(error_2))
+
+    return {'rmse': average, 'std': std_}
+
+
+def extract_energy_and_forces(atom_frames,calc=None,atomic=True):
+    """
+    Electronic free energy and Hellman-Feynman forces,
+    forces are arrays of components of each element
+    """
+    atom_frames = list(atom_frames)
+    references = collect_results(atom_frames)
+    natoms = references['natoms'] if atomic else 1
+
+    energies_dft = references['energies'] / natoms
+    forces_dft = group_forces(references)
+    energies_gap, forces_gap = [], {}
+    if calc:
+        predictions = calculator_predictor(calc)(atom_frames)
+        predictions = concatenate_results(predictions[0], references['natoms'], \
+                [references['numbers']], predictions[1])
+        energies_gap = predictions['energies'] / natoms
+        forces_gap = group_forces(predictions)
+
+    return forces_dft, forces_gap, energies_dft, energies_gap
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import shutil
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import ase.io
+from ase import Atoms
+
+from coreOUTCAR import read_atoms
+from coreStore import is_store, write_store, iread_store, store_atoms
+
+"""
+Author: Jiayan Xu
+Description:
+    Harvest frames from many VASP calculations (OUTCAR or vasprun.xml).
+    Files are parsed in a process pool and the frames of each file are cached
+    in a frame store next to it (.OUTCAR.frames), keyed by the file size,
+    mtime and the frame selection, so a re-run only parses new or changed
+    calculations. Frames are yielded in the order of the input files, and
+    uncached ones are reduced to what the store keeps, so a result does not
+    depend on the cache.
+"""
+
+CACHE_SUFFIX = '.frames'
+
+
+def cache_name(fname):
+    """hidden frame store in the same directory, .OUTCAR.frames"""
+    dirname, basename = os.path.split(os.path.abspath(fname))
+    return os.path.join(dirname, '.' + basename + CACHE_SUFFIX)
+
+
+def file_key(fname, selection):
+    stat = os.stat(fname)
+    key = {
+        'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+        'selection': str(selection)
+    }
+    return key
+
+
+def load_cache(fname, selection):
+    """cached store of fname, None if missing or outdated"""
+    cache = cache_name(fname)
+    keyfile = os.path.join(cache, 'source.json')
+    if not (is_store(cache) and os.path.exists(keyfile)):
+        return None
+
+    with open(keyfile, 'r') as fopen:
+        key = json.load(fopen)
+    if key != file_key(fname, selection):
+        return None
+
+    return cache
+
+
+def save_cache(fname, selection, frames):
+    """write frames to the cache, None if the directory is read-only"""
+    cache = cache_name(fname)
+    key = file_key(fname, selection)
+    try:
+        if os.path.exists(cache):
+            shutil.rmtree(cache)
+        write_store(cache, frames)
+        # the key is written last, an incomplete cache is never valid
+        with open(os.path.join(cache, 'source.json'), 'w') as fopen:
+            json.dump(key, fopen)
+    except OSError:
+        return None
+
+    return cache
+
+
+def read_vasp_frames(fname, selection=-1):
+    """list of atoms from OUTCAR by coreOUTCAR, other files by ase"""
+    if 'OUTCAR' in os.path.basename(fname):
+        return read_atoms(fname, selection=selection)
+
+    frames = ase.io.read(fname, str(selection))
+    if isinstance(frames, Atoms):
+        frames = [frames]
+
+    return frames
+
+
+def harvest_file(fname, selection=-1, use_cache=True):
+    """
+    parse one file in a worker, return the cache directory if the frames
+    are cached, otherwise the list of frames itself
+    """
+    fname = str(fname)
+    if not use_cache:
+        frames = read_vasp_frames(fname, selection)
+        return [store_atoms(atoms) for atoms in frames]
+
+    cache = load_cache(fname, selection)
+    if cache is not None:
+        return cache
+
+    frames = read_vasp_frames(fname, selection)
+    cache = save_cache(fname, selection, frames)
+    if cache is None:
+        return [store_atoms(atoms) for atoms in frames]
+
+    return cache
+
+
+def iharvest(fnames, selection=-1, njobs=1, use_cache=True):
+    """
+    yield (fname, frames) of each file in the input order,
+    frames are read from the cache store when it exists
+    """
+    fnames = [str(fname) for fname in fnames]
+
+    def resolve(fname, result):
+        if isinstance(result, str):
+            return fname, list(iread_store(result))
+        return fname, result
+
+    if njobs > 1:
+        with ProcessPoolExecutor(max_workers=njobs) as executor:
+            results = executor.map(
+                harvest_file, fnames, [selection]*len(fnames), \
+                [use_cache]*len(fnames)
+            )
+            for fname, result in zip(fnames, results):
+                yield resolve(fname, result)
+    else:
+        for fname in fnames:
+            yield resolve(fname, harvest_file(fname, selection, use_cache))
+
+
+def harvest(fnames, selection=-1, njobs=1, use_cache=True):
+    """yield merged frames of all files"""
+    for fname, frames in iharvest(fnames, selection, njobs, use_cache):
+        for atoms in frames:
+            yield atoms
+
+
+def write_frames(fname, frames):
+    """
+    stream frames to an extended xyz, or to a frame store if fname ends
+    with .frames, return number of frames
+    """
+    fname = str(fname)
+    if fname.endswith(CACHE_SUFFIX):
+        return write_store(fname, frames)
+
+    count = 0
+    with open(fname, 'w') as writer:
+        for atoms in frames:
+            ase.io.write(writer, atoms, format='extxyz')
+            count += 1
+
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='merge frames of many vasp calculations'
+    )
+    parser.add_argument('FILES', nargs='+', \
+            help='OUTCAR or vasprun.xml files')
+    parser.add_argument('-i', '--indices', default='-1', \
+            help='frame selection in each file, -1, 0:100, ::10')
+    parser.add_argument('-nj', '--njobs', type=int, default=1, \
+            help='number of processes')
+    parser.add_argument('-o', '--output', default='merged.xyz', \
+            help='output xyz, or frame store with .frames')
+    parser.add_argument('--nocache', action='store_true', \
+            help='do not use or write the per-file cache')
+    args = parser.parse_args()
+
+    nframes = write_frames(args.output, harvest(
+        [Path(f) for f in args.FILES], args.indices, args.njobs, \
+        not args.nocache
+    ))
+    print('Successfully write %d frames to %s.' %(nframes, args.output))
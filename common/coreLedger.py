@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import subprocess
+
+"""
+Author: Jiayan Xu
+Description:
+    Local job scheduler with a JSON ledger. Each job is a shell command run
+    in its own directory, as many jobs as fit in the core budget run at once.
+    The state of every job (pending, running, done, failed) is written to the
+    ledger atomically on each change, so an interrupted run resumes with the
+    unfinished jobs and failed ones are retried up to maxtries attempts.
+"""
+
+LEDGER_VERSION = 1
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+
+def load_ledger(fname):
+    """ledger in fname, an empty one if it does not exist"""
+    if not os.path.exists(fname):
+        return {'version': LEDGER_VERSION, 'jobs': {}}
+
+    with open(fname, 'r') as fopen:
+        ledger = json.load(fopen)
+    if ledger['version'] != LEDGER_VERSION:
+        raise ValueError('Unsupported ledger version %s.' %ledger['version'])
+
+    return ledger
+
+
+def save_ledger(fname, ledger):
+    """replace the ledger atomically, a killed run never leaves half a file"""
+    with open(fname + '.tmp', 'w') as fopen:
+        json.dump(ledger, fopen, indent=2)
+    os.replace(fname + '.tmp', fname)
+
+    return
+
+
+def register_jobs(ledger, names, maxtries=1):
+    """
+    add new jobs as pending, jobs left running by an interrupted run and
+    failed jobs with attempts left are pending again
+    """
+    jobs = ledger['jobs']
+    for name in names:
+        if name not in jobs.keys():
+            jobs[name] = {'status': PENDING, 'attempts': 0}
+        job = jobs[name]
+        if job['status'] == RUNNING or \
+                (job['status'] == FAILED and job['attempts'] < maxtries):
+            job['status'] = PENDING
+
+    return [name for name in names if jobs[name]['status'] == PENDING]
+
+
+def summarize(ledger):
+    """number of jobs in each status"""
+    counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+    for job in ledger['jobs'].values():
+        counts[job['status']] += 1
+
+    return counts
+
+
+def run_jobs(jobs, ledgerfile, ncores=1, cores_per_job=1, maxtries=1, \
+        poll=1.0):
+    """
+    run jobs of (name, directory, command) within ncores, the command is a
+    template formatted with name, directory and ncores (cores per job),
+    a failed job is retried until it has been attempted maxtries times
+    """
+    ledger = load_ledger(ledgerfile)
+    directories = {name: directory for name, directory, command in jobs}
+    commands = {name: command for name, directory, command in jobs}
+
+    queue = register_jobs(ledger, [job[0] for job in jobs], maxtries)
+    save_ledger(ledgerfile, ledger)
+
+    nslots = max(ncores // cores_per_job, 1)
+    print('Run %d jobs, %d at a time.' %(len(queue), nslots))
+
+    running = {}
+    try:
+        while queue or running:
+            # launch jobs in free slots
+            while queue and len(running) < nslots:
+                name = queue.pop(0)
+                command = commands[name].format(
+                    name=name, directory=directories[name], ncores=cores_per_job
+                )
+                proc = subprocess.Popen(command, shell=True, \
+                        cwd=directories[name])
+                running[name] = (proc, time.time())
+                job = ledger['jobs'][name]
+                job.update(status=RUNNING, attempts=job['attempts']+1, \
+                        command=command, directory=directories[name])
+                save_ledger(ledgerfile, ledger)
+
+            # collect finished jobs
+            finished = [(name, proc.poll()) for name, (proc, start) \
+                    in running.items() if proc.poll() is not None]
+            for name, errorcode in finished:
+                proc, start = running.pop(name)
+                job = ledger['jobs'][name]
+                job.update(returncode=errorcode, walltime=time.time()-start)
+                if errorcode == 0:
+                    job['status'] = DONE
+                else:
+                    path = os.path.abspath(directories[name])
+                    print('Job "%s" failed with command "%s" in %s with ' \
+                            'error code %d (attempt %d).' %(name, \
+                            job['command'], path, errorcode, job['attempts']))
+                    if job['attempts'] < maxtries:
+                        job['status'] = PENDING
+                        queue.append(name)
+                    else:
+                        job['status'] = FAILED
+                save_ledger(ledgerfile, ledger)
+
+            if running and not finished:
+                time.sleep(poll)
+    except KeyboardInterrupt:
+        # interrupted jobs are pending again and rerun on resume
+        for name, (proc, start) in running.items():
+            proc.terminate()
+            proc.wait()
+            job = ledger['jobs'][name]
+            job.update(status=PENDING, attempts=job['attempts']-1)
+        save_ledger(ledgerfile, ledger)
+        raise
+
+    counts = summarize(ledger)
+    print('Jobs done %d, failed %d.' %(counts[DONE], counts[FAILED]))
+
+    return ledger
+
+
+if __name__ == '__main__':
+    pass
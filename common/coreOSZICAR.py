@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import re
+import argparse
+
+import numpy as np
+
+from coreStats import SeriesSummary
+
+"""
+Author: Jiayan Xu
+Description:
+    Shared OSZICAR parser of MD steps. The file is read in chunks of bytes,
+    the lines of ionic steps (N T= E= F= E0= EK= SP= SK=) are picked by one
+    regex per chunk and decoded in bulk into a structured array, so a
+    multi-million-step run can be parsed and summarized in a single pass.
+"""
+
+OSZICAR_FIELDS = ['step', 'T', 'E', 'F', 'E0', 'EK', 'SP', 'SK']
+OSZICAR_DTYPE = np.dtype([(name, 'f8') for name in OSZICAR_FIELDS])
+
+MD_LINE = re.compile(rb'\n[ \t]*[0-9]+ +T=[^\n]*')
+LABELS = [b'T=', b'E=', b'F=', b'E0=', b'EK=', b'SP=', b'SK=', b'mag=']
+
+CHUNK = 2**24 # bytes read at once
+
+
+def decode_md_lines(text):
+    """
+    structured array of MD lines in text (bytes), extra columns like mag=
+    of spin-polarized runs are dropped
+    """
+    lines = MD_LINE.findall(b'\n' + text)
+    if not lines:
+        return np.zeros(0, dtype=OSZICAR_DTYPE)
+    nlines, nfields = len(lines), len(OSZICAR_FIELDS)
+
+    # labels become spaces so fused values like T=12345. are split as well
+    text = b''.join(lines)
+    nmags = text.count(b'mag=')
+    for label in LABELS:
+        text = text.replace(label, b' '*len(label))
+
+    if nmags == 0 or nmags == nlines:
+        # all lines have the same width
+        values = np.fromstring(text.decode(), sep=' ')
+        if values.size != nlines*(nfields + (nmags > 0)):
+            raise ValueError('Unrecognized MD lines in OSZICAR.')
+        values = values.reshape(nlines, -1)[:,:nfields]
+    else:
+        # runs with and without ISPIN=2 are concatenated
+        values = np.array([line.split()[:nfields] for line in \
+                text.decode().splitlines() if line.strip()], dtype=float)
+        if values.shape != (nlines, nfields):
+            raise ValueError('Unrecognized MD lines in OSZICAR.')
+
+    data = np.zeros(nlines, dtype=OSZICAR_DTYPE)
+    for i, name in enumerate(OSZICAR_FIELDS):
+        data[name] = values[:,i]
+
+    return data
+
+
+def iread_oszicar(oszicar='OSZICAR', chunksize=CHUNK):
+    """
+    yield structured arrays of MD steps chunk by chunk, an incomplete
+    last line is still being written and skipped
+    """
+    rest = b''
+    with open(oszicar, 'rb') as fopen:
+        while True:
+            chunk = fopen.read(chunksize)
+            if not chunk:
+                break
+            chunk = rest + chunk
+            end = chunk.rfind(b'\n') + 1
+            chunk, rest = chunk[:end], chunk[end:]
+            data = decode_md_lines(chunk)
+            if len(data) > 0:
+                yield data
+
+
+def read_oszicar(oszicar='OSZICAR', chunksize=CHUNK):
+    """structured array of all MD steps"""
+    chunks = list(iread_oszicar(oszicar, chunksize))
+    if not chunks:
+        return np.zeros(0, dtype=OSZICAR_DTYPE)
+
+    return np.concatenate(chunks)
+
+
+def summarize_chunks(chunks, names=['T', 'E0'], blocksize=1000):
+    """
+    streaming statistics of fields in chunks of MD steps, structured arrays
+    or dicts of arrays, in a single pass
+    """
+    summaries = {name: SeriesSummary(blocksize) for name in names}
+    for data in chunks:
+        for name in names:
+            summaries[name].update(data[name])
+
+    return {name: summary.results() for name, summary in summaries.items()}
+
+
+def summarize_oszicar(oszicar='OSZICAR', names=['T', 'E0'], blocksize=1000):
+    """streaming statistics of fields in a single pass over OSZICAR"""
+    return summarize_chunks(iread_oszicar(oszicar), names, blocksize)
+
+
+def print_summary(results, blocksize):
+    content = '{:<6s}{:>10s}{:>16s}{:>12s}{:>12s}{:>8s}{:>12s}\n'.format(
+        'Field', 'Steps', 'Mean', 'Std', 'Error', 'g', 'Equil.'
+    )
+    for name, res in results.items():
+        content += '{:<6s}{:>10d}{:>16.6f}{:>12.6f}{:>12.6f}{:>8.2f}{:>12d}\n'.format(
+            name, res['n'], res['mean'], res['std'], res['error'],
+            res['inefficiency'], res['equilibration']
+        )
+    content += 'Error is corrected by the statistical inefficiency g = 1+2tau, '
+    content += 'equilibration by MSER on blocks of %d steps.' %blocksize
+    print(content)
+
+    return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='statistics of MD steps in OSZICAR'
+    )
+    parser.add_argument('-f', '--oszicar', default='OSZICAR', \
+            help='OSZICAR file')
+    parser.add_argument('-n', '--names', nargs='+', default=['T', 'E0'], \
+            choices=OSZICAR_FIELDS[1:], help='fields')
+    parser.add_argument('-b', '--blocksize', type=int, default=1000, \
+            help='steps in each block')
+    args = parser.parse_args()
+
+    print_summary(
+        summarize_oszicar(args.oszicar, args.names, args.blocksize), \
+        args.blocksize
+    )
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from ase import Atoms
+from ase.units import GPa
+from ase.calculators.singlepoint import SinglePointCalculator
+
+from coreTraj import open_mmap, skip_lines, index_file, parse_selection
+
+"""
+Author: Jiayan Xu
+Description:
+    Shared OUTCAR parser. The file is memory-mapped and scanned only once for
+    the block markers of each ionic step, the byte offsets are collected into
+    a frame index (kept in a sidecar by coreTraj) and position/force blocks
+    are decoded in bulk by NumPy.
+"""
+
+# block markers, searched byte-wise in the memory map
+POSITION_MARKER = b'\n POSITION '
+ENERGY_MARKER = b'FREE ENERGIE OF THE ION-ELECTRON SYSTEM'
+STRESS_MARKER = b'  in kB'
+LATTICE_MARKER = b'VOLUME and BASIS'
+
+MAXLINE = 1000 # number of lines to search for NIONS in the header
+
+
+OUTCAR_KEYS = ['position', 'energy', 'lattice', 'stress', 'cell_changed']
+
+
+def open_outcar(outcar='OUTCAR'):
+    """return a read-only memory map of OUTCAR"""
+    return open_mmap(outcar)
+
+
+def read_natoms(mm):
+    """NIONS in the header of OUTCAR"""
+    pos = 0
+    for i in range(MAXLINE):
+        end = mm.find(b'\n', pos)
+        if end == -1:
+            break
+        line = mm[pos:end]
+        if b'NIONS' in line:
+            return int(line.split(b'NIONS')[-1].split(b'=')[1].split()[0])
+        pos = end + 1
+
+    raise ValueError('No NIONS after reading %d lines.' %MAXLINE)
+
+
+def read_symbols(mm):
+    """chemical symbols of all atoms, from VRHFIN and ions per type"""
+    types = []
+    pos = mm.find(b'VRHFIN =')
+    while pos != -1:
+        end = mm.find(b':', pos)
+        types.append(mm[pos+8:end].strip().decode())
+        pos = mm.find(b'VRHFIN =', end)
+
+    pos = mm.find(b'ions per type =')
+    end = mm.find(b'\n', pos)
+    numbers = [int(n) for n in mm[pos:end].split(b'=')[1].split()]
+
+    symbols = []
+    for s, n in zip(types, numbers):
+        symbols.extend([s]*n)
+
+    return symbols
+
+
+def scan_outcar(mm, start=0, previous=None):
+    """
+    scan OUTCAR once from the byte offset start and return offsets of blocks,
+    only positions followed by an energy block are counted as a frame,
+    lattice and stress are searched backwards between two frames
+    """
+    positions, energies, lattices, stresses, flags = [], [], [], [], []
+
+    lattice, lattice_bytes = -1, None
+    if previous is not None and len(previous['lattice']) > 0:
+        lattice = int(previous['lattice'][-1])
+        if lattice != -1:
+            lattice_bytes = read_lattice_bytes(mm, lattice)
+
+    lower = start
+    pos = mm.find(POSITION_MARKER, start)
+    while pos != -1:
+        pos += 1 # skip newline
+        ene = mm.find(ENERGY_MARKER, pos)
+        if ene == -1:
+            break # last frame is still being written
+        # lattice may be not printed every step, keep the previous one
+        lat = mm.rfind(LATTICE_MARKER, lower, pos)
+        changed = False
+        if lat != -1:
+            cur_bytes = read_lattice_bytes(mm, lat)
+            changed = lattice_bytes is not None and cur_bytes != lattice_bytes
+            lattice, lattice_bytes = lat, cur_bytes
+        positions.append(pos)
+        energies.append(ene)
+        lattices.append(lattice)
+        stresses.append(mm.rfind(STRESS_MARKER, lower, pos))
+        flags.append(changed)
+        # next frame
+        lower = ene
+        pos = mm.find(POSITION_MARKER, ene)
+
+    results = {
+        'natoms': np.array(read_natoms(mm), dtype=np.int64),
+        'position': np.array(positions, dtype=np.int64),
+        'energy': np.array(energies, dtype=np.int64),
+        'lattice': np.array(lattices, dtype=np.int64),
+        'stress': np.array(stresses, dtype=np.int64),
+        'cell_changed': np.array(flags, dtype=bool)
+    }
+
+    # resume after the last complete energy block
+    end = start
+    if energies:
+        end = energies[-1] + len(ENERGY_MARKER)
+
+    return results, end
+
+
+def index_outcar(outcar='OUTCAR'):
+    """frame index of OUTCAR, reused from or saved to the sidecar"""
+    return index_file(outcar, 'outcar', scan_outcar, OUTCAR_KEYS)
+
+
+def skip_lines_or_end(mm, pos, nlines):
+    pos = skip_lines(mm, pos, nlines)
+    return len(mm) if pos == -1 else pos
+
+
+def decode_block(mm, pos, nrows, ncols):
+    """decode nrows lines of floats starting at byte offset pos"""
+    end = skip_lines_or_end(mm, pos, nrows)
+    data = np.array(mm[pos:end].split(), dtype=float)
+    data = data.reshape(nrows, -1)[:,:ncols]
+
+    return data
+
+
+def position_block(mm, pos):
+    """byte range of atom lines in the POSITION block"""
+    pos = skip_lines(mm, pos, 2) # title and segment line ---...---
+    end = mm.find(b' ---', pos) # closing segment line
+
+    return pos, end
+
+
+def decode_positions(mm, pos, natoms):
+    """POSITION block, cartesian coordinates and total forces"""
+    pos, end = position_block(mm, pos)
+    data = np.array(mm[pos:end].split(), dtype=float).reshape(natoms, 6)
+
+    return data[:,:3], data[:,3:]
+
+
+def decode_energy(mm, pos):
+    """free energy TOTEN and energy(sigma->0)"""
+    pos = skip_lines(mm, pos, 2) # title and segment line ---...---
+    end = skip_lines(mm, pos, 3)
+    lines = mm[pos:end].split(b'\n')
+    free_energy = float(lines[0].split()[-2])
+    energy = float(lines[2].split()[-1])
+
+    return energy, free_energy
+
+
+def decode_stress(mm, pos):
+    """stress in eV/AA^3, the line is in kB that equals 0.1 GPa"""
+    end = mm.find(b'\n', pos)
+    # XX YY ZZ XY YZ ZX
+    stress = -np.array(mm[pos:end].split()[2:8], dtype=float)
+    # vigot notation, XX YY ZZ YZ XZ XY
+    stress_vigot = stress[[0,1,2,4,5,3]]*1e-1*GPa # in eV/AA^3
+    stress = stress_vigot[[0,5,4,5,1,3,4,3,2]].reshape(3,3)
+
+    return stress
+
+
+def read_lattice_bytes(mm, pos):
+    """lines of direct lattice vectors"""
+    # segment, energy-cutoff, volume of cell and title lines
+    pos = skip_lines_or_end(mm, pos, 5)
+    end = skip_lines_or_end(mm, pos, 3)
+
+    return mm[pos:end]
+
+
+def decode_lattice(mm, pos):
+    """direct lattice vectors"""
+    # segment, energy-cutoff, volume of cell and title lines
+    pos = skip_lines(mm, pos, 5)
+    lattice = decode_block(mm, pos, 3, 3)
+
+    return lattice
+
+
+def read_frame(mm, index, i, natoms):
+    """decode the i-th frame in the index"""
+    results = {'step': int(i)+1}
+
+    poses, forces = decode_positions(mm, index['position'][i], natoms)
+    results['positions'] = poses
+    results['forces'] = forces
+
+    energy, free_energy = decode_energy(mm, index['energy'][i])
+    results['energy'] = energy
+    results['free_energy'] = free_energy
+
+    if index['stress'][i] != -1:
+        results['stress'] = decode_stress(mm, index['stress'][i])
+    if index['lattice'][i] != -1:
+        results['lattice'] = decode_lattice(mm, index['lattice'][i])
+
+    return results
+
+
+def select_frames(index, nframes=-1, selection=None):
+    """indices of selected frames, at most nframes if it is positive"""
+    indices = parse_selection(selection, len(index['position']))
+    if nframes > 0:
+        indices = indices[:int(nframes)]
+
+    return indices
+
+
+def read_trajectory(outcar='OUTCAR',natoms=None,nframes=-1,verbose=True,\
+        selection=None):
+    """
+    positions, forces in (nframes, natoms, 3) and energies in (nframes,),
+    blocks are decoded directly into preallocated arrays
+    """
+    index = index_outcar(outcar)
+    if natoms is None:
+        natoms = index['natoms']
+    natoms = int(natoms)
+
+    indices = select_frames(index, nframes, selection)
+    ntotal = len(indices)
+
+    mm = open_outcar(outcar)
+    data = np.empty((ntotal, natoms, 6))
+    energies = np.empty(ntotal)
+    for i, j in enumerate(indices):
+        pos, end = position_block(mm, index['position'][j])
+        data[i] = np.array(mm[pos:end].split(), dtype=float).reshape(natoms, 6)
+        energies[i] = decode_energy(mm, index['energy'][j])[0]
+    mm.close()
+
+    if verbose:
+        print('Successfully read %s, get %d frames ...' %(outcar, ntotal))
+
+    return data[:,:,:3], data[:,:,3:], energies
+
+
+def iread_outcar(outcar='OUTCAR',natoms=None,nframes=-1,selection=None):
+    """
+    yield frames one by one, only the frame index is kept in memory,
+    selection is an integer or a slice string like -1 or ::10
+    """
+    index = index_outcar(outcar)
+    if natoms is None:
+        natoms = index['natoms']
+    natoms = int(natoms)
+
+    indices = select_frames(index, nframes, selection)
+
+    mm = open_outcar(outcar)
+    try:
+        for i in indices:
+            yield read_frame(mm, index, i, natoms)
+    finally:
+        mm.close()
+
+
+def read_outcar(outcar='OUTCAR',natoms=None,nframes=-1,verbose=True,\
+        selection=None):
+    """
+    in each frame,
+    coordinates, forces, energies, stress and lattice (if have) will be read,
+    all frames are read when nframes is not positive
+    """
+    frames = list(iread_outcar(outcar, natoms, nframes, selection))
+
+    if verbose:
+        print('Successfully read %s, get %d frames ...' %(outcar, len(frames)))
+
+    return frames
+
+
+def read_atoms(outcar='OUTCAR', selection=-1):
+    """selected frames as a list of ase atoms with single point results"""
+    mm = open_outcar(outcar)
+    symbols = read_symbols(mm)
+    mm.close()
+
+    frames = read_outcar(outcar, natoms=len(symbols), verbose=False, \
+            selection=selection)
+
+    atom_frames = []
+    for results in frames:
+        atoms = Atoms(symbols, positions=results['positions'], \
+                cell=results['lattice'], pbc=True)
+        properties = {}
+        for key in ['energy', 'free_energy', 'forces', 'stress']:
+            if key in results.keys():
+                properties[key] = results[key]
+        atoms.calc = SinglePointCalculator(atoms, **properties)
+        atom_frames.append(atoms)
+
+    return atom_frames
+
+
+if __name__ == '__main__':
+    pass
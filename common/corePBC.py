@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+"""
+Author: Jiayan Xu
+Description:
+    Periodic unwrapping of positions. Each frame is shifted by whole lattice
+    vectors to be the closest image of the previous one, done with array
+    operations over a (nframes, natoms, 3) block in fractional coordinates
+    so non-orthogonal and variable cells are handled as well.
+"""
+
+
+def adjust_poses(poses, refposes):
+    """poses, poses_ref should be in direct, take last step as reference"""
+    poses = poses - np.round(poses - refposes)
+    refposes = poses.copy()
+
+    return poses, refposes
+
+
+def unwrap_direct(dirposes, refposes=None, return_images=False):
+    """
+    unwrap (nframes, natoms, 3) direct coordinates frame by frame,
+    the first frame is adjusted to refposes if it is given,
+    cumulative lattice images of each frame can be returned for diffusion
+    """
+    dirposes = np.asarray(dirposes, dtype=float)
+
+    # image shift between consecutive frames
+    steps = np.zeros(dirposes.shape)
+    steps[1:] = np.round(dirposes[1:] - dirposes[:-1])
+    if refposes is not None:
+        steps[0] = np.round(dirposes[0] - refposes)
+    images = np.cumsum(steps, axis=0)
+
+    unwrapped = dirposes - images
+
+    if return_images:
+        return unwrapped, images.astype(int)
+    return unwrapped
+
+
+def unwrap_cartesian(poses, lattice, refposes=None, return_images=False):
+    """
+    unwrap (nframes, natoms, 3) cartesian coordinates,
+    lattice is a (3, 3) cell or (nframes, 3, 3) cells, refposes in direct
+    """
+    poses = np.asarray(poses, dtype=float)
+    lattice = np.asarray(lattice, dtype=float)
+
+    if lattice.ndim == 2:
+        dirposes = np.dot(poses, np.linalg.inv(lattice))
+    else:
+        dirposes = np.einsum('fij,fjk->fik', poses, np.linalg.inv(lattice))
+
+    results = unwrap_direct(dirposes, refposes, return_images)
+    if return_images:
+        dirposes, images = results
+    else:
+        dirposes = results
+
+    if lattice.ndim == 2:
+        poses = np.dot(dirposes, lattice)
+    else:
+        poses = np.einsum('fij,fjk->fik', dirposes, lattice)
+
+    if return_images:
+        return poses, images
+    return poses
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+"""
+Author: Jiayan Xu
+Description:
+    Streaming statistics of long time series, fed chunk by chunk so memory
+    does not grow with the number of steps. RunningStats merges mean and
+    variance of chunks, Blocking keeps one pending value per level of the
+    Flyvbjerg-Petersen blocking to estimate the statistical inefficiency
+    (autocorrelation time), and BlockAverage keeps means of fixed blocks for
+    block averages and equilibration detection by MSER.
+"""
+
+
+class RunningStats(object):
+    """mean and variance merged over chunks (Chan et al.)"""
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.
+        self.m2 = 0. # sum of squared deviations
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        n = len(values)
+        if n == 0:
+            return
+        mean = np.mean(values)
+        m2 = np.sum((values - mean)**2)
+
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta**2 * self.n * n / total
+        self.n = total
+
+        return
+
+    @property
+    def variance(self):
+        """unbiased variance"""
+        if self.n < 2:
+            return 0.
+        return self.m2 / (self.n - 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+
+class Blocking(object):
+    """
+    block means of sizes 2^l, level l only keeps its running stats and
+    an unpaired value waiting for the next chunk
+    """
+    def __init__(self, nlevels=32):
+        self.levels = [RunningStats() for l in range(nlevels)]
+        self.carries = [None] * nlevels
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        for l, stats in enumerate(self.levels):
+            if len(values) == 0:
+                break
+            stats.update(values)
+            if self.carries[l] is not None:
+                values = np.concatenate(([self.carries[l]], values))
+                self.carries[l] = None
+            if len(values) % 2 == 1:
+                self.carries[l] = values[-1]
+                values = values[:-1]
+            values = 0.5 * (values[0::2] + values[1::2])
+
+        return
+
+    def inefficiencies(self, minblocks=32):
+        """block sizes and statistical inefficiencies with enough blocks"""
+        variance = self.levels[0].variance
+        sizes, ginefs = [], []
+        for l, stats in enumerate(self.levels):
+            if stats.n < minblocks or variance == 0.:
+                break
+            sizes.append(2**l)
+            ginefs.append(2**l * stats.variance / variance)
+
+        return np.array(sizes), np.array(ginefs)
+
+    def inefficiency(self, minblocks=32):
+        """
+        statistical inefficiency g = 1 + 2 tau, the largest estimate of
+        levels with at least minblocks blocks
+        """
+        sizes, ginefs = self.inefficiencies(minblocks)
+        if len(ginefs) == 0:
+            return 1.
+        return max(np.max(ginefs), 1.)
+
+    def error(self, minblocks=32):
+        """standard error of the mean corrected by the inefficiency"""
+        stats = self.levels[0]
+        if stats.n < 2:
+            return 0.
+        return np.sqrt(self.inefficiency(minblocks) * stats.variance / stats.n)
+
+
+class BlockAverage(object):
+    """means of consecutive blocks of blocksize values"""
+    def __init__(self, blocksize=1000):
+        self.blocksize = blocksize
+        self.means = []
+        self.pending = RunningStats()
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        while len(values) > 0:
+            nfill = self.blocksize - self.pending.n
+            self.pending.update(values[:nfill])
+            values = values[nfill:]
+            if self.pending.n == self.blocksize:
+                self.means.append(self.pending.mean)
+                self.pending = RunningStats()
+
+        return
+
+    def get_means(self):
+        return np.array(self.means)
+
+    def equilibration(self):
+        """
+        number of values to discard by MSER on block means, the truncation
+        minimizing the squared standard error of the remaining means
+        """
+        means = self.get_means()
+        n = len(means)
+        if n < 2:
+            return 0
+
+        # variance of means[d:] for every d by reversed cumulative sums
+        counts = np.arange(n, 0, -1)
+        sums = np.cumsum(means[::-1])[::-1]
+        sqsums = np.cumsum(means[::-1]**2)[::-1]
+        variances = sqsums/counts - (sums/counts)**2
+        # keep at least half of the blocks
+        ncut = n // 2 + 1
+        d = np.argmin(variances[:ncut] / counts[:ncut])
+
+        return int(d * self.blocksize)
+
+
+class SeriesSummary(object):
+    """all streaming statistics of one series"""
+    def __init__(self, blocksize=1000, minblocks=32):
+        self.minblocks = minblocks
+        self.stats = RunningStats()
+        self.blocking = Blocking()
+        self.blocks = BlockAverage(blocksize)
+
+    def update(self, values):
+        self.stats.update(values)
+        self.blocking.update(values)
+        self.blocks.update(values)
+
+        return
+
+    def results(self):
+        """
+        mean, std, standard error, statistical inefficiency,
+        equilibration length and block means
+        """
+        results = {
+            'n': self.stats.n, 'mean': self.stats.mean, 'std': self.stats.std,
+            'error': self.blocking.error(self.minblocks),
+            'inefficiency': self.blocking.inefficiency(self.minblocks),
+            'equilibration': self.blocks.equilibration(),
+            'block_means': self.blocks.get_means()
+        }
+
+        return results
+
+
+def summarize_series(chunks, blocksize=1000, minblocks=32):
+    """statistics of a series given in chunks, in a single pass"""
+    summary = SeriesSummary(blocksize, minblocks)
+    for values in chunks:
+        summary.update(values)
+
+    return summary.results()
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import argparse
+
+import numpy as np
+
+import ase.io
+from ase import Atoms
+from ase.calculators.singlepoint import SinglePointCalculator
+from ase.constraints import FixAtoms, FixScaled
+
+from coreTraj import parse_selection
+from coreXYZ import write_xyz_frames
+
+"""
+Author: Jiayan Xu
+Description:
+    Binary columnar frame store, an alternative to extended xyz for datasets.
+    A store is a directory with one raw binary file per column (positions,
+    forces, cells, energies, virials, species ...) and a meta.json. Per-atom
+    columns are concatenated over frames and sliced with an offset table, so
+    frames of different sizes can be mixed. Columns are loaded by np.memmap
+    and new frames are appended at the end of each file. Selective dynamics
+    (FixAtoms and FixScaled) is kept as a move mask, other constraints and
+    atoms.info except the step are not stored.
+"""
+
+STORE_VERSION = 1
+
+# name: (dtype, shape of one row, atom or frame column)
+COLUMNS = {
+    'species': ('<i4', (), 'atom'),
+    'positions': ('<f8', (3,), 'atom'),
+    'forces': ('<f8', (3,), 'atom'),
+    'cells': ('<f8', (3,3), 'frame'),
+    'pbc': ('|b1', (3,), 'frame'),
+    'energies': ('<f8', (), 'frame'),
+    'free_energies': ('<f8', (), 'frame'),
+    'virials': ('<f8', (3,3), 'frame'),
+    'natoms': ('<i8', (), 'frame'),
+    'steps': ('<i8', (), 'frame'), # -1 if no step in atoms.info
+    'move_mask': ('|b1', (3,), 'atom') # False if fixed by selective dynamics
+}
+
+# columns added later, filled for stores written without them
+FILLS = {
+    'move_mask': True
+}
+
+CHUNK = 1000 # frames buffered before appending to column files
+
+
+def is_store(dirname):
+    return os.path.isfile(os.path.join(str(dirname), 'meta.json'))
+
+
+def read_meta(dirname):
+    with open(os.path.join(str(dirname), 'meta.json'), 'r') as fopen:
+        meta = json.load(fopen)
+    if meta['version'] != STORE_VERSION:
+        raise ValueError('Unsupported store version %s.' %meta['version'])
+    return meta
+
+
+def write_meta(dirname, meta):
+    """replace meta.json atomically, it defines the number of valid frames"""
+    fname = os.path.join(str(dirname), 'meta.json')
+    with open(fname + '.tmp', 'w') as fopen:
+        json.dump(meta, fopen, indent=2)
+    os.replace(fname + '.tmp', fname)
+
+
+def atoms2columns(atoms):
+    """columns of a single atoms, missing properties are NaN"""
+    natoms = len(atoms)
+    results = {}
+    if atoms.calc is not None:
+        results = atoms.calc.results
+
+    energy = results.get('energy', atoms.info.get('energy', np.nan))
+    free_energy = results.get('free_energy', \
+            atoms.info.get('free_energy', energy))
+
+    forces = results.get('forces', atoms.arrays.get('forces', None))
+    if forces is None:
+        forces = np.full((natoms,3), np.nan)
+
+    if 'stress' in results.keys():
+        stress = np.array(results['stress'])
+        if stress.shape == (6,):
+            xx, yy, zz, yz, xz, xy = stress
+            stress = np.array([[xx,xy,xz],[xy,yy,yz],[xz,yz,zz]])
+        virial = -stress*atoms.get_volume()
+    elif 'virial' in atoms.info.keys():
+        virial = np.array(atoms.info['virial'], dtype=float).reshape(3,3)
+    else:
+        virial = np.full((3,3), np.nan)
+
+    move_mask = np.ones((natoms,3), dtype=bool)
+    for constraint in atoms.constraints:
+        if isinstance(constraint, FixAtoms):
+            move_mask[constraint.index] = False
+        elif isinstance(constraint, FixScaled):
+            move_mask[constraint.index] &= ~np.asarray(constraint.mask)
+
+    columns = {
+        'species': atoms.get_atomic_numbers(),
+        'positions': atoms.get_positions(),
+        'forces': forces,
+        'cells': atoms.get_cell()[:],
+        'pbc': atoms.get_pbc(),
+        'energies': energy,
+        'free_energies': free_energy,
+        'virials': virial,
+        'natoms': natoms,
+        'steps': atoms.info.get('step', -1),
+        'move_mask': move_mask
+    }
+
+    return columns
+
+
+def flush_columns(dirname, buffers):
+    """append buffered rows to each column file"""
+    for name, (dtype, shape, kind) in COLUMNS.items():
+        if not buffers[name]:
+            continue
+        if kind == 'atom':
+            data = np.concatenate(
+                [np.asarray(b, dtype=dtype).reshape(-1, *shape) \
+                        for b in buffers[name]]
+            )
+        else:
+            data = np.asarray(buffers[name], dtype=dtype)
+        with open(os.path.join(str(dirname), name + '.bin'), 'ab') as fopen:
+            fopen.write(np.ascontiguousarray(data).tobytes())
+        buffers[name] = []
+
+    return
+
+
+def write_store(dirname, frames, mode='w'):
+    """
+    write an iterable of ase atoms to the store dirname,
+    mode a appends frames to an existing store
+    """
+    dirname = str(dirname)
+    if mode == 'a' and is_store(dirname):
+        meta = read_meta(dirname)
+        # drop bytes of an interrupted append beyond the valid frames
+        truncate_columns(dirname, meta)
+    elif mode in ['w', 'a']:
+        os.makedirs(dirname, exist_ok=True)
+        meta = {'version': STORE_VERSION, 'nframes': 0, 'natoms': 0}
+        for name in COLUMNS.keys():
+            open(os.path.join(dirname, name + '.bin'), 'wb').close()
+    else:
+        raise ValueError('Unknown mode %s.' %mode)
+
+    buffers = {name: [] for name in COLUMNS.keys()}
+
+    def flush():
+        nframes = len(buffers['natoms'])
+        natoms = int(np.sum(buffers['natoms'], dtype=np.int64))
+        flush_columns(dirname, buffers)
+        meta['nframes'] += nframes
+        meta['natoms'] += natoms
+        write_meta(dirname, meta)
+
+    count = 0
+    for atoms in frames:
+        for name, value in atoms2columns(atoms).items():
+            buffers[name].append(value)
+        count += 1
+        if count % CHUNK == 0:
+            flush()
+    flush()
+
+    return count
+
+
+def append_store(dirname, frames):
+    return write_store(dirname, frames, mode='a')
+
+
+def truncate_columns(dirname, meta):
+    """
+    cut column files to the frames recorded in meta, missing columns are
+    filled so appended rows line up
+    """
+    for name, (dtype, shape, kind) in COLUMNS.items():
+        nrows = meta['natoms'] if kind == 'atom' else meta['nframes']
+        nbytes = nrows * np.dtype(dtype).itemsize * int(np.prod(shape))
+        fname = os.path.join(str(dirname), name + '.bin')
+        if not os.path.exists(fname):
+            with open(fname, 'wb') as fopen:
+                fopen.write(np.full((nrows, *shape), FILLS[name], \
+                        dtype=dtype).tobytes())
+        elif os.path.getsize(fname) > nbytes:
+            with open(fname, 'r+b') as fopen:
+                fopen.truncate(nbytes)
+
+    return
+
+
+def read_column(dirname, name, nrows):
+    """memory map of the first nrows rows in a column"""
+    dtype, shape, kind = COLUMNS[name]
+    if nrows == 0:
+        return np.zeros((0, *shape), dtype=dtype)
+    fname = os.path.join(str(dirname), name + '.bin')
+    if not os.path.exists(fname):
+        return np.full((nrows, *shape), FILLS[name], dtype=dtype)
+    data = np.memmap(fname, dtype=dtype, mode='r', \
+            shape=(nrows, *shape))
+
+    return data
+
+
+def read_store(dirname):
+    """memory maps of all columns and the per-frame atom offsets"""
+    meta = read_meta(dirname)
+    store = {}
+    for name, (dtype, shape, kind) in COLUMNS.items():
+        nrows = meta['natoms'] if kind == 'atom' else meta['nframes']
+        store[name] = read_column(dirname, name, nrows)
+    store['offsets'] = np.concatenate(([0], np.cumsum(store['natoms'])))
+
+    return store
+
+
+def get_atoms(store, i):
+    """i-th frame in the store as ase atoms with single point results"""
+    start, end = store['offsets'][i], store['offsets'][i+1]
+    atoms = Atoms(
+        numbers=np.array(store['species'][start:end]),
+        positions=np.array(store['positions'][start:end]),
+        cell=np.array(store['cells'][i]), pbc=np.array(store['pbc'][i])
+    )
+
+    properties = {}
+    if not np.isnan(store['energies'][i]):
+        properties['energy'] = float(store['energies'][i])
+    if not np.isnan(store['free_energies'][i]):
+        properties['free_energy'] = float(store['free_energies'][i])
+    forces = np.array(store['forces'][start:end])
+    if not np.isnan(forces).any():
+        properties['forces'] = forces
+    virial = np.array(store['virials'][i])
+    if not np.isnan(virial).any() and atoms.cell.rank == 3:
+        properties['stress'] = -virial/atoms.get_volume()
+    if store['steps'][i] != -1:
+        atoms.info['step'] = int(store['steps'][i])
+    if properties:
+        atoms.calc = SinglePointCalculator(atoms, **properties)
+
+    # same constraints as ase gives to selective dynamics of vasp
+    fixed = ~np.array(store['move_mask'][start:end])
+    constraints = [FixScaled(int(j), fixed[j], atoms.cell) \
+            for j in np.flatnonzero(fixed.any(axis=1) & ~fixed.all(axis=1))]
+    if fixed.all(axis=1).any():
+        constraints.append(FixAtoms(np.flatnonzero(fixed.all(axis=1))))
+    if constraints:
+        atoms.set_constraint(constraints)
+
+    return atoms
+
+
+def store_atoms(atoms):
+    """atoms as it is read back from a store"""
+    store = {}
+    for name, value in atoms2columns(atoms).items():
+        dtype, shape, kind = COLUMNS[name]
+        if kind == 'atom':
+            store[name] = np.asarray(value, dtype=dtype).reshape(-1, *shape)
+        else:
+            store[name] = np.asarray([value], dtype=dtype)
+    store['offsets'] = np.array([0, len(atoms)])
+
+    return get_atoms(store, 0)
+
+
+def iread_store(dirname, selection=None):
+    """yield selected frames as ase atoms"""
+    store = read_store(dirname)
+    for i in parse_selection(selection, len(store['natoms'])):
+        yield get_atoms(store, i)
+
+
+def read_frames(fname, index=':'):
+    """
+    list of atoms from a store or any file ase can read, so the dataset
+    tools accept both without changing their loops
+    """
+    if is_store(fname):
+        return list(iread_store(fname, index))
+
+    frames = ase.io.read(fname, index)
+    if isinstance(frames, Atoms):
+        frames = [frames]
+
+    return frames
+
+
+def xyz2store(xyzfile, dirname, mode='w'):
+    """convert an extended xyz to a store without keeping all atoms"""
+    return write_store(dirname, ase.io.iread(xyzfile, ':'), mode)
+
+
+def store2xyz(dirname, xyzfile, selection=None):
+    """convert a store back to extended xyz with coreXYZ writer"""
+    store = read_store(dirname)
+
+    def frame_dicts():
+        for i in parse_selection(selection, len(store['natoms'])):
+            atoms = get_atoms(store, i)
+            frame = {
+                'symbols': atoms.get_chemical_symbols(),
+                'positions': atoms.get_positions(),
+                'Lattice': atoms.get_cell()[:],
+                'pbc': ['T' if p else 'F' for p in atoms.get_pbc()]
+            }
+            if 'step' in atoms.info.keys():
+                frame['step'] = atoms.info['step']
+            results = atoms.calc.results if atoms.calc is not None else {}
+            if 'energy' in results.keys():
+                frame['energy'] = results['energy']
+            if 'free_energy' in results.keys():
+                frame['free_energy'] = results['free_energy']
+            if 'forces' in results.keys():
+                frame['forces'] = results['forces']
+            if not np.isnan(store['virials'][i]).any():
+                frame['virial'] = np.array(store['virials'][i])
+            yield frame
+
+    return write_xyz_frames(xyzfile, frame_dicts())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='convert between extended xyz and frame store'
+    )
+    parser.add_argument('INPUT', help='xyz file or store directory')
+    parser.add_argument('OUTPUT', help='store directory or xyz file')
+    parser.add_argument('-a', '--append', action='store_true', \
+            help='append frames to an existing store')
+    args = parser.parse_args()
+
+    if is_store(args.INPUT):
+        nframes = store2xyz(args.INPUT, args.OUTPUT)
+    else:
+        nframes = xyz2store(args.INPUT, args.OUTPUT, \
+                'a' if args.append else 'w')
+    print('Successfully convert %d frames to %s.' %(nframes, args.OUTPUT))
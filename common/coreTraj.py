@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import mmap
+
+import numpy as np
+
+"""
+Author: Jiayan Xu
+Description:
+    Persistent frame index of trajectory files (OUTCAR, XDATCAR, OUT.ANI, xyz).
+    The byte offsets of each ionic step are written to a sidecar file next to
+    the trajectory on the first scan and reused afterwards, so any frame can
+    be decoded with a single seek. The sidecar is extended incrementally when
+    the trajectory is still being appended and rebuilt when it is modified.
+"""
+
+SIDECAR_VERSION = 1
+
+TAIL = 64 # bytes before the scanned end used to check an appended file
+
+
+def open_mmap(fname):
+    """return a read-only memory map of fname"""
+    # check file existence
+    if not os.path.exists(fname):
+        raise ValueError('%s doesnot exist.' %fname)
+
+    with open(fname, 'rb') as fopen:
+        if os.fstat(fopen.fileno()).st_size == 0:
+            raise ValueError('%s is empty.' %fname)
+        mm = mmap.mmap(fopen.fileno(), 0, access=mmap.ACCESS_READ)
+
+    return mm
+
+
+def skip_lines(mm, pos, nlines):
+    """byte offset after skipping nlines from pos, -1 if the file ends"""
+    for i in range(nlines):
+        pos = mm.find(b'\n', pos)
+        if pos == -1:
+            return -1
+        pos += 1
+    return pos
+
+
+def sidecar_name(fname):
+    """hidden index file in the same directory, .OUTCAR.idx.npz"""
+    dirname, basename = os.path.split(os.path.abspath(fname))
+    return os.path.join(dirname, '.' + basename + '.idx.npz')
+
+
+def load_sidecar(fname, fmt):
+    """index in the sidecar, None if missing or unreadable"""
+    sidecar = sidecar_name(fname)
+    if not os.path.exists(sidecar):
+        return None
+
+    try:
+        with np.load(sidecar, allow_pickle=False) as data:
+            index = {key: data[key] for key in data.files}
+    except (OSError, ValueError):
+        return None
+
+    if int(index['version']) != SIDECAR_VERSION or str(index['format']) != fmt:
+        return None
+
+    return index
+
+
+def save_sidecar(fname, index):
+    """write the sidecar atomically, silently skip read-only directories"""
+    sidecar = sidecar_name(fname)
+    tmpname = sidecar + '.tmp'
+    try:
+        with open(tmpname, 'wb') as writer:
+            np.savez(writer, **index)
+        os.replace(tmpname, sidecar)
+    except OSError:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+
+    return
+
+
+def index_file(fname, fmt, scanner, frame_keys):
+    """
+    frame index of fname, scanner(mm, start, previous) scans frames after the
+    byte offset start and returns a dict of per-frame arrays and the end offset
+    """
+    stat = os.stat(fname)
+
+    index = load_sidecar(fname, fmt)
+    if index is not None:
+        if int(index['size']) == stat.st_size and \
+                int(index['mtime_ns']) == stat.st_mtime_ns:
+            return index
+
+    mm = open_mmap(fname)
+
+    # an appended file keeps the scanned bytes, only scan the new part
+    previous = None
+    if index is not None and stat.st_size >= int(index['size']):
+        end = int(index['end'])
+        tail = np.frombuffer(mm[max(end-TAIL,0):end], dtype=np.uint8)
+        if np.array_equal(tail, index['tail']):
+            previous = index
+
+    if previous is None:
+        start = 0
+    else:
+        start = int(previous['end'])
+    results, end = scanner(mm, start, previous)
+
+    if previous is not None:
+        for key in frame_keys:
+            results[key] = np.concatenate((previous[key], results[key]))
+
+    index = dict(results)
+    index['version'] = np.array(SIDECAR_VERSION)
+    index['format'] = np.array(fmt)
+    index['size'] = np.array(stat.st_size, dtype=np.int64)
+    index['mtime_ns'] = np.array(stat.st_mtime_ns, dtype=np.int64)
+    index['end'] = np.array(end, dtype=np.int64)
+    index['tail'] = np.frombuffer(mm[max(end-TAIL,0):end], dtype=np.uint8)
+
+    mm.close()
+
+    save_sidecar(fname, index)
+
+    return index
+
+
+def parse_selection(selection, nframes):
+    """
+    frame indices from an integer or a string like -1, 10, 0:100, ::10,
+    or a comma-separated list of them like 0:10,15,20:25,
+    all frames are selected when selection is None
+    """
+    if selection is None:
+        return np.arange(nframes)
+
+    if isinstance(selection, str) and ',' in selection:
+        return np.concatenate([np.zeros(0, dtype=int)] + \
+                [parse_selection(s, nframes) for s in selection.split(',') if s])
+
+    if isinstance(selection, str) and ':' in selection:
+        indices = [int(i) if i else None for i in selection.split(':')]
+        return np.arange(nframes)[slice(*indices)]
+
+    i = int(selection)
+    if i < 0:
+        i += nframes
+    if not 0 <= i < nframes:
+        raise IndexError('Frame %s out of %d frames.' %(selection, nframes))
+
+    return np.array([i])
+
+
+def format_selection(indices):
+    """shortest selection string of indices, consecutive runs as start:stop"""
+    parts = []
+    indices = [int(i) for i in indices]
+    i = 0
+    while i < len(indices):
+        j = i
+        while j+1 < len(indices) and indices[j+1] == indices[j] + 1:
+            j += 1
+        if j > i:
+            parts.append('%d:%d' %(indices[i], indices[j]+1))
+        else:
+            parts.append('%d' %indices[i])
+        i = j + 1
+
+    return ','.join(parts)
+
+
+def write_chunks(fname, contents, chunk_size=100, mode='w'):
+    """
+    write an iterable of frame strings, chunk_size frames are joined per write
+    so the output grows while frames are still being read
+    """
+    chunk_size = max(int(chunk_size), 1)
+
+    count = 0
+    with open(fname, mode) as writer:
+        chunk = []
+        for content in contents:
+            chunk.append(content)
+            count += 1
+            if len(chunk) == chunk_size:
+                writer.write(''.join(chunk))
+                writer.flush()
+                chunk = []
+        if chunk:
+            writer.write(''.join(chunk))
+
+    return count
+
+
+# --- XDATCAR ---
+XDATCAR_MARKER = b'configuration='
+XDATCAR_KEYS = ['offset', 'header', 'cell_changed']
+
+
+def is_counts_line(line):
+    """the line of numbers of each element in the header"""
+    data = line.split()
+    return len(data) > 0 and all(d.isdigit() for d in data)
+
+
+def scan_xdatcar(mm, start=0, previous=None):
+    """offsets of configuration lines and the header (cell) of each frame"""
+    offsets, headers, flags = [], [], []
+    if previous is None:
+        header, header_bytes = 0, None
+    else:
+        header = int(previous['header'][-1])
+        header_bytes = read_xdatcar_header_bytes(mm, header)
+
+    pos = mm.find(XDATCAR_MARKER, start)
+    while pos != -1:
+        line_start = mm.rfind(b'\n', 0, pos) + 1
+        # variable cell, the header is repeated before the configuration
+        counts_start = mm.rfind(b'\n', 0, line_start-1) + 1
+        if is_counts_line(mm[counts_start:line_start]):
+            header = line_start
+            for i in range(7):
+                header = mm.rfind(b'\n', 0, header-1) + 1
+        cur_bytes = read_xdatcar_header_bytes(mm, header)
+        offsets.append(line_start)
+        headers.append(header)
+        flags.append(header_bytes is not None and cur_bytes != header_bytes)
+        header_bytes = cur_bytes
+        pos = mm.find(XDATCAR_MARKER, pos+len(XDATCAR_MARKER))
+
+    # the last frame may be still being written
+    end = start
+    if offsets:
+        natoms = read_xdatcar_natoms(mm, headers[-1])
+        end = skip_lines(mm, offsets[-1], natoms+1)
+        if end == -1:
+            offsets, headers, flags = offsets[:-1], headers[:-1], flags[:-1]
+            end = start
+            if offsets:
+                end = skip_lines(mm, offsets[-1], natoms+1)
+
+    results = {
+        'offset': np.array(offsets, dtype=np.int64),
+        'header': np.array(headers, dtype=np.int64),
+        'cell_changed': np.array(flags, dtype=bool)
+    }
+
+    return results, end
+
+
+def read_xdatcar_header_bytes(mm, header):
+    """scaling, lattice, symbols and numbers lines"""
+    pos = skip_lines(mm, header, 1)
+    end = skip_lines(mm, pos, 6)
+    return mm[pos:end]
+
+
+def read_xdatcar_natoms(mm, header):
+    lines = read_xdatcar_header_bytes(mm, header).split(b'\n')
+    return sum(int(n) for n in lines[5].split())
+
+
+def read_xdatcar_header(mm, header):
+    """lattice, element symbols and numbers"""
+    lines = read_xdatcar_header_bytes(mm, header).split(b'\n')
+    scaling = float(lines[0].split()[0])
+    lattice = np.array([line.split()[:3] for line in lines[1:4]], dtype=float)
+    symbols = [s.decode() for s in lines[4].split()]
+    numbers = [int(n) for n in lines[5].split()]
+
+    return lattice*scaling, symbols, numbers
+
+
+def index_xdatcar(xdatcar='XDATCAR'):
+    return index_file(xdatcar, 'xdatcar', scan_xdatcar, XDATCAR_KEYS)
+
+
+def read_xdatcar(xdatcar='XDATCAR', selection=None):
+    """lattice, symbols, numbers and direct coordinates of selected frames"""
+    index = index_xdatcar(xdatcar)
+    indices = parse_selection(selection, len(index['offset']))
+
+    mm = open_mmap(xdatcar)
+    frames = []
+    for i in indices:
+        lattice, symbols, numbers = read_xdatcar_header(mm, index['header'][i])
+        natoms = sum(numbers)
+        pos = skip_lines(mm, index['offset'][i], 1)
+        end = skip_lines(mm, pos, natoms)
+        dirposes = np.array(mm[pos:end].split(), dtype=float).reshape(natoms,3)
+        frames.append((lattice, symbols, numbers, dirposes))
+    mm.close()
+
+    return frames
+
+
+# --- OUT.ANI (xyz) ---
+ANI_KEYS = ['offset', 'natoms']
+
+
+def read_natoms_line(mm, pos):
+    """natoms if the line at pos is a number of atoms line else None"""
+    end = mm.find(b'\n', pos)
+    if end == -1:
+        return None
+    line = mm[pos:end].strip()
+    if not line.isdigit():
+        return None
+    return int(line)
+
+
+def scan_ani(mm, start=0, previous=None):
+    """offsets of each frame, natoms line followed by comment and atoms"""
+    offsets, numbers = [], []
+
+    size = len(mm)
+    pos, length = start, None
+    while pos < size:
+        natoms = read_natoms_line(mm, pos)
+        if natoms is None:
+            break
+        # frames mostly share the same byte length, try it before counting
+        end = -1
+        if length is not None and natoms == numbers[-1] and \
+                pos+length <= size and mm[pos+length-1:pos+length] == b'\n':
+            guess = pos + length
+            if guess == size or read_natoms_line(mm, guess) == natoms:
+                end = guess
+        if end == -1:
+            end = skip_lines(mm, pos, natoms+2)
+            if end == -1:
+                break # last frame is still being written
+        offsets.append(pos)
+        numbers.append(natoms)
+        pos, length = end, end - pos
+
+    results = {
+        'offset': np.array(offsets, dtype=np.int64),
+        'natoms': np.array(numbers, dtype=np.int64)
+    }
+
+    return results, pos
+
+
+def index_ani(ani='OUT.ANI'):
+    return index_file(ani, 'ani', scan_ani, ANI_KEYS)
+
+
+def read_ani(ani='OUT.ANI', selection=None):
+    """symbols and cartesian coordinates of selected frames"""
+    index = index_ani(ani)
+    indices = parse_selection(selection, len(index['offset']))
+
+    mm = open_mmap(ani)
+    frames = []
+    for i in indices:
+        natoms = int(index['natoms'][i])
+        pos = skip_lines(mm, index['offset'][i], 2)
+        end = skip_lines(mm, pos, natoms)
+        data = np.array(mm[pos:end].split()).reshape(natoms,-1)
+        symbols = [s.decode() for s in data[:,0]]
+        frames.append((symbols, data[:,1:4].astype(float)))
+    mm.close()
+
+    return frames
+
+
+# --- extended xyz, natoms line, comment line and atom lines as OUT.ANI ---
+XYZ_KEYS = ['offset', 'natoms']
+
+
+def index_xyz(xyz):
+    """frame offsets of an (extended) xyz, frames are counted not parsed"""
+    return index_file(xyz, 'xyz', scan_ani, XYZ_KEYS)
+
+
+def count_xyz(xyz):
+    return len(index_xyz(xyz)['offset'])
+
+
+def frame_ends(index):
+    """byte offset after each frame in an xyz index"""
+    return np.append(index['offset'][1:], index['end']).astype(np.int64)
+
+
+if __name__ == '__main__':
+    pass
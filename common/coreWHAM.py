@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+
+import numpy as np
+
+from coreTraj import index_file
+
+"""
+Author: Jiayan Xu
+Description:
+    WHAM and MBAR for umbrella sampling with harmonic restraints (PLUMED
+    RESTRAINT, 0.5*KAPPA*(x-AT)^2) in one or two collective variables.
+    Values in each COLVAR are indexed in a sidecar and only the appended part
+    is parsed when a window is extended. Both methods solve the same
+    self-consistent equations in log space, binned WHAM on the occupied bins
+    only and MBAR on all samples, accelerated by Anderson mixing and started
+    from the free energies of the previous run.
+"""
+
+# boltzmann constant per mol
+KB = {'kj': 0.0083144626, 'kcal': 0.0019872041}
+
+CHUNK = 100000 # points of which the bias of all windows is held at once
+
+
+# --- COLVAR ---
+COLVAR_KEYS = ['values']
+
+
+def decode_colvar(text, ncols=None):
+    """values of data lines, comment lines (#! FIELDS ...) are skipped"""
+    if '#' in text:
+        text = ''.join(line for line in text.splitlines(True) \
+                if not line.lstrip().startswith('#'))
+    nlines = text.count('\n')
+    if nlines == 0:
+        return np.zeros((0, ncols if ncols else 0))
+
+    values = np.fromstring(text, sep=' ')
+    if values.size % nlines != 0:
+        raise ValueError('Inconsistent number of columns in COLVAR.')
+
+    return values.reshape(nlines, -1)
+
+
+def scan_colvar(mm, start=0, previous=None):
+    """values of complete lines after the byte offset start"""
+    end = mm.rfind(b'\n') + 1
+    if end < start:
+        end = start
+
+    ncols = None
+    if previous is not None:
+        ncols = previous['values'].shape[1]
+    values = decode_colvar(mm[start:end].decode(), ncols)
+
+    results = {'values': values}
+
+    return results, end
+
+
+def index_colvar(colvar='COLVAR'):
+    return index_file(colvar, 'colvar', scan_colvar, COLVAR_KEYS)
+
+
+def read_metadata(metafile):
+    """
+    windows in lines of colvar, centers and kappas, e.g. 2D
+    d2900/colvar 0.29 0.10 200000.0 1000.0
+    paths are relative to the metafile
+    """
+    dirname = os.path.dirname(os.path.abspath(metafile))
+    windows = []
+    with open(metafile, 'r') as reader:
+        for line in reader:
+            data = line.split()
+            if not data or data[0].startswith('#'):
+                continue
+            ndim = (len(data) - 1) // 2
+            if ndim not in [1, 2] or len(data) != 1 + 2*ndim:
+                raise ValueError('Wrong window line %s.' %line.strip())
+            colvar = os.path.join(dirname, data[0])
+            centers = np.array(data[1:1+ndim], dtype=float)
+            kappas = np.array(data[1+ndim:], dtype=float)
+            windows.append((colvar, centers, kappas))
+
+    return windows
+
+
+# --- solver ---
+def logsumexp(a, axis=None):
+    amax = np.max(a, axis=axis, keepdims=True)
+    amax = np.where(np.isfinite(amax), amax, 0.)
+    s = np.log(np.sum(np.exp(a - amax), axis=axis, keepdims=True)) + amax
+
+    return np.squeeze(s, axis=axis)
+
+
+def reduced_bias(points, centers, kappas, beta):
+    """(nwindows, npoints) harmonic bias in kT"""
+    diffs = points[np.newaxis,:,:] - centers[:,np.newaxis,:]
+    return beta * 0.5 * np.sum(kappas[:,np.newaxis,:]*diffs**2, axis=2)
+
+
+def self_consistent_step(f, points, logweights, lnN, centers, kappas, beta):
+    """
+    one iteration of
+    f_k = -ln sum_m w_m exp(-u_km) / sum_l N_l exp(f_l - u_lm)
+    return new f with f_0 = 0 and ln of unbiased weights of points
+    """
+    lnp = np.empty(len(points))
+    lnz = np.full(len(centers), -np.inf)
+    for i in range(0, len(points), CHUNK):
+        u = reduced_bias(points[i:i+CHUNK], centers, kappas, beta)
+        lnp[i:i+CHUNK] = logweights[i:i+CHUNK] - \
+                logsumexp((lnN+f)[:,np.newaxis] - u, axis=0)
+        lnz = np.logaddexp(lnz, logsumexp(lnp[i:i+CHUNK] - u, axis=1))
+    fnew = -lnz
+
+    return fnew - fnew[0], lnp
+
+
+def solve(points, logweights, nsamples, centers, kappas, beta, f=None, \
+        tol=1e-7, maxiter=10000, history=10, verbose=False):
+    """
+    dimensionless free energies of windows by Anderson accelerated
+    iteration, points are bin centers weighted by counts (WHAM) or
+    samples with unit weights (MBAR)
+    """
+    nwindows = len(centers)
+    lnN = np.log(nsamples)
+    if f is None:
+        f = np.zeros(nwindows)
+    f = f - f[0]
+
+    fs, gs = [], []
+    for it in range(maxiter):
+        g, lnp = self_consistent_step(f, points, logweights, lnN, \
+                centers, kappas, beta)
+        residual = np.max(np.fabs(g - f))
+        if verbose and it % 100 == 0:
+            print('Iteration %d residual %.4e.' %(it, residual))
+        if residual < tol:
+            f = g
+            break
+
+        fs.append(f)
+        gs.append(g)
+        fs, gs = fs[-history:], gs[-history:]
+        fnew = g
+        if len(fs) > 1:
+            # least squares mixing of the latest iterations
+            R = np.array(gs) - np.array(fs)
+            dR, dG = np.diff(R, axis=0).T, np.diff(np.array(gs), axis=0).T
+            gamma = np.linalg.lstsq(dR, R[-1], rcond=None)[0]
+            fnew = g - np.dot(dG, gamma)
+            if not np.all(np.isfinite(fnew)):
+                fs, gs, fnew = [], [], g
+        f = fnew
+    else:
+        print('WHAM does not converge in %d iterations, residual %.4e.' \
+                %(maxiter, residual))
+
+    if verbose:
+        print('Converged in %d iterations.' %(it+1))
+
+    return f, lnp
+
+
+# --- grid ---
+def make_grid(samples, nbins, ranges=None):
+    """bin edges in each dimension, default from min to max of samples"""
+    edges = []
+    for d, nb in enumerate(nbins):
+        if ranges is not None:
+            low, high = ranges[d]
+        else:
+            low, high = np.min(samples[:,d]), np.max(samples[:,d])
+        edges.append(np.linspace(low, high, nb+1))
+
+    return edges
+
+
+def assign_grid(samples, edges):
+    """flat bin index of each sample, -1 if outside the grid"""
+    nbins = [len(e)-1 for e in edges]
+    inside = np.ones(len(samples), dtype=bool)
+    indices = []
+    for d, e in enumerate(edges):
+        i = np.searchsorted(e, samples[:,d], side='right') - 1
+        i[samples[:,d] == e[-1]] = len(e) - 2 # right edge is included
+        inside &= (i >= 0) & (i < len(e)-1)
+        indices.append(i.clip(0, len(e)-2))
+    flat = np.ravel_multi_index(indices, nbins)
+
+    return np.where(inside, flat, -1)
+
+
+def grid_centers(edges, flat):
+    """coordinates of bin centers of flat indices, (npoints, ndim)"""
+    nbins = [len(e)-1 for e in edges]
+    indices = np.unravel_index(flat, nbins)
+    centers = [0.5*(e[i]+e[i+1]) for e, i in zip(edges, indices)]
+
+    return np.array(centers).T
+
+
+# --- driver ---
+def load_windows(windows, columns):
+    """samples of collective variables and window of each sample"""
+    samples, owners = [], []
+    for k, (colvar, centers, kappas) in enumerate(windows):
+        values = index_colvar(colvar)['values'][:,columns]
+        if values.shape[1] != len(centers):
+            raise ValueError('%s has %d CVs but %d centers.' \
+                    %(colvar, values.shape[1], len(centers)))
+        samples.append(values)
+        owners.append(np.full(len(values), k))
+
+    return np.concatenate(samples), np.concatenate(owners)
+
+
+def load_state(statefile, windows):
+    """free energies of the previous run as a guess, new windows start at 0"""
+    if not os.path.exists(statefile):
+        return None
+
+    with open(statefile, 'r') as reader:
+        state = json.load(reader)
+    previous = dict(zip(state['colvars'], state['f']))
+
+    return np.array([previous.get(w[0], 0.) for w in windows])
+
+
+def save_state(statefile, windows, f):
+    with open(statefile, 'w') as writer:
+        json.dump({'colvars': [w[0] for w in windows], 'f': f.tolist()}, \
+                writer, indent=2)
+
+    return
+
+
+def compute_pmf(windows, nbins, columns=None, temperature=300., units='kj', \
+        method='wham', ranges=None, f=None, tol=1e-7, verbose=False):
+    """
+    free energy surface on the grid, inf in bins without samples,
+    return bin edges, pmf and dimensionless window free energies
+    """
+    ndim = len(windows[0][1])
+    if columns is None:
+        columns = list(range(1, ndim+1)) # first column is time
+    beta = 1. / (KB[units]*temperature)
+
+    centers = np.array([w[1] for w in windows])
+    kappas = np.array([w[2] for w in windows])
+    samples, owners = load_windows(windows, columns)
+
+    edges = make_grid(samples, nbins, ranges)
+    flat = assign_grid(samples, edges)
+    # windows only count samples on the grid
+    inside = flat >= 0
+    nsamples = np.bincount(owners[inside], minlength=len(windows))
+    if np.any(nsamples == 0):
+        raise ValueError('Windows without samples on the grid.')
+
+    # only occupied bins are stored
+    occupied, inverse, counts = np.unique(flat[inside], \
+            return_inverse=True, return_counts=True)
+    if method == 'wham':
+        points = grid_centers(edges, occupied)
+        logweights = np.log(counts)
+    elif method == 'mbar':
+        points = samples[inside]
+        logweights = np.zeros(len(points))
+    else:
+        raise ValueError('Unknown method %s.' %method)
+
+    f, lnp = solve(points, logweights, nsamples, centers, kappas, beta, \
+            f, tol, verbose=verbose)
+
+    if method == 'mbar':
+        # accumulate sample weights on the occupied bins
+        shift = np.max(lnp)
+        lnp = np.log(np.bincount(inverse, weights=np.exp(lnp-shift))) + shift
+
+    pmf = np.full(int(np.prod(nbins)), np.inf)
+    pmf[occupied] = -(lnp - np.max(lnp)) / beta
+    pmf = pmf.reshape(nbins)
+
+    return edges, pmf, f
+
+
+def write_pmf(pmffile, edges, pmf):
+    """
+    1D lines of coordinate and free energy, 2D blocks of x y free energy
+    separated by blank lines, read by plot_wham.read_whamdat
+    """
+    centers = [0.5*(e[1:]+e[:-1]) for e in edges]
+    if len(edges) == 1:
+        content = '#Coor Free\n'
+        for x, e in zip(centers[0], pmf):
+            content += '%12.6f %16.8f\n' %(x, e)
+    else:
+        content = '#X Y Free\n'
+        for i, x in enumerate(centers[0]):
+            for j, y in enumerate(centers[1]):
+                content += '%12.6f %12.6f %16.8f\n' %(x, y, pmf[i,j])
+            content += '\n'
+
+    with open(pmffile, 'w') as writer:
+        writer.write(content)
+
+    return
+
+
+if __name__ == '__main__':
+    pass
@@ -1,12 +1,34 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import io
 import os
+import time
+import argparse
 
 import numpy as np
 
 import ase.io
 from ase import Atoms, Atom
+from ase.io.extxyz import key_val_str_to_dict
+from ase.calculators.singlepoint import SinglePointCalculator
+
+from coreTraj import write_chunks, open_mmap, skip_lines, index_xyz, frame_ends
+
+# per-atom line, same as '{:<4s} '+'{:>12.6f} '*n but %-formatting is faster
+POS_FORMAT = '%-4s ' + '%12.6f '*3 + '\n'
+POSFOR_FORMAT = '%-4s ' + '%12.6f '*6 + '\n'
+
+
+def format_atoms(symbols, positions, forces=None):
+    """atom lines of a frame, formatted in one pass over plain lists"""
+    if forces is None:
+        return ''.join([POS_FORMAT %(s, *p) for s, p in \
+                zip(symbols, np.asarray(positions, dtype=float).tolist())])
+    else:
+        return ''.join([POSFOR_FORMAT %(s, *p, *f) for s, p, f in \
+                zip(symbols, np.asarray(positions, dtype=float).tolist(), \
+                np.asarray(forces, dtype=float).tolist())])
 
 
 def write_xyz(*args,**kwargs):
@@ -78,18 +100,136 @@ def write_xyz(*args,**kwargs):
         forces = kwargs['forces']
         comment_content += 'Properties=species:S:1:pos:R:3:forces:R:3\n'
         content += comment_content
-        for i in range(natoms):
-            content += ('{:<4s} '+'{:>12.6f} '*6+'\n')\
-                .format(symbols[i],*list(positions[i]),*list(forces[i]))
+        content += format_atoms(symbols, positions, forces)
     else:
         comment_content += 'Properties=species:S:1:pos:R:3\n'
         content += comment_content
-        for i in range(natoms):
-            content += ('{:<4s} '+'{:>12.6f} '*3+'\n')\
-                .format(symbols[i],*list(positions[i]))
+        content += format_atoms(symbols, positions)
 
     return content
 
 
+def write_xyz_frames(fname, frames, chunk_size=100, mode='w'):
+    """
+    write an iterable of frames (dicts of write_xyz arguments) to fname,
+    chunk_size frames are formatted and appended to the file at once
+    """
+    contents = (write_xyz(**frame) for frame in frames)
+    count = write_chunks(fname, contents, chunk_size, mode)
+
+    return count
+
+
+def read_frames(fname, indices=None):
+    """
+    atoms of frames at indices, only their bytes are parsed by seeking to
+    offsets in the xyz index and consecutive frames are parsed at once
+    """
+    index = index_xyz(fname)
+    offsets, ends = index['offset'], frame_ends(index)
+    if indices is None:
+        indices = np.arange(len(offsets))
+    indices = [int(i) for i in indices]
+
+    mm = open_mmap(fname)
+    frames, i = [], 0
+    while i < len(indices):
+        j = i
+        while j+1 < len(indices) and indices[j+1] == indices[j] + 1:
+            j += 1
+        text = mm[offsets[indices[i]]:ends[indices[j]]].decode()
+        frames.extend(ase.io.read(io.StringIO(text), ':', format='extxyz'))
+        i = j + 1
+    mm.close()
+
+    return frames
+
+
+def read_headers(fname, indices=None):
+    """natoms and info of comment lines of frames, atoms are not parsed"""
+    index = index_xyz(fname)
+    if indices is None:
+        indices = np.arange(len(index['offset']))
+
+    mm = open_mmap(fname)
+    headers = []
+    for i in indices:
+        pos = skip_lines(mm, index['offset'][i], 1)
+        comment = mm[pos:mm.find(b'\n', pos)].decode()
+        headers.append((int(index['natoms'][i]), key_val_str_to_dict(comment)))
+    mm.close()
+
+    return headers
+
+
+def read_symbols(fname, indices=None):
+    """chemical symbols of frames, the first column of atom lines"""
+    index = index_xyz(fname)
+    ends = frame_ends(index)
+    if indices is None:
+        indices = np.arange(len(index['offset']))
+
+    mm = open_mmap(fname)
+    symbols = []
+    for i in indices:
+        pos = skip_lines(mm, index['offset'][i], 2)
+        lines = mm[pos:ends[i]].split(b'\n')
+        symbols.append([line.split(None, 1)[0].decode() for line in lines if line.strip()])
+    mm.close()
+
+    return symbols
+
+
+def benchmark(nframes=50000, natoms=64, chunk_size=100):
+    """compare write_xyz_frames with ase.io.write on random frames"""
+    rng = np.random.default_rng(1)
+    symbols = ['Pt']*(natoms//2) + ['O']*(natoms-natoms//2)
+    lattice = np.eye(3)*10.
+
+    frames = []
+    for i in range(nframes):
+        frames.append({
+            'symbols': symbols, 'pbc': ['T','T','T'], 'Lattice': lattice,
+            'step': i+1, 'energy': rng.normal(), 'free_energy': rng.normal(),
+            'positions': rng.uniform(0., 10., (natoms,3)),
+            'forces': rng.normal(size=(natoms,3))
+        })
+
+    st = time.time()
+    write_xyz_frames('bench-core.xyz', frames, chunk_size)
+    t_core = time.time() - st
+
+    atoms_frames = []
+    for frame in frames:
+        atoms = Atoms(symbols, positions=frame['positions'], \
+                cell=lattice, pbc=True)
+        atoms.calc = SinglePointCalculator(atoms, energy=frame['energy'], \
+                free_energy=frame['free_energy'], forces=frame['forces'])
+        atoms_frames.append(atoms)
+
+    st = time.time()
+    ase.io.write('bench-ase.xyz', atoms_frames, format='extxyz')
+    t_ase = time.time() - st
+
+    print('{:<20s}{:>12s}{:>16s}'.format('writer', 'time (s)', 'frames/s'))
+    for name, t in zip(['write_xyz_frames', 'ase.io.write'], [t_core, t_ase]):
+        print('{:<20s}{:>12.2f}{:>16.1f}'.format(name, t, nframes/t))
+
+    for fname in ['bench-core.xyz', 'bench-ase.xyz']:
+        os.remove(fname)
+
+    return
+
+
 if __name__ == '__main__':
-    pass
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-b', '--benchmark', action='store_true', \
+            help='benchmark against ase.io.write')
+    parser.add_argument('-nf', '--nframes', type=int, default=50000, \
+            help='Number of Frames')
+    parser.add_argument('-na', '--natoms', type=int, default=64, \
+            help='Number of Atoms')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.nframes, args.natoms)
@@ -7,27 +7,13 @@ import numpy as np
 
 from ase.io import read, write
 
+from coreEval import rms_dict
+
 import matplotlib as mpl
 mpl.use('Agg') #silent mode
 from matplotlib import pyplot as plt
 
 
-def rms_dict(x_ref, x_pred):
-    """ Takes two datasets of the same shape and returns a dictionary containing RMS error data"""
-
-    x_ref = np.array(x_ref)
-    x_pred = np.array(x_pred)
-
-    if np.shape(x_pred) != np.shape(x_ref):
-        raise ValueError('WARNING: not matching shapes in rms')
-
-    error_2 = (x_ref - x_pred) ** 2
-
-    average = np.sqrt(np.average(error_2))
-    std_ = np.sqrt(np.var(error_2))
-
-    return {'rmse': average, 'std': std_}
-
 def energy_plot(ener_in, ener_out, ax, title='Plot of energy'):
     """ Plots the distribution of energy per atom on the output vs the input"""
     # check
@@ -71,7 +57,7 @@ def force_plot(in_force, out_force, ax, symbol='H', title='Plot of force'):
     ax.scatter(in_force, out_force)
 
     # get the appropriate limits for the plot
-    for_limits = np.array(in_force + out_force)
+    for_limits = np.concatenate((in_force, out_force), axis=None)
     flim = (for_limits.min() - 1, for_limits.max() + 1)
     ax.set_xlim(flim)
     ax.set_ylim(flim)
@@ -97,45 +83,6 @@ def calc_free_energy():
     pass
 
 
-def extract_energy_and_forces(atom_frames,calc=None,atomic=True):
-    """
-    Electronic free energy and Hellman-Feynman forces
-    """
-    energies_dft, forces_dft = [], {}
-    energies_gap, forces_gap = [], {}
-
-    for atoms in atom_frames: # free energy per atom
-        # basic info
-        symbols = atoms.get_chemical_symbols()
-        if atomic:
-            natoms = len(atoms)
-        else:
-            natoms = 1
-        # energy
-        free_energy = atoms.get_potential_energy(force_consistent=True) # electronic free energy
-        energies_dft.append(free_energy/natoms)
-        # force
-        forces = atoms.get_forces()
-        for sym, force in zip(symbols,forces):
-            if sym in forces_dft.keys():
-                forces_dft[sym].extend(force)
-            else:
-                forces_dft[sym] = list(force)
-        if calc:
-            # use quip to calculate gap predicted energy
-            atoms.set_calculator(calc)
-            free_energy = atoms.get_potential_energy(force_consistent=True) # electronic free energy
-            energies_gap.append(free_energy/natoms)
-            # force
-            forces = atoms.get_forces()
-            for sym, force in zip(symbols,forces):
-                if sym in forces_gap.keys():
-                    forces_gap[sym].extend(force)
-                else:
-                    forces_gap[sym] = list(force)
-
-    return forces_dft, forces_gap, energies_dft, energies_gap
-
 def read_arrays(datafile):
     with open(datafile, 'r') as reader:
         lines = reader.readlines()
@@ -11,40 +11,44 @@ from matplotlib import pyplot as plt
 
 from matplotlib import cm
 
+from coreWHAM import read_metadata, load_state, save_state, \
+        compute_pmf, write_pmf
+
+"""
+Author: Jiayan Xu
+Description:
+    Plot the free energy surface of path collective variable umbrella
+    sampling. The surface is read from a WHAM output or rebuilt from the
+    COLVAR of each window by coreWHAM.
+"""
+
+# kcal/mol or kJ/mol to eV
+EV = {'kcal': 23.061, 'kj': 96.485}
+
 
 def read_whamdat(whamdat):
-    nbins_x, nbins_y = 84, 8
-
-    fopen = open(whamdat, 'r')
-    line = fopen.readline() # first line of file
-    data = []
-    for i in range(nbins_x):
-        cur_data = []
-        for j in range(nbins_y):
-            line = fopen.readline()
-            if line:
-                cur_data.append(line.split()[:3])
-            else:
-                print('End of file.')
-                break
-        line = fopen.readline() # blank line
-        data.append(cur_data)
-    fopen.close()
+    """x, y and masked free energies, x blocks are separated by blank lines"""
+    with open(whamdat, 'r') as reader:
+        content = reader.read()
+
+    blocks = []
+    for block in content.split('\n\n'):
+        lines = [line.split()[:3] for line in block.split('\n') \
+                if line.strip() and not line.startswith('#')]
+        if lines:
+            blocks.append(lines)
+
+    nbins_y = len(blocks[0])
+    if len(blocks[-1]) != nbins_y:
+        print('End of file.')
+        blocks = blocks[:-1]
 
     # data
-    data = np.array(data, dtype=float)
+    data = np.array(blocks, dtype=float) # (nbins_x, nbins_y, 3)
 
-    X, Y, Z = [], [], []
-    for cur_data in data:
-        X.append(cur_data[0][0])
-        cur_z = []
-        for cur_row in cur_data:
-            cur_z.append(cur_row[2])
-        Z.append(cur_z)
-    Y = data[0][:,1]
-
-    X = np.array(X)
-    Z = np.array(Z).T
+    X = data[:,0,0]
+    Y = data[0,:,1]
+    Z = data[:,:,2].T
 
     mZ = np.ma.masked_equal(Z,np.inf)
     #Z = np.ma.array(Z, mask=mz.mask)
@@ -52,10 +56,10 @@ def read_whamdat(whamdat):
     return X, Y, mZ
 
 
-def plot_wham():
+def plot_wham(whamdat='us-new.csv', pic='f2d.png', units='kcal'):
     # read data
-    x, y, e = read_whamdat('us-new.csv')
-    e = e / 23.061 # kcal/mol2eV
+    x, y, e = read_whamdat(whamdat)
+    e = e / EV[units] # to eV
 
     # plot figure
     fig, ax = plt.subplots(nrows=1, ncols=1, figsize=(12,8))
@@ -73,43 +77,65 @@ def plot_wham():
     #        cmap=cm.get_cmap(cmap, len(levels)-1))
     cs = ax.contourf(x, y, e, 10)
 
-    cl = ax.contour(x, y, e, cs.levels, colors='k')
-    for c in cl.collections:
-        c.set_linestyle('solid')
+    cl = ax.contour(x, y, e, cs.levels, colors='k', linestyles='solid')
 
     # contour label
     ax.clabel(cl, fmt='%2.1f', colors='k', fontsize=14)
 
     # color bar
     cbar = fig.colorbar(cs)
-    cbar.ax.set_ylabel('Free Energy (kcal / mol)', fontsize=16)
+    cbar.ax.set_ylabel('Free Energy (eV)', fontsize=16)
 
     # find MFEP
-    paths = []
-    for i, e_row in enumerate(e.T):
-        p = 0
-        emin = 1e8
-        for j, cur_e in enumerate(e_row):
-            if cur_e < emin:
-                p = j
-        paths.append([x[i],y[p]])
-    paths = np.array(paths)
+    paths = np.array([x, y[np.ma.argmin(e, axis=0)]]).T
 
     ax.plot(paths[:,0], paths[:,1], linestyle='solid', color='k', linewidth=4)
 
-    plt.savefig('f2d.png')
+    plt.savefig(pic)
+
+def rebuild_pmf(metafile, whamdat, nbins, columns=None, temperature=300., \
+        units='kcal', method='wham', tol=1e-7):
+    """run WHAM or MBAR on windows in metafile and write whamdat"""
+    windows = read_metadata(metafile)
+    statefile = whamdat + '.json'
+    f = load_state(statefile, windows)
+
+    edges, pmf, f = compute_pmf(windows, nbins, columns, temperature, units, \
+            method, None, f, tol, verbose=True)
+    write_pmf(whamdat, edges, pmf)
+    save_state(statefile, windows, f)
+
+    print('Successfully write %s PMF of %d windows into %s.' \
+            %(method.upper(), len(windows), whamdat))
+
+    return edges, pmf
+
 
 if __name__ == '__main__':
-    '''
     parser = argparse.ArgumentParser()
 
     parser.add_argument('-f', '--datafile', \
-            default='PDOS_USER.dat', help='PDOS Data File')
+            default='us-new.csv', help='WHAM Data File')
     parser.add_argument('-o', '--out', \
-            default='DOS.png', help='DOS Figure')
+            default='f2d.png', help='FES Figure')
+    parser.add_argument('-m', '--metafile', \
+            default=None, help='Windows (colvar centers kappas), rebuild PMF')
+    parser.add_argument('-b', '--nbins', nargs='+', type=int, \
+            default=[84, 8], help='Number of Bins of Each CV')
+    parser.add_argument('-c', '--columns', nargs='+', type=int, \
+            default=None, help='CV Columns in COLVAR')
+    parser.add_argument('-t', '--temperature', type=float, \
+            default=300., help='Temperature')
+    parser.add_argument('-u', '--units', choices=['kcal', 'kj'], \
+            default='kcal', help='Energy Units of Kappas and PMF')
+    parser.add_argument('-me', '--method', choices=['wham', 'mbar'], \
+            default='wham', help='Solver')
 
     args = parser.parse_args()
-    '''
 
-    #read_whamdat('us.csv')
-    plot_wham()
+    if args.metafile:
+        rebuild_pmf(args.metafile, args.datafile, args.nbins, args.columns, \
+                args.temperature, args.units, args.method)
+
+    if len(args.nbins) == 2:
+        plot_wham(args.datafile, args.out, args.units)
@@ -2,8 +2,8 @@
 # -*- coding: utf-8 -*-
 
 import os
-import subprocess
 import shutil
+import argparse
 
 import copy
 
@@ -26,12 +26,28 @@ import ase.io
 import ase.io.dmol
 from ase.io.trajectory import Trajectory
 
+from coreLedger import load_ledger, run_jobs
+
+"""
+Author: Jiayan Xu
+Description:
+    Umbrella sampling of CO desorption by DFTB+ and PLUMED. Every distance is
+    a window directory, windows run concurrently within the core budget and
+    their states are kept in a ledger, so an interrupted run is resumed by
+    running the script again.
+"""
+
+DFTBPLUS = "/home/mmm0586/apps/dftbplus/release/master/install/bin/dftb+"
+COMMAND = "mpirun -n {ncores} %s 2>&1 > dftb.out" %DFTBPLUS
+
+KAPPA = 200000.0
+
 
 def write_plumed_dat(datPath, distance):
     content = "FLUSH STRIDE=1\n"
     content += "com1: COM ATOMS=1,2 MASS\n"
     content += "dis1: DISTANCE ATOMS=com1,16\n"
-    content += "res1: RESTRAINT ARG=dis1 AT=%f KAPPA=200000.0\n" %distance
+    content += "res1: RESTRAINT ARG=dis1 AT=%f KAPPA=%.1f\n" %(distance, KAPPA)
     content += "dis2: DISTANCE ATOMS=1,12\n"
     content += "dis3: DISTANCE ATOMS=1,8\n"
     content += "dis4: DISTANCE ATOMS=1,4\n"
@@ -75,42 +91,66 @@ def generate_initial_structure(genPath, atoms_in, distance):
     return
 
 
+def prepare_window(directoryPath, atoms_in, distance):
+    """window directory with dftb_in.hsd, geo_in.gen and plumed.dat"""
+    if os.path.exists(directoryPath):
+        shutil.move(directoryPath, directoryPath+'.bak')
+    os.makedirs(directoryPath)
+    print(directoryPath)
+    shutil.copyfile('./dftb_in.hsd', directoryPath+'/dftb_in.hsd')
+    genPath = os.path.join(directoryPath, 'geo_in.gen')
+    generate_initial_structure(genPath, atoms_in, distance)
+    write_plumed_dat(os.path.join(directoryPath, 'plumed.dat'), distance)
+
+    return
+
+
+def write_wham_meta(metaPath, windows):
+    """windows (colvar, center, kappa) for plot_wham -m"""
+    content = ''
+    for directoryPath, distance in windows:
+        content += '%s %.4f %.1f\n' %( \
+                os.path.join(directoryPath, 'colvar'), distance, KAPPA)
+
+    with open(metaPath, 'w') as writer:
+        writer.write(content)
+
+    return
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--distances', nargs=3, type=float, \
+            default=[0.29, 0.33, 5], help='start, stop and number of windows')
+    parser.add_argument('-n', '--ncores', type=int, \
+            default=2, help='total cores')
+    parser.add_argument('-np', '--cores_per_job', type=int, \
+            default=2, help='cores of each window')
+    parser.add_argument('-r', '--maxtries', type=int, \
+            default=2, help='attempts of each window')
+    parser.add_argument('-c', '--command', \
+            default=COMMAND, help='command template, {ncores} {name} {directory}')
+    parser.add_argument('-l', '--ledger', \
+            default='us.json', help='window ledger')
+    args = parser.parse_args()
+
     structureTemplatePath = './usTemp.xyz'
     atoms_in = ase.io.read(structureTemplatePath)
 
-    #us_frames = ase.io.read('./us.xyz', ':')
-    distances = np.linspace(0.29,0.33,5)
-    #print(len(us_frames))
+    start, stop, num = args.distances
+    distances = np.linspace(start, stop, int(num))
+
+    # only windows new to the ledger are (re)created
+    ledger = load_ledger(args.ledger)
+    windows, jobs = [], []
     for distance in distances:
         distance = round(distance, 2)
         directoryPath = 'd%4d' %(distance*10000)
-        if os.path.exists(directoryPath):
-            shutil.move(directoryPath, directoryPath+'.bak')
-            os.makedirs(directoryPath)
-            print(directoryPath)
-        else:
-            os.makedirs(directoryPath)
-            print(directoryPath)
-        shutil.copyfile('./dftb_in.hsd', directoryPath+'/dftb_in.hsd')
-        genPath = os.path.join(directoryPath, 'geo_in.gen')
-        generate_initial_structure(genPath, atoms_in, distance)
-        #distance = np.linalg.norm(pos1 - pos2)
-        write_plumed_dat(os.path.join(directoryPath, 'plumed.dat'), distance)
-        #print(distance)
-        #run_ase_plumed(atoms, potentialPath, directoryPath)
-        #subprocess.Popen("echo 'haha' > dftb.out", shell=True, cwd=directoryPath)
-        dftbPlus = "/home/mmm0586/apps/dftbplus/release/master/install/bin/dftb+"
-        command = "mpirun -n 2 %s 2>&1 > dftb.out" %dftbPlus
-        print(command)
-        proc = subprocess.Popen(command, \
-                shell=True, cwd=directoryPath)
-
-        errorcode = proc.wait()
-        if errorcode:
-            path = os.path.abspath(self.directory)
-            msg = ('Calculator "{}" failed with command "{}" failed in '
-                   '{} with error code {}'.format('dftb+', command,
-                                                  path, errorcode))
-            print(msg)
-
+        if directoryPath not in ledger['jobs'].keys():
+            prepare_window(directoryPath, atoms_in, distance)
+        windows.append((directoryPath, distance))
+        jobs.append((directoryPath, directoryPath, args.command))
+    write_wham_meta('wham.meta', windows)
+
+    ledger = run_jobs(jobs, args.ledger, args.ncores, args.cores_per_job, \
+            args.maxtries)
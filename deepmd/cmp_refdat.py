@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
+import sys
 import argparse
 import pickle 
 
@@ -8,34 +10,23 @@ import numpy as np
 
 from ase.io import read, write 
 
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from coreEval import rms_dict, deepmd_predictor, evaluate_dataset, \
+        error_metrics, print_metrics, group_forces
+
 import matplotlib as mpl
 mpl.use('Agg') #silent mode
 from matplotlib import pyplot as plt
 
 
-def rms_dict(x_ref, x_pred):
-    """ Takes two datasets of the same shape and returns a dictionary containing RMS error data"""
-
-    x_ref = np.array(x_ref)
-    x_pred = np.array(x_pred)
-
-    if np.shape(x_pred) != np.shape(x_ref):
-        raise ValueError('WARNING: not matching shapes in rms')
-
-    error_2 = (x_ref - x_pred) ** 2
-
-    average = np.sqrt(np.average(error_2))
-    std_ = np.sqrt(np.var(error_2))
-
-    return {'rmse': average, 'std': std_}
-
 def energy_plot(ener_in, ener_out, ax, title='Plot of energy'):
     """ Plots the distribution of energy per atom on the output vs the input"""
     # scatter plot of the data
     ax.scatter(ener_in, ener_out)
 
     # get the appropriate limits for the plot
-    for_limits = np.array(ener_in +ener_out)
+    for_limits = np.concatenate((ener_in, ener_out), axis=None)
     elim = (for_limits.min() - 0.05, for_limits.max() + 0.05)
     ax.set_xlim(elim)
     ax.set_ylim(elim)
@@ -67,7 +58,7 @@ def force_plot(in_force, out_force, ax, symbol='H', title='Plot of force'):
     ax.scatter(in_force, out_force)
 
     # get the appropriate limits for the plot
-    for_limits = np.array(in_force + out_force)
+    for_limits = np.concatenate((in_force, out_force), axis=None)
     flim = (for_limits.min() - 1, for_limits.max() + 1)
     ax.set_xlim(flim)
     ax.set_ylim(flim)
@@ -89,53 +80,13 @@ def force_plot(in_force, out_force, ax, symbol='H', title='Plot of force'):
         verticalalignment='bottom')
 
 
-def extract_energy_and_forces(atom_frames,calc=None,atomic=True):
-    """
-    Electronic free energy and Hellman-Feynman forces
-    """
-    energies_dft, forces_dft = [], {}
-    energies_gap, forces_gap = [], {}
-
-    for atoms in atom_frames: # free energy per atom
-        # basic info
-        symbols = atoms.get_chemical_symbols()
-        if atomic:
-            natoms = len(atoms)
-        else:
-            natoms = 1
-        # energy
-        free_energy = atoms.get_potential_energy(force_consistent=True) # electronic free energy
-        energies_dft.append(free_energy/natoms)
-        # force
-        forces = atoms.get_forces()
-        for sym, force in zip(symbols,forces):
-            if sym in forces_dft.keys():
-                forces_dft[sym].extend(force)
-            else:
-                forces_dft[sym] = list(force)
-        if calc:
-            # use quip to calculate gap predicted energy
-            atoms.set_calculator(calc)
-            free_energy = atoms.get_potential_energy(force_consistent=True) # electronic free energy
-            energies_gap.append(free_energy/natoms)
-            # force
-            forces = atoms.get_forces()
-            for sym, force in zip(symbols,forces):
-                if sym in forces_gap.keys():
-                    forces_gap[sym].extend(force)
-                else:
-                    forces_gap[sym] = list(force)
-
-    return forces_dft, forces_gap, energies_dft, energies_gap
-
-
 if __name__ == '__main__':
     # parser
     parser = argparse.ArgumentParser()
 
     parser.add_argument(
         '-t', '--train', 
-        default='evaluated.xyz', help='trained structures in xyz format'
+        default='evaluated.xyz', help='trained structures in xyz or frame store'
     )
     parser.add_argument(
         '-c', '--calc', action='store_true', 
@@ -145,34 +96,33 @@ if __name__ == '__main__':
         '-g', '--graph', 
         default='graph.pb', help='deep potential'
     )
+    parser.add_argument(
+        '-s', '--symbol', 
+        default='Cu', help='element of the force plot'
+    )
+    parser.add_argument(
+        '-b', '--batchsize', type=int, 
+        default=100, help='frames predicted at once'
+    )
 
     args = parser.parse_args()
 
-    # calculate using dp 
+    # calculate using dp, predictions are cached next to the dataset,
+    # reference energies are potential energies as before
     if args.calc:
-        frames = read(args.train, ':')
-
-        from deepmd.calculator import DP 
-        calc = DP(
-            model = args.graph, 
-            #type_dict = {"O": 1, "Zn": 2, "Cr": 0}
+        references, predictions = evaluate_dataset(
+            args.train, args.graph, deepmd_predictor, (args.graph,), \
+            args.batchsize, free_energy=False
         )
-        data_dict = {'ener': [[],[]], 'force': [[],[]]}
-        for atoms in frames:
-            natoms = len(atoms) 
-            energy = atoms.get_potential_energy() / natoms
-            forces = atoms.get_forces() 
-            data_dict['ener'][0].append(energy)
-            data_dict['force'][0].extend(forces.flatten().tolist())
-            # calculation 
-            calc.reset() 
-            atoms.calc = calc 
-            energy = atoms.get_potential_energy() / natoms
-            forces = atoms.get_forces()
-            data_dict['ener'][1].append(energy)
-            data_dict['force'][1].extend(forces.flatten().tolist())
-            #print(dp_data)
-        #print(tot_dat)
+        print_metrics(error_metrics(references, predictions), args.train)
+
+        data_dict = {
+            'ener': [
+                references['energies']/references['natoms'],
+                predictions['energies']/predictions['natoms']
+            ],
+            'force': [group_forces(references), group_forces(predictions)]
+        }
 
         with open('prop.pkl', 'wb') as fopen:
             pickle.dump(data_dict, fopen)
@@ -183,8 +133,9 @@ if __name__ == '__main__':
             tot_data = pickle.load(fopen)
         ener_dat = tot_data['ener']
         force_dat = tot_data['force']
-        force_dat[0] = {'Cu': force_dat[0]}
-        force_dat[1] = {'Cu': force_dat[1]}
+        # prop.pkl of older versions has flat force lists of one element
+        if not isinstance(force_dat[0], dict):
+            force_dat = [{args.symbol: force_dat[0]}, {args.symbol: force_dat[1]}]
     
         # plot
         fig, axarr = plt.subplots(
@@ -202,8 +153,7 @@ if __name__ == '__main__':
         )
         force_plot(
             force_dat[0], force_dat[1], 
-            axarr[1], 'Cu', 'Force on training data - Cu'
+            axarr[1], args.symbol, 'Force on training data - %s' %args.symbol
         )
 
         plt.savefig('benchmark.png')
-
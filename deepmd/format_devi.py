@@ -1,31 +1,235 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import numpy as np 
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 
-with open('model_devi.out') as fopen:
-    lines = fopen.readlines() 
+import numpy as np
 
-nsteps = len(lines) - 1 # the first line is comment 
-print('number of steps %d' %nsteps)
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from coreTraj import open_mmap, index_file
 
-devi_stat = [] # max_devi_e, min_devi_e, avg_devi_e, ...
-atomic_devi = []
-for i in range(1,nsteps+1):
-    data = lines[i].strip().split() 
-    print(len(data))
-    devi_stat.append(data[1:7])
-    atomic_devi.append(data[7:])
+"""
+Author: Jiayan Xu
+Description:
+    Model deviation analysis of DeePMD explorations. Statistics columns of
+    model_devi.out are decoded in chunks and kept in a sidecar index, so an
+    exploration still running only parses its new lines. Frames are classified
+    by the max force deviation into accurate, candidate and failed with array
+    masks and the candidates of each run are written next to its model_devi.
+"""
 
-assert len(devi_stat) == len(atomic_devi) 
+DEVI_KEYS = ['values']
 
-devi_stat = np.array(devi_stat, dtype=np.float32)
-print(devi_stat.shape)
-atomic_devi = np.array(atomic_devi, dtype=np.float32)
-print(atomic_devi.shape)
-atomic_devi = np.reshape(atomic_devi, (nsteps,-1))
-print(atomic_devi)
+# step max_devi_v min_devi_v avg_devi_v max_devi_f min_devi_f avg_devi_f
+DEVI_NAMES = [
+    'step', 'max_devi_v', 'min_devi_v', 'avg_devi_v',
+    'max_devi_f', 'min_devi_f', 'avg_devi_f'
+]
+
+CHUNK = 2**24 # bytes decoded at once
+
+
+def read_devi_names(mm):
+    """
+    names of statistics columns in the comment line, up to avg_devi_f
+    without atm_devi_f(N) of per-atom deviations, default ones without it
+    """
+    if mm[:1] != b'#':
+        return DEVI_NAMES
+    names = mm[1:mm.find(b'\n')].decode().split()
+    if 'avg_devi_f' in names:
+        names = names[:names.index('avg_devi_f')+1]
+
+    return [name for name in names if not name.startswith('atm_devi_f')]
+
+
+def decode_devi(text, ncols):
+    """
+    first ncols columns of data lines, per-atom deviations after the
+    statistics are dropped, comment lines of restarts are skipped
+    """
+    if '#' in text:
+        text = ''.join(line for line in text.splitlines(True) \
+                if not line.lstrip().startswith('#'))
+    nlines = text.count('\n')
+    if nlines == 0:
+        return np.zeros((0, ncols if ncols else 0))
+
+    values = np.fromstring(text, sep=' ')
+    if values.size % nlines != 0:
+        raise ValueError('Inconsistent number of columns in model_devi.')
+
+    return values.reshape(nlines, -1)[:,:ncols]
+
+
+def scan_devi(mm, start=0, previous=None):
+    """statistics of complete lines after the byte offset start"""
+    names = read_devi_names(mm)
+    ncols = len(names)
+
+    chunks = [np.zeros((0, ncols))]
+    pos, end = start, mm.rfind(b'\n') + 1
+    while pos < end:
+        # chunks end at line ends
+        stop = mm.rfind(b'\n', pos, min(pos+CHUNK, end)) + 1
+        if stop <= pos:
+            stop = end
+        chunks.append(decode_devi(mm[pos:stop].decode(), ncols))
+        pos = stop
+
+    results = {
+        'names': np.array(names),
+        'values': np.concatenate(chunks)
+    }
+
+    return results, max(end, start)
+
+
+def index_devi(devi='model_devi.out'):
+    return index_file(devi, 'model_devi_stats', scan_devi, DEVI_KEYS)
+
+
+def read_devi(devi='model_devi.out'):
+    """column names and statistics (nsteps, ncols)"""
+    index = index_devi(devi)
+
+    return [str(name) for name in index['names']], index['values']
+
+
+def read_atomic_devi(devi='model_devi.out', indices=None):
+    """per-atom force deviations (nframes, natoms) of frames in indices"""
+    names, values = read_devi(devi)
+    ncols = len(names)
+    if indices is None:
+        indices = np.arange(len(values))
+    indices = np.asarray(indices)
+
+    mm = open_mmap(devi)
+    rows, nlines = [], 0
+    pos, end = 0, mm.rfind(b'\n') + 1
+    while pos < end:
+        stop = mm.rfind(b'\n', pos, min(pos+CHUNK, end)) + 1
+        if stop <= pos:
+            stop = end
+        data = decode_devi(mm[pos:stop].decode(), None)
+        selected = indices[(indices >= nlines) & (indices < nlines+len(data))]
+        if len(selected) > 0:
+            rows.append(data[selected-nlines, ncols:])
+        nlines += len(data)
+        pos = stop
+    mm.close()
+
+    if not rows:
+        return np.zeros((0, 0))
+
+    return np.concatenate(rows)
+
+
+def select_frames(max_devi_f, trust_lo=0.05, trust_hi=0.15):
+    """frame indices of accurate, candidate and failed by max_devi_f"""
+    accurate = max_devi_f < trust_lo
+    failed = max_devi_f >= trust_hi
+    candidate = ~(accurate | failed)
+
+    selected = {
+        'accurate': np.flatnonzero(accurate),
+        'candidate': np.flatnonzero(candidate),
+        'failed': np.flatnonzero(failed)
+    }
+
+    return selected
+
+
+def analyze_run(devi='model_devi.out', trust_lo=0.05, trust_hi=0.15, \
+        nmax=None, seed=None, selfile='candidate.dat'):
+    """
+    classify frames of one run and write the candidates (index, step and
+    max_devi_f) next to model_devi, at most nmax randomly chosen ones
+    """
+    names, values = read_devi(devi)
+    if 'max_devi_f' not in names:
+        raise ValueError('No max_devi_f in %s.' %devi)
+    max_devi_f = values[:,names.index('max_devi_f')]
+
+    selected = select_frames(max_devi_f, trust_lo, trust_hi)
+    candidates = selected['candidate']
+    if nmax is not None and len(candidates) > nmax:
+        rng = np.random.default_rng(seed)
+        candidates = np.sort(rng.choice(candidates, nmax, replace=False))
+
+    content = '# index step max_devi_f\n'
+    content += ''.join('%d %d %.6f\n' %(i, values[i,0], max_devi_f[i]) \
+            for i in candidates)
+    with open(os.path.join(os.path.dirname(os.path.abspath(devi)), selfile), \
+            'w') as writer:
+        writer.write(content)
+
+    counts = {key: len(value) for key, value in selected.items()}
+    counts['selected'] = len(candidates)
+
+    return counts
+
+
+def analyze_runs(devis, trust_lo=0.05, trust_hi=0.15, nmax=None, seed=None, \
+        njobs=1):
+    """analyze many runs in a process pool, counts in the input order"""
+    nruns = len(devis)
+    args = (devis, [trust_lo]*nruns, [trust_hi]*nruns, [nmax]*nruns, \
+            [seed]*nruns)
+    if njobs > 1:
+        with ProcessPoolExecutor(max_workers=njobs) as executor:
+            results = list(executor.map(analyze_run, *args))
+    else:
+        results = list(map(analyze_run, *args))
+
+    return results
+
+
+def write_summary(sumfile, devis, results):
+    """counts and ratios of frames of each run"""
+    content = '{:<40s}{:>10s}{:>10s}{:>10s}{:>10s}{:>10s}\n'.format(
+        '# run', 'nframes', 'accurate', 'candidate', 'failed', 'selected'
+    )
+    for devi, counts in zip(devis, results):
+        nframes = counts['accurate'] + counts['candidate'] + counts['failed']
+        content += '{:<40s}{:>10d}{:>10.4f}{:>10.4f}{:>10.4f}{:>10d}\n'.format(
+            devi, nframes, counts['accurate']/max(nframes,1),
+            counts['candidate']/max(nframes,1), counts['failed']/max(nframes,1),
+            counts['selected']
+        )
+
+    with open(sumfile, 'w') as writer:
+        writer.write(content)
+
+    return
 
 
 if __name__ == '__main__':
-    pass
+    parser = argparse.ArgumentParser(
+        description='select candidates by model deviation'
+    )
+    parser.add_argument('DEVIS', nargs='*', default=['model_devi.out'], \
+            help='model_devi.out of runs')
+    parser.add_argument('-lo', '--trust_lo', type=float, default=0.05, \
+            help='lower trust level of max_devi_f')
+    parser.add_argument('-hi', '--trust_hi', type=float, default=0.15, \
+            help='higher trust level of max_devi_f')
+    parser.add_argument('-n', '--nmax', type=int, default=None, \
+            help='max number of candidates of each run')
+    parser.add_argument('-s', '--seed', type=int, default=None, \
+            help='random seed of choosing candidates')
+    parser.add_argument('-nj', '--njobs', type=int, default=1, \
+            help='number of processes')
+    parser.add_argument('-o', '--output', default='devi_summary.dat', \
+            help='summary of runs')
+    args = parser.parse_args()
+
+    results = analyze_runs(args.DEVIS, args.trust_lo, args.trust_hi, \
+            args.nmax, args.seed, args.njobs)
+    write_summary(args.output, args.DEVIS, results)
+    print('Successfully analyze %d runs, summary in %s.' \
+            %(len(args.DEVIS), args.output))
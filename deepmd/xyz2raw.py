@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
 import json
 import argparse
 
@@ -13,11 +14,15 @@ from tqdm import tqdm
 
 import dpdata 
 
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from coreStore import read_frames
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument(
         '-df', '--datafile', 
-        default='data.xyz', help='time series files'
+        default='data.xyz', help='xyz file or frame store'
     )
     parser.add_argument(
         '-ej', '--enjson', 
@@ -35,7 +40,7 @@ if __name__ == '__main__':
 
     # sanity check, dpdata only needs species, pos, Z, force, virial 
     # ase-extxyz is inconsistent with quip-xyz, especially the force 
-    frames = read(args.datafile, ':')
+    frames = read_frames(args.datafile)
     print('number of frames ', len(frames))
 
     atomic_properties = ['numbers', 'positions', 'forces']
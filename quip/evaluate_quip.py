@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
+import sys
 import argparse
 
 import numpy as np
@@ -10,8 +12,18 @@ from ase import Atom, Atoms
 
 from ase.optimize import BFGS
 
-from quippy.potential import Potential
-from quippy import descriptors
+from ase.calculators.emt import EMT
+
+# EMT stands in for GAP when QUIP is not installed
+try:
+    from quippy.potential import Potential
+except ImportError:
+    Potential = None
+
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from coreEval import rms_dict, calculator_predictor, evaluate_dataset, \
+        error_metrics, print_metrics, group_forces
 
 import matplotlib as mpl
 mpl.use('Agg') #silent mode
@@ -21,29 +33,13 @@ from matplotlib import pyplot as plt
 # quip E=T F=T atoms_filename=validate.xyz param_filename=GAP.xml | grep AT | sed 's/AT//' > quip_validate.xyz
 
 
-def rms_dict(x_ref, x_pred):
-    """ Takes two datasets of the same shape and returns a dictionary containing RMS error data"""
-
-    x_ref = np.array(x_ref)
-    x_pred = np.array(x_pred)
-
-    if np.shape(x_pred) != np.shape(x_ref):
-        raise ValueError('WARNING: not matching shapes in rms')
-
-    error_2 = (x_ref - x_pred) ** 2
-
-    average = np.sqrt(np.average(error_2))
-    std_ = np.sqrt(np.var(error_2))
-
-    return {'rmse': average, 'std': std_}
-
 def energy_plot(ener_in, ener_out, ax, title='Plot of energy'):
     """ Plots the distribution of energy per atom on the output vs the input"""
     # scatter plot of the data
     ax.scatter(ener_in, ener_out)
 
     # get the appropriate limits for the plot
-    for_limits = np.array(ener_in +ener_out)
+    for_limits = np.concatenate((ener_in, ener_out), axis=None)
     elim = (for_limits.min() - 0.05, for_limits.max() + 0.05)
     ax.set_xlim(elim)
     ax.set_ylim(elim)
@@ -75,7 +71,7 @@ def force_plot(in_force, out_force, ax, symbol='H', title='Plot of force'):
     ax.scatter(in_force, out_force)
 
     # get the appropriate limits for the plot
-    for_limits = np.array(in_force + out_force)
+    for_limits = np.concatenate((in_force, out_force), axis=None)
     flim = (for_limits.min() - 1, for_limits.max() + 1)
     ax.set_xlim(flim)
     ax.set_ylim(flim)
@@ -101,44 +97,33 @@ def calc_free_energy():
     pass
 
 
-def extract_energy_and_forces(atom_frames,calc=None,atomic=True):
+def gap_predictor(gap, emt=False):
+    """predictor by GAP, or by EMT if asked or QUIP is unavailable"""
+    if emt or Potential is None:
+        return calculator_predictor(EMT())
+    return calculator_predictor(Potential(param_filename=gap))
+
+
+def evaluate_gap(dataset, gap, batchsize=100, use_cache=True, njobs=1, \
+        emt=False):
     """
-    Electronic free energy and Hellman-Feynman forces
+    energies per atom and element forces of references and GAP,
+    frames are sharded over njobs workers each loading GAP once
     """
-    energies_dft, forces_dft = [], {}
-    energies_gap, forces_gap = [], {}
-
-    for atoms in atom_frames: # free energy per atom
-        # basic info
-        symbols = atoms.get_chemical_symbols()
-        if atomic:
-            natoms = len(atoms)
-        else:
-            natoms = 1
-        # energy
-        free_energy = atoms.get_potential_energy(force_consistent=True) # electronic free energy
-        energies_dft.append(free_energy/natoms)
-        # force
-        forces = atoms.get_forces()
-        for sym, force in zip(symbols,forces):
-            if sym in forces_dft.keys():
-                forces_dft[sym].extend(force)
-            else:
-                forces_dft[sym] = list(force)
-        if calc:
-            # use quip to calculate gap predicted energy
-            atoms.set_calculator(calc)
-            free_energy = atoms.get_potential_energy(force_consistent=True) # electronic free energy
-            energies_gap.append(free_energy/natoms)
-            # force
-            forces = atoms.get_forces()
-            for sym, force in zip(symbols,forces):
-                if sym in forces_gap.keys():
-                    forces_gap[sym].extend(force)
-                else:
-                    forces_gap[sym] = list(force)
-
-    return forces_dft, forces_gap, energies_dft, energies_gap
+    if Potential is None and not emt:
+        print('QUIP is not installed, use EMT instead of GAP.')
+        emt = True
+    references, predictions = evaluate_dataset(
+        dataset, gap, gap_predictor, (gap, emt), batchsize, \
+        use_cache and not emt, njobs
+    )
+    print_metrics(error_metrics(references, predictions), dataset)
+
+    energies_vasp = references['energies'] / references['natoms']
+    energies_gap = predictions['energies'] / predictions['natoms']
+
+    return group_forces(references), group_forces(predictions), \
+            energies_vasp, energies_gap
 
 
 if __name__ == '__main__':
@@ -146,29 +131,32 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
 
     parser.add_argument('-t', '--train', \
-            default='PDOS_USER.dat', help='PDOS Data File')
+            default='train.xyz', help='training structures in xyz or frame store')
     parser.add_argument('-v', '--valid', \
-            default='DOS.png', help='DOS Figure')
+            default='validate.xyz', help='validation structures in xyz or frame store')
     parser.add_argument('-g', '--gap', \
-            default='DOS.png', help='DOS Figure')
+            default='GAP.xml', help='GAP potential')
+    parser.add_argument('-s', '--symbol', \
+            default='Pt', help='element of force plots')
+    parser.add_argument('-b', '--batchsize', type=int, \
+            default=100, help='frames predicted at once')
+    parser.add_argument('-nj', '--njobs', type=int, \
+            default=1, help='number of processes')
+    parser.add_argument('--nocache', action='store_true', \
+            help='do not use or write cached predictions')
+    parser.add_argument('--emt', action='store_true', \
+            help='predict by EMT, a stand-in of GAP for tests')
 
     args = parser.parse_args()
 
-    # read structures
-    #train_frames = ase.io.read('./train.xyz', ':')
-    #valid_frames = ase.io.read('./validate.xyz', ':')
-    #gap = Potential(param_filename='./GAP.xml')
-
-    train_frames = ase.io.read(args.train, ':')
-    valid_frames = ase.io.read(args.valid, ':')
-    gap = Potential(param_filename=args.gap)
-
-    # read energy using vasp
+    # read energy using vasp and predict by gap, cached next to datasets
     train_forces_vasp, train_forces_gap, train_energies_vasp, train_energies_gap = \
-            extract_energy_and_forces(train_frames,calc=gap)
+            evaluate_gap(args.train, args.gap, args.batchsize, not args.nocache, \
+            args.njobs, args.emt)
     
     valid_forces_vasp, valid_forces_gap, valid_energies_vasp, valid_energies_gap = \
-            extract_energy_and_forces(valid_frames,calc=gap)
+            evaluate_gap(args.valid, args.gap, args.batchsize, not args.nocache, \
+            args.njobs, args.emt)
     
     # plot
     fig, axarr = plt.subplots(nrows=2, ncols=2, \
@@ -183,8 +171,8 @@ if __name__ == '__main__':
     energy_plot(valid_energies_vasp, valid_energies_gap, \
             axarr[1], 'Energy on validate data')
     force_plot(train_forces_vasp, train_forces_gap, 
-            axarr[2], 'Pt', 'Force on training data - Pt')
+            axarr[2], args.symbol, 'Force on training data - %s' %args.symbol)
     force_plot(valid_forces_vasp, valid_forces_gap, 
-            axarr[3], 'Pt', 'Force on validate data - Pt')
+            axarr[3], args.symbol, 'Force on validate data - %s' %args.symbol)
 
     plt.savefig('error-jx.png')
@@ -18,12 +18,17 @@
 #       }
 
 import os
+import sys
 import subprocess
 
 import argparse
 
 import ase.io
 
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from coreStore import read_frames
+
 """
 This is a gap_fit wrapper for quickly generating the gap_fit command.
 """
@@ -165,12 +170,13 @@ if __name__ == '__main__':
     parser.add_argument('-m', '--mode', \
             default='com', help='mode')
     parser.add_argument('-d', '--dat', \
-            default='sampled_structures.xyz', help='datafile in total')
+            default='sampled_structures.xyz', \
+            help='datafile in total, xyz or frame store')
 
     args = parser.parse_args()
 
     # k-fold
-    total_frames = ase.io.read(args.dat, ':')
+    total_frames = read_frames(args.dat)
     from sklearn.model_selection import KFold
     kf = KFold(n_splits=5, shuffle=True, random_state=42)
     for i in kf.split(total_frames):
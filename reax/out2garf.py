@@ -10,6 +10,11 @@ import argparse
 import numpy as np
 from scipy import integrate
 
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from coreOUTCAR import read_trajectory
+from corePBC import unwrap_cartesian
+
 pi = np.pi
 
 norm = np.linalg.norm
@@ -24,55 +29,6 @@ description=r"""
 Author: Jiayan Xu, jxu15@qub.ac.uk
 """
 
-def read_outcar(outcar='OUTCAR', natoms=100 , nframes=1000, wdat=False):
-    # check file existence
-    if not os.path.exists(outcar):
-        raise ValueError('%s doesnot exist.' %outcar)
-
-    # read OUTCAR
-    frames = []
-    energies = []
-    fopen = open(outcar, 'r')
-    count, flag = 0, True
-    while flag:
-        line = fopen.readline()
-        if line.startswith(' POSITION'):
-            fopen.readline() # segment line ---...---
-            poses, forces = [], []
-            for n in range(natoms):
-                data = fopen.readline().strip().split()
-                poses.append(data[:3]) # x y z
-                forces.append(data[3:]) # fx fy fz
-            poses = np.array(poses, dtype=float)
-            forces = np.array(forces, dtype=float)
-            frames.append((poses, forces))
-        if line.startswith('  FREE ENERGIE'):
-            fopen.readline() # segment line ---...---
-            fopen.readline() # free energy TOTEN
-            fopen.readline() # blank line
-            data = fopen.readline()
-            energies.append(data.strip().split()[-1])
-            count += 1
-        if count == nframes:
-            flag = False
-    fopen.close()
-    print('Successfully read %s, get positions, forces, energies ...' %outcar)
-
-    energies = np.array(energies, dtype=float)
-    
-    # out datfile ?
-    '''
-    for i, d in enumerate(data):
-        content = '#\n'
-        for j in range(nsteps):
-            pos, force = data[i][0][j], data[i][1][j]
-            content += ('{:<12.4f}'*6+'\n').format(*pos, *force)
-        with open('atom-'+str(i+1)+'.dat', 'w') as writer:
-            writer.write(content)
-        break
-    '''
-    return frames, energies
-
 def read_poscar(poscar='POSCAR', format='vasp5'):
     """read POSCAR"""
     # check file existence
@@ -160,17 +116,6 @@ def calc_trans(lattice):
             [np.cross(b,c),np.cross(c,a),np.cross(a,b)])
     return lx, ly, lz, alpha, beta, gamma, trans_matrix
 
-def adjust_poses(poses, refposes):
-    """poses, poses_ref should be in direct"""
-    # atoms, take last step as reference
-    for i in range(len(poses)):
-        for x in range(3):
-            move = round(poses[i][x] - refposes[i][x], 0)
-            poses[i][x] -= move
-    refposes = poses.copy()
-
-    return poses, refposes
-
 def write_trainsetin(names, energies, refname):
     EVTOKCAM = 23.061
     content = 'ENERGY 100.0\n'
@@ -194,17 +139,10 @@ def out2garf(outcar='OUTCAR', poscar='POSCAR', nframes=100, intv=5,\
     lx, ly, lz, alpha, beta, gamma, trans_matrix = calc_trans(lattice)
     
     # read OUTCAR
-    frames, energies = read_outcar(outcar, natoms, nframes)
+    frames, forces, energies = read_trajectory(outcar, natoms, nframes)
 
     # adjust positiosn and get cartesian coordinates
-    dirposes = []
-    cartposes = []
-    for frame in frames:
-        dirpos = dot(frame[0], inv(lattice.T))
-        dirpos, refpos = adjust_poses(dirpos, refpos)
-        dirposes.append(dirpos)
-        cartposes.append(dot(dirpos, lattice))
-    cartposes = np.array(cartposes)
+    cartposes = unwrap_cartesian(frames, lattice, refpos)
 
     # write geo
     names = []
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import shutil
+import importlib.util
+
+import pytest
+
+"""
+Author: Jiayan Xu
+Description:
+    Regression of vasp/enmd/calc_thfo.py against ffff.dat written by the
+    frame-by-frame implementation on a synthetic CO on Pt trajectory (24
+    steps), for a C-O distance and a combination of C-O and O-Pt distances.
+    fort_wrapped.129 is the same trajectory with C wrapped by lattice vectors
+    in some steps, the minimum image gives the unwrapped gradients.
+"""
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(REPO, 'tests', 'data', 'thfo')
+
+sys.path.insert(0, os.path.join(REPO, 'common'))
+spec = importlib.util.spec_from_file_location(
+    'calc_thfo', os.path.join(REPO, 'vasp', 'enmd', 'calc_thfo.py')
+)
+calc_thfo = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(calc_thfo)
+
+ReactCoord = calc_thfo.ReactCoord
+
+
+def distance():
+    return [ReactCoord('R', [0,1], 0)], 0
+
+
+def combination():
+    rcs = [
+        ReactCoord('R', [0,1], 1),
+        ReactCoord('R', [1,3], 1),
+        ReactCoord('S', [], 0, [1,-1])
+    ]
+    return rcs, 2
+
+
+@pytest.mark.parametrize('chunk', [1000, 5, 1])
+@pytest.mark.parametrize('thfofile, make_rcs, expected', [
+    ('fort.129', distance, 'ffff_distance.dat'),
+    ('fort.129', combination, 'ffff_combination.dat'),
+    ('fort_wrapped.129', distance, 'ffff_distance.dat'),
+    ('fort_wrapped.129', combination, 'ffff_combination.dat')
+])
+def test_ffff(tmp_path, monkeypatch, thfofile, make_rcs, expected, chunk):
+    shutil.copy(os.path.join(DATA, 'POSCAR'), tmp_path / 'POSCAR')
+    monkeypatch.chdir(tmp_path)
+
+    rcs, para = make_rcs()
+    fegs = calc_thfo.calc_thfo(
+        os.path.join(DATA, thfofile), 24, rcs, para, 0.5, chunk=chunk
+    )
+
+    assert fegs.shape == (24, len(rcs))
+    with open(tmp_path / 'ffff.dat', 'r') as fopen:
+        content = fopen.read()
+    with open(os.path.join(DATA, expected), 'r') as fopen:
+        assert content == fopen.read()
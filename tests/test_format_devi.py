@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import importlib.util
+
+import numpy as np
+
+"""
+Author: Jiayan Xu
+Description:
+    Columns of deepmd/format_devi.py on a synthetic model_devi.out with
+    per-atom force deviations, whose header ends in atm_devi_f(N).
+"""
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, os.path.join(REPO, 'common'))
+spec = importlib.util.spec_from_file_location(
+    'format_devi', os.path.join(REPO, 'deepmd', 'format_devi.py')
+)
+format_devi = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(format_devi)
+
+NATOMS = 3
+
+
+def write_devi(devi, nsteps=5):
+    rng = np.random.default_rng(0)
+    values = np.column_stack((
+        np.arange(nsteps)*10, rng.random((nsteps, 6+NATOMS))
+    ))
+    content = '#%12s' %'step' + ''.join('%15s' %name for name in 
+        format_devi.DEVI_NAMES[1:] + ['atm_devi_f(N)']) + '\n'
+    content += ''.join('%12d' %row[0] + ''.join('%15.6e' %v for v in row[1:]) 
+        + '\n' for row in values)
+    with open(devi, 'w') as writer:
+        writer.write(content)
+
+    return np.loadtxt(devi)
+
+
+def test_atomic_header(tmp_path):
+    devi = str(tmp_path / 'model_devi.out')
+    data = write_devi(devi)
+
+    names, values = format_devi.read_devi(devi)
+    assert names == format_devi.DEVI_NAMES
+    np.testing.assert_allclose(values, data[:,:7])
+
+    atomic = format_devi.read_atomic_devi(devi, [1, 3])
+    assert atomic.shape == (2, NATOMS)
+    np.testing.assert_allclose(atomic, data[[1,3],7:])
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+from ase import Atoms
+from ase.calculators.singlepoint import SinglePointCalculator
+from ase.constraints import FixAtoms, FixScaled
+
+"""
+Author: Jiayan Xu
+Description:
+    Frames of common/coreHarvest.py are the same whether they come from the
+    per-file cache or are parsed again, including the selective dynamics.
+"""
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, os.path.join(REPO, 'common'))
+import coreHarvest
+import coreStore
+
+
+def make_frames(nframes=3):
+    rng = np.random.default_rng(0)
+    frames = []
+    for i in range(nframes):
+        atoms = Atoms('Cu3O', positions=rng.random((4,3))*4., \
+                cell=[5.,5.,6.], pbc=True)
+        atoms.set_constraint([
+            FixScaled(1, [False, False, True], atoms.cell), FixAtoms([0, 2])
+        ])
+        atoms.info.update(step=i, comment='parsed')
+        atoms.calc = SinglePointCalculator(atoms, energy=-1.*i, \
+                free_energy=-1.5*i, forces=rng.random((4,3)))
+        frames.append(atoms)
+    return frames
+
+
+def describe(atoms):
+    return {
+        'numbers': atoms.get_atomic_numbers().tolist(),
+        'positions': atoms.get_positions().tolist(),
+        'cell': atoms.get_cell()[:].tolist(),
+        'pbc': atoms.get_pbc().tolist(),
+        'constraints': [c.todict() for c in atoms.constraints],
+        'info': atoms.info,
+        'results': {k: np.asarray(v).tolist() \
+                for k, v in atoms.calc.results.items()}
+    }
+
+
+@pytest.fixture
+def vaspfile(tmp_path, monkeypatch):
+    fname = tmp_path / 'vasprun.xml'
+    fname.write_text('')
+    monkeypatch.setattr(coreHarvest, 'read_vasp_frames', \
+            lambda fname, selection: make_frames())
+    return fname
+
+
+def harvested(fnames, **kwargs):
+    return [describe(atoms) for atoms in coreHarvest.harvest(fnames, **kwargs)]
+
+
+def test_hit_and_miss(vaspfile, monkeypatch):
+    nocache = harvested([vaspfile], use_cache=False)
+    assert not os.path.exists(coreHarvest.cache_name(vaspfile))
+
+    first = harvested([vaspfile])
+    assert coreHarvest.load_cache(str(vaspfile), -1) is not None
+    hit = harvested([vaspfile])
+
+    monkeypatch.setattr(coreHarvest, 'save_cache', lambda *args: None)
+    readonly = harvested([vaspfile])
+
+    assert nocache == first == hit == readonly
+    assert hit[0]['constraints'] == [
+        {'name': 'FixScaled', 'kwargs': {'a': [1], 'mask': [False, False, True]}},
+        {'name': 'FixAtoms', 'kwargs': {'indices': [0, 2]}}
+    ]
+    assert [frame['info'] for frame in hit] == [{'step': i} for i in range(3)]
+
+
+def test_store_without_move_mask(tmp_path):
+    store = str(tmp_path / 'old.frames')
+    coreStore.write_store(store, make_frames(2))
+    os.remove(os.path.join(store, 'move_mask.bin'))
+
+    frames = list(coreStore.iread_store(store))
+    assert [atoms.constraints for atoms in frames] == [[], []]
+
+    coreStore.append_store(store, make_frames(1))
+    frames = list(coreStore.iread_store(store))
+    assert len(frames) == 3
+    assert len(frames[2].constraints) == 2
@@ -2,6 +2,10 @@
 # -*- coding: utf-8 -*-
 
 
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
 from numpy import pi
 import numpy as np
 
@@ -10,8 +14,11 @@ Author: jyxu
 Description:
     A reproduction of band structure process of vaspkit in Python, 
     which avoids a malloc bug due to a large amount of bands.
+    EIGENVAL is parsed once into a (nspin, nkpt, nband) array and the gap is
+    found by array operations, many calculation directories can be
+    summarized in parallel by the batch mode.
 Notes:
-    Not compatible with spin calculation well.
+    Gap and band character are from SPIN-UP bands.
 """
 
 
@@ -38,91 +45,83 @@ def real2recip(poscar='POSCAR'):
     return recip_lat
 
 
-def read_fermi():
+def read_fermi(doscar='DOSCAR'):
     """Read DOSCAR and get fermi-energy."""
-    # read doscar
-    with open('DOSCAR', 'r') as reader:
-        lines = reader.readlines()
-    lines = [line.strip('\n').split() for line in lines]
+    # only the sixth line is needed
+    with open(doscar, 'r') as reader:
+        for i in range(6):
+            line = reader.readline()
 
     # read 
-    e_max, e_min, nrows, e_fermi = [float(i) for i in lines[5][:4]]
+    e_max, e_min, nrows, e_fermi = [float(i) for i in line.split()[:4]]
 
     return e_max, e_min, e_fermi
 
 
-def read_eigenvalue_info():
-    """Only read first 6 lines of EIGENVAL."""
-    # read eigenvalue
-    with open('EIGENVAL', 'r') as reader:
-        lines = reader.readlines()
-    lines = [line.strip('\n').split() for line in lines]
+def read_eigenval(eigenval='EIGENVAL'):
+    """
+    Read EIGENVAL once.
+    return nelectrons, kmesh (nkpt, 3), weights (nkpt,) and
+    levels (nspin, nkpt, nband) of band energies
+    """
+    with open(eigenval, 'r') as reader:
+        header = [reader.readline() for i in range(6)]
+        content = reader.read()
 
-    spin = int(lines[0][-1])
-    nelectrons, nkpt, nband = [int(i) for i in lines[5]]
+    spin = int(header[0].split()[-1])
+    nelectrons, nkpt, nband = [int(i) for i in header[5].split()]
 
-    return lines, nelectrons, nkpt, nband, spin
+    # each kpoint is a line of kx ky kz weight and nband lines of
+    # index, energies of each spin and occupations (vasp 5.4+)
+    data = np.fromstring(content, sep=' ')
+    ncols = int((data.size/nkpt - 4) / nband)
+    if data.size != nkpt*(4+nband*ncols):
+        raise ValueError('Unrecognized EIGENVAL Format.')
+    data = data.reshape(nkpt, 4+nband*ncols)
 
+    kmesh = data[:,:3]
+    weights = data[:,3]
+    bands = data[:,4:].reshape(nkpt, nband, ncols)
+    levels = bands[:,:,1:1+spin].transpose(2,0,1).copy()
 
-def read_eigenvalue(lines, nelectrons, nkpt, nband, spin):
-    """
-    Read EIGENVAL and get band energy.
-    if spin==1, read first col elseif spin==2, read second col.
-    """
-    # read eigenvalue
+    return nelectrons, kmesh, weights, levels
 
-    # get level, kmesh
-    kmesh, level = [], []
-    for i in range(nkpt):
-        start_index = i*(nband + 2) + 6
-        kmesh.append(lines[start_index+1][:3])
 
-        if spin == 1 or spin == 2:
-            klevel = [col[spin] for col in lines[start_index+2:start_index+2+nband]]
-            level.append(klevel)
+def read_kstep(kmesh, recip_lattice):
+    """accumulated distance along the k-path"""
+    kspc = np.dot(np.diff(kmesh, axis=0), recip_lattice) # vector in real space
+    kstep = np.zeros(len(kmesh))
+    kstep[1:] = np.cumsum(np.linalg.norm(kspc, axis=1))
 
-    kmesh = np.array(kmesh, 'float64') # kpoints
-    level = np.array(level, 'float64') # band energies
+    return kstep
 
-    # get reciprocal lattice
-    recip_lattice = real2recip()
 
-    # get kstep
-    kstep = np.zeros((nkpt,1))
-    for i in range(nkpt-1):
-        kspc = kmesh[i+1] - kmesh[i] # vector in reciprocal space
-        kspc = np.dot(kspc, recip_lattice) # vector in real space
-        kstep[i+1] = kstep[i] + np.linalg.norm(kspc)
+def read_eigenvalue(eigenval='EIGENVAL', poscar='POSCAR'):
+    """Read EIGENVAL and get kpoints, band energies and kpath."""
+    nelectrons, kmesh, weights, levels = read_eigenval(eigenval)
+    kstep = read_kstep(kmesh, real2recip(poscar))
 
-    return kmesh, level, kstep
+    return nelectrons, kmesh, levels, kstep
 
 
-def read_gap():
-    """Calculate gap using SPIN-UP bands."""
-    lines, nelectrons, nkpt, nband, spin = read_eigenvalue_info()
-    kmesh, level, kstep = read_eigenvalue(lines, nelectrons, nkpt, nband, 1)
-    
+def find_gap(level, kmesh, nelectrons):
+    """Calculate gap using (nkpt, nband) bands."""
     if nelectrons%2 == 0:
         nth_band_vbm = int(nelectrons / 2)
         nth_band_cbm = int(nelectrons / 2 + 1)
     else:
         raise ValueError('Band for Odd Electrons is Not Supported.')
-    #print(nth_band_vbm, nth_band_cbm)
 
     # pay attetion to the index!!!
-    vbm = np.max(level[:,nth_band_vbm-1])
-    #print(level[:,nth_band_vbm])
-    cbm = np.min(level[:,nth_band_cbm-1])
-    #print(level[:,nth_band_cbm])
-
-    for ikpt in range(nkpt):
-        if level[ikpt, nth_band_vbm-1] >= vbm:
-            vbm = level[ikpt, nth_band_vbm-1]
-            vbm_kpt_coord = kmesh[ikpt]
-        if level[ikpt, nth_band_cbm-1] <= cbm:
-            cbm = level[ikpt, nth_band_cbm-1]
-            cbm_kpt_coord = kmesh[ikpt]
-    #print(vbm_kpt_coord, cbm_kpt_coord)
+    # take the last kpoint if several have the same extremum
+    vbm_level = level[:,nth_band_vbm-1]
+    cbm_level = level[:,nth_band_cbm-1]
+    nkpt = len(level)
+    vbm_ikpt = nkpt - 1 - np.argmax(vbm_level[::-1])
+    cbm_ikpt = nkpt - 1 - np.argmin(cbm_level[::-1])
+
+    vbm, vbm_kpt_coord = vbm_level[vbm_ikpt], kmesh[vbm_ikpt]
+    cbm, cbm_kpt_coord = cbm_level[cbm_ikpt], kmesh[cbm_ikpt]
 
     band_gap = cbm - vbm 
 
@@ -139,10 +138,18 @@ def read_gap():
             nth_band_vbm, nth_band_cbm, vbm_kpt_coord, cbm_kpt_coord,
 
 
-def write_gap():
+def read_gap(eigenval='EIGENVAL'):
+    """Calculate gap using SPIN-UP bands."""
+    nelectrons, kmesh, weights, levels = read_eigenval(eigenval)
+
+    return find_gap(levels[0], kmesh, nelectrons)
+
+
+def write_gap(eigenval='EIGENVAL', band_gap_file='BAND_GAP'):
     # read gap
     band_character, band_gap, vbm, cbm, \
-            nth_band_vbm, nth_band_cbm, vbm_kpt_coord, cbm_kpt_coord = read_gap()
+            nth_band_vbm, nth_band_cbm, vbm_kpt_coord, cbm_kpt_coord = \
+            read_gap(eigenval)
 
     content = '--BAND GAP--\n'
     content += '%25s%10s\n' %('Band Character:', band_character)
@@ -159,15 +166,15 @@ def write_gap():
     content += '--END--\n'
     
     # write gap 
-    with open('BAND_GAP', 'w') as writer:
+    with open(band_gap_file, 'w') as writer:
         writer.write(content)
 
 
-def write_single_band(band_dat, nband, kstep, level, e_fermi):
+def write_single_band(band_dat, nband, kstep, level, e_fermi, kpoints='KPOINTS'):
     # read KPOINTS
-    with open('KPOINTS', 'r') as reader:
-        lines = reader.readlines()
-    line = lines[0].strip('\n').split(':')[1].split()
+    with open(kpoints, 'r') as reader:
+        line = reader.readline()
+    line = line.strip('\n').split(':')[1].split()
     nkpt_ibz, ndiv, bandpath_num = [int(i) for i in line[2:5]]
 
     nkpt = ndiv # number of kpoints with zero-weight
@@ -177,60 +184,86 @@ def write_single_band(band_dat, nband, kstep, level, e_fermi):
 
     level = level[nkpt_ibz:] - e_fermi
     
-    '''
-    for iband in range(nband):
-        for ikpt in range(nkpt):
-            level[ikpt,iband] -= e_fermi 
-            if level[ikpt,iband] > e_max:
-                level[ikpt,iband] = e_max
-            if level[ikpt,iband] < e_min:
-                level[ikpt,iband] = e_min
-    '''
-    
     # write reformatted.dat
-    content = '#KPATH\n'
-    for ikpt in range(nkpt):
-        content += '%6.2f' %kstep[ikpt]
-        for iband in range(nband):
-            content += '%9.3f' %level[ikpt][iband]
-        content += '\n'
+    row_format = '%6.2f' + '%9.3f'*nband + '\n'
+    rows = np.column_stack((kstep[:nkpt], level[:nkpt,:nband]))
+    content = '#KPATH\n' + ''.join(row_format %tuple(row) for row in rows)
 
     with open(band_dat, 'w') as writer:
         writer.write(content)
 
 
-def write_band():
+def write_band(directory='./'):
     # read DOSCAR
-    e_max, e_min, e_fermi = read_fermi()
+    e_max, e_min, e_fermi = read_fermi(os.path.join(directory, 'DOSCAR'))
 
     # read band
-    lines, nelectrons, nkpt, nband, spin = read_eigenvalue_info()
-    if spin == 1:
-        band_dat = 'REFORMATTED_BAND.dat'
-        kmesh, level, kstep = read_eigenvalue(lines, nelectrons, nkpt, nband, 1)
-
-        # write band.dat
+    nelectrons, kmesh, levels, kstep = read_eigenvalue(
+        os.path.join(directory, 'EIGENVAL'), os.path.join(directory, 'POSCAR')
+    )
+    kpoints = os.path.join(directory, 'KPOINTS')
+    nspin, nkpt, nband = levels.shape
+    if nspin == 1:
+        band_dat = os.path.join(directory, 'REFORMATTED_BAND.dat')
+        level = levels[0]
+
+        # write band.dat, odd bands go backwards along the kpath
         content ='#KPATH\n'
         for iband in range(nband):
             content += '#Band-index%5d\n' %(iband+1)
-            for ikpt in range(nkpt):
-                if iband%2 == 0:
-                    content += '%14.5f%14.5f\n' \
-                            %(kstep[ikpt], level[ikpt][iband])
-                elif iband%2 == 1:
-                    content += '%14.5f%14.5f\n' \
-                            %(kstep[nkpt-ikpt-1], level[nkpt-ikpt-1][iband])
-
-        with open('BAND.dat', 'w') as writer:
+            if iband%2 == 0:
+                rows = np.column_stack((kstep, level[:,iband]))
+            elif iband%2 == 1:
+                rows = np.column_stack((kstep[::-1], level[::-1,iband]))
+            content += ''.join('%14.5f%14.5f\n' %tuple(row) for row in rows)
+
+        with open(os.path.join(directory, 'BAND.dat'), 'w') as writer:
             writer.write(content)
 
-        write_single_band(band_dat, nband, kstep, level, e_fermi)
-    elif spin == 2:
-        band_up, band_dw = 'REFORMATTED_BAND_UP.dat', 'REFORMATTED_BAND_DW.dat'
-        kmesh, level, kstep = read_eigenvalue(lines, nelectrons, nkpt, nband, 1)
-        write_single_band(band_up, nband, kstep, level, e_fermi)
-        kmesh, level, kstep = read_eigenvalue(lines, nelectrons, nkpt, nband, 2)
-        write_single_band(band_dw, nband, kstep, level, e_fermi)
+        write_single_band(band_dat, nband, kstep, level, e_fermi, kpoints)
+    elif nspin == 2:
+        band_up = os.path.join(directory, 'REFORMATTED_BAND_UP.dat')
+        band_dw = os.path.join(directory, 'REFORMATTED_BAND_DW.dat')
+        write_single_band(band_up, nband, kstep, levels[0], e_fermi, kpoints)
+        write_single_band(band_dw, nband, kstep, levels[1], e_fermi, kpoints)
+
+
+def summarize_directory(directory):
+    """gap summary of one calculation directory"""
+    nelectrons, kmesh, weights, levels = read_eigenval(
+        os.path.join(directory, 'EIGENVAL')
+    )
+    band_character, band_gap, vbm, cbm, \
+            nth_band_vbm, nth_band_cbm, vbm_kpt_coord, cbm_kpt_coord = \
+            find_gap(levels[0], kmesh, nelectrons)
+
+    e_fermi = np.nan
+    if os.path.exists(os.path.join(directory, 'DOSCAR')):
+        e_fermi = read_fermi(os.path.join(directory, 'DOSCAR'))[2]
+
+    return (directory, band_character, band_gap, vbm, cbm, e_fermi, \
+            nth_band_vbm, nth_band_cbm)
+
+
+def write_summary(directories, summary_file='BAND_SUMMARY.dat', njobs=1):
+    """summarize gaps of many directories into one table in the given order"""
+    if njobs > 1:
+        with ProcessPoolExecutor(max_workers=njobs) as executor:
+            results = list(executor.map(summarize_directory, directories))
+    else:
+        results = [summarize_directory(d) for d in directories]
+
+    width = max([len(r[0]) for r in results] + [9])
+    content = '#%*s%10s%10s%10s%10s%10s%6s%6s\n' %(width-1, 'Directory', \
+            'Character', 'Gap', 'VBM', 'CBM', 'Fermi', 'HOMO', 'LUMO')
+    for result in results:
+        content += '%*s%10s%10.4f%10.4f%10.4f%10.4f%6d%6d\n' \
+                %(width, *result)
+
+    with open(summary_file, 'w') as writer:
+        writer.write(content)
+
+    return results
 
 
 def write_klabels():
@@ -308,10 +341,23 @@ def write_klabels():
 
 
 if __name__ == '__main__':
-    #read_fermi()
-    #read_eigenvalue()
-    #real2recip()
-    #read_gap()
-    write_gap()
-    write_band()
-    write_klabels()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-b', '--batch', nargs='*', \
+            help='directories to summarize gaps into one table')
+    parser.add_argument('-o', '--output', \
+            default='BAND_SUMMARY.dat', help='summary table')
+    parser.add_argument('-nj', '--njobs', type=int, \
+            default=1, help='number of processes in the batch mode')
+
+    args = parser.parse_args()
+
+    if args.batch:
+        write_summary(args.batch, args.output, args.njobs)
+    else:
+        #read_fermi()
+        #read_eigenvalue()
+        #real2recip()
+        #read_gap()
+        write_gap()
+        write_band()
+        write_klabels()
@@ -2,8 +2,9 @@
 # -*- coding: utf-8 -*-
 
 import os
-
+import sys
 import argparse
+from functools import lru_cache
 
 import numpy as np
 
@@ -12,6 +13,10 @@ mpl.use('Agg') #silent mode
 from matplotlib import pyplot as plt
 from matplotlib.ticker import MultipleLocator, FormatStrFormatter
 
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from coreTraj import open_mmap, skip_lines, index_file
+
 ELEMENT_COLOR = {'default': '#000000', 'H': '#FFFFF0', 'C': '#A9A9A9', 
 'O': '#FF0000', 'S': '#FEC615', 'Cd': '#645403', 'Pt': '#0000CD'}
 ORBITAL_COLOR = {'s': '#4b0101', 'p': '#01366a', 'd': '#0a461e', 'f': '#751973'}
@@ -20,6 +25,48 @@ ORBITALS = ['s', 'py', 'pz', 'px', \
     'dxy', 'dyz', 'dz2', 'dxz', 'dx2', \
     'f-3', 'f-2', 'f-1', 'f0', 'f1', 'f2', 'f3']
 
+ANGULAR = ['s', 'p', 'd', 'f']
+SPINS = ['up', 'dw']
+
+def select_orbitals(orbital, norbitals):
+    """
+    indices of orbital columns and whether absolute values are summed,
+    s/p/d/f and None (all) sum |dos|, a single orbital like px is signed
+    """
+    orbitals = ORBITALS[:norbitals]
+    if orbital is None:
+        return list(range(norbitals)), True
+    elif orbital in ANGULAR:
+        return [i for i, o in enumerate(orbitals) if o.startswith(orbital)], True
+    elif orbital in ORBITALS:
+        return [i for i, o in enumerate(orbitals) if o == orbital], False
+    else:
+        raise ValueError('Unknown Orbital Type.')
+
+def select_spins(spin, nspin):
+    """indices of spin channels, up is the only channel of ISPIN=1"""
+    if spin in SPINS:
+        return [i for i in [SPINS.index(spin)] if i < nspin]
+    return list(range(nspin))
+
+def sum_dos(doses, orbital=None, spin=None):
+    """
+    sum dos in (..., nedos, norbitals, nspin) over selected orbitals and
+    spins and all leading atom axes
+    """
+    norbitals, nspin = doses.shape[-2:]
+    orbitals, absolute = select_orbitals(orbital, norbitals)
+    spins = select_spins(spin, nspin)
+
+    selected = doses[..., orbitals, :][..., spins]
+    if absolute:
+        selected = np.fabs(selected)
+    pdos = selected.sum(axis=(-2,-1))
+    if pdos.ndim > 1:
+        pdos = pdos.reshape(-1, pdos.shape[-1]).sum(axis=0)
+
+    return pdos
+
 class AtomDos(object):
     """
     Description:
@@ -28,17 +75,17 @@ class AtomDos(object):
     element attr.  [str]   the element symbol
     number  attr.  [int]   the index, start from 1
     _nedos  attr.  [int]   number of bands
-    _doses  attr.  [dict]  {'up': [], 'dw': []}
+    _doses  attr.  [array] (nedos, norbitals, nspin)
     ----- ----- ----- ----- ----- ----- ----- ----- ----- ----- 
-    parse_block  meth.
     get_dos      meth.
     ===== ===== ===== ===== ===== ===== ===== ===== ===== =====
 
     """
-    def __init__(self, element, number, block):
+    def __init__(self, element, number, doses):
         self._element = element
         self._number = number
-        self._nedos, self._doses = self.parse_block(block) # dict
+        self._nedos = doses.shape[0]
+        self._doses = doses # view in DosCar array
 
     @property
     def element(self):
@@ -48,91 +95,134 @@ class AtomDos(object):
     def number(self):
         return self._number
 
-    def parse_block(self, block):
-        # energy s py pz px dxy dyz dz2 dxz dx2 f-3 f3
-        #print(block[0])
-        emax, emin, nedos, efermi, scale = block[0] # these are all strings
-        nedos = int(nedos)
-
-        dos_data = np.array(block[1:], dtype=float)
-
-        doses = dos_data[:,1:]
-
-        # s 1 sp 4 spd 9 spdf 16
-        # check orbitals
-        norbitals = len(doses[0])
-
-        if norbitals == 1 or norbitals == 4 or norbitals == 9 or norbitals == 16:
-            orbitals = ORBITALS[:norbitals]
-            doses_dict = {}
-            for i, orbital in enumerate(orbitals):
-                doses_dict[orbital] = doses[:,i]
-        elif norbitals == 2 or norbitals == 8 or norbitals == 18 or norbitals == 32:
-            # spin-polarized
-            orbitals = ORBITALS[:int(norbitals/2)]
-            doses_up, doses_dw = [], []
-            for i in range(norbitals):
-                if i%2 == 0:
-                    doses_up.append(doses[:,i])
-                else:
-                    doses_dw.append(doses[:,i])
-
-            #doses_dict_up, doses_dict_dw = {}, {}
-            doses_dict = {}
-            for i, orbital in enumerate(orbitals):
-                doses_dict[orbital+'_up'] = doses_up[i]
-                doses_dict[orbital+'_dw'] = doses_dw[i]
-
-        return nedos, doses_dict
-
     def get_dos(self, orbital=None, spin=None):
         """
-        >>> AtomDos.get_dos('s') # get s_up-s_dw orbital
-        >>> AtomDos.get_dos('p', 'up') # get s_up orbital
+        >>> AtomDos.get_dos('s') # get s_up+s_dw orbital
+        >>> AtomDos.get_dos('p', 'up') # get p_up orbital
 
         """
-        doses = np.zeros(self._nedos)
-        if orbital in ['s', 'p', 'd', 'f']:
-            if spin == 'up' or spin == 'dw':
-                spins = [spin]
-            else:
-                spins = ['up', 'dw']
-            for o, d in self._doses.items():
-                if o.startswith(orbital):
-                    if spin:
-                        if spin in o:
-                            doses += np.fabs(d)
-                    else:
-                        doses += np.fabs(d)
-                else:
-                    pass
-        elif orbital in ORBITALS:
-            if spin == 'up' or spin == 'dw':
-                orbital += '_' + spin
-            for o, d in self._doses.items():
-                if orbital in o:
-                    doses += d
-        else:
-            raise ValueError('Unknown Orbital Type.')
-
-        return doses
+        return sum_dos(self._doses, orbital, spin)
 
     def __repr__(self):
-        return 'DOS %s%s (%d)' %(self.element, self.number, len(self._doses))
+        norbitals, nspin = self._doses.shape[1:]
+        return 'DOS %s%s (%d)' %(self.element, self.number, norbitals*nspin)
+
+DOSCAR_KEYS = ['offset']
+
+def read_doscar_header(mm):
+    """natoms, nedos, the dos header line and offset of the total dos"""
+    natoms = int(mm[:mm.find(b'\n')].split()[0])
+    pos = skip_lines(mm, 0, 5)
+    end = mm.find(b'\n', pos) + 1
+    header = mm[pos:end] # repeated before every projected block
+    nedos = int(header.split()[2])
+
+    return natoms, nedos, header, end
+
+def scan_doscar(mm, start=0, previous=None):
+    """offsets of projected blocks, each begins with the dos header line"""
+    natoms, nedos, header, pos = read_doscar_header(mm)
+    pos = skip_lines(mm, pos, nedos)
+    if previous is not None:
+        pos = start
+
+    size = len(mm)
+    offsets, length = [], None
+    while pos != -1 and mm[pos:pos+len(header)] == header:
+        # blocks mostly share the same byte length, try it before counting
+        end = -1
+        if length is not None:
+            guess = pos + length
+            if guess == size or mm[guess:guess+len(header)] == header:
+                end = guess
+        if end == -1:
+            end = skip_lines(mm, pos, nedos+1)
+            if end == -1:
+                break
+        offsets.append(pos)
+        pos, length = end, end - pos
+
+    results = {
+        'natoms': np.array(natoms, dtype=np.int64),
+        'nedos': np.array(nedos, dtype=np.int64),
+        'offset': np.array(offsets, dtype=np.int64)
+    }
+
+    return results, (pos if offsets else start)
+
+def index_doscar(doscar='DOSCAR'):
+    return index_file(doscar, 'doscar', scan_doscar, DOSCAR_KEYS)
+
+def projection_cache_name(doscar):
+    """hidden cache of element-summed projections, .DOSCAR.pdos.npz"""
+    dirname, basename = os.path.split(os.path.abspath(doscar))
+    return os.path.join(dirname, '.' + basename + '.pdos.npz')
+
+def load_projections(doscar, atoms):
+    """cached element projections, empty if missing or outdated"""
+    cache = projection_cache_name(doscar)
+    if not os.path.exists(cache):
+        return {}
+
+    stat = os.stat(doscar)
+    try:
+        with np.load(cache, allow_pickle=False) as data:
+            if int(data['size']) != stat.st_size or \
+                    int(data['mtime_ns']) != stat.st_mtime_ns or \
+                    not np.array_equal(data['atoms'], atoms):
+                return {}
+            projections = {}
+            for key in data.files:
+                if key.startswith('abs_'):
+                    element = key[4:]
+                    projections[element] = \
+                            (data['abs_'+element], data['sum_'+element])
+    except (OSError, ValueError, KeyError):
+        return {}
+
+    return projections
+
+def save_projections(doscar, atoms, projections):
+    """write the cache atomically, silently skip read-only directories"""
+    cache = projection_cache_name(doscar)
+    stat = os.stat(doscar)
+    data = {
+        'size': np.array(stat.st_size, dtype=np.int64),
+        'mtime_ns': np.array(stat.st_mtime_ns, dtype=np.int64),
+        'atoms': np.array(atoms)
+    }
+    for element, (abs_doses, sum_doses) in projections.items():
+        data['abs_'+element] = abs_doses
+        data['sum_'+element] = sum_doses
+
+    tmpname = cache + '.tmp'
+    try:
+        with open(tmpname, 'wb') as writer:
+            np.savez(writer, **data)
+        os.replace(tmpname, cache)
+    except OSError:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+
+    return
 
 class DosCar(object):
     """
     Description:
-        A class for a single atom in DOSCAR.
+        A class for DOSCAR, projected doses of all atoms are kept in one array.
+        In lazy mode, only offsets of atom blocks are indexed and each block
+        is decoded on demand and kept in a LRU cache.
     ===== ===== ===== ===== ===== ===== ===== ===== ===== =====
-    _doses
-    ----- ----- ----- ----- ----- ----- ----- ----- ----- ----- 
+    _doses        attr.  [array] (natoms, nedos, norbitals, nspin)
+    _projections  attr.  [dict]  {element: (sum |dos|, sum dos)}
+    ----- ----- ----- ----- ----- ----- ----- ----- ----- -----
     ===== ===== ===== ===== ===== ===== ===== ===== ===== =====
 
     """
-    def __init__(self, filename='DOSCAR'):
+    def __init__(self, filename='DOSCAR', lazy=False, cachesize=128):
         # doscar name
         self.filename = filename
+        self.lazy = lazy
 
         # get atom list
         with open('POSCAR', 'r') as reader:
@@ -144,54 +234,106 @@ class DosCar(object):
         for e, n in zip(elements, numbers):
             atoms.extend([e]*n)
 
-        self._atoms = atoms
+        self._atoms = np.array(atoms)
 
-        # read DOSCAR
-        self._doses = self.readfile()
+        # element projections, persisted next to DOSCAR
+        self._projections = load_projections(filename, self._atoms)
 
-    def readfile(self):
-        with open(self.filename, 'r') as reader:
-            lines = reader.readlines()
-        lines = [line.strip().split() for line in lines]
+        # read DOSCAR
+        if lazy:
+            self._index = index_doscar(filename)
+            if len(self._index['offset']) != len(self._atoms):
+                raise ValueError('No projected DOS of %d atoms.' %len(self._atoms))
+            self._mm = open_mmap(filename)
+            self.read_total(self._mm)
+            self._doses = None
+            self._decode_atom = lru_cache(maxsize=cachesize)(self.decode_atom)
+        else:
+            self._doses = self.readfile()
 
-        # parse data
-        # general info
-        natoms = int(lines[0][0])
-        a_omega, a_norm, b_norm, c_norm, potim = np.array(lines[1], dtype=float)
-        system_name = lines[4]
+    def read_total(self, mm):
+        """energies and total dos, return offset of the first projected block"""
+        natoms, nedos, header, start = read_doscar_header(mm)
 
-        # total dos
-        emax, emin, nedos, e_fermi, scale = np.array(lines[5], dtype=float)
+        emax, emin, nedos, e_fermi, scale = np.array(header.split(), dtype=float)
         nedos = int(nedos)
-        if len(lines[6]) == 3:
+        ncols = len(mm[start:mm.find(b'\n', start)].split())
+        if ncols == 3:
             ISPIN = 1
-        elif len(lines[6]) == 5:
+        elif ncols == 5:
             ISPIN = 2
         else:
             raise ValueError('Unrecognized DOSCAR Format.')
 
-        self._nedos = int(nedos)
+        self._natoms = natoms
+        self._nedos = nedos
+        self._nspin = ISPIN
+        self.e_fermi = e_fermi
 
-        dos_data = np.array(lines[6:6+nedos], dtype=float) # including energies
+        pos = skip_lines(mm, start, nedos)
+        dos_data = np.fromstring(mm[start:pos].decode(), sep=' ')
+        dos_data = dos_data.reshape(nedos, ncols) # including energies
 
-        self._energies = np.array(dos_data[:,0], dtype=float)
+        self._energies = dos_data[:,0].copy()
 
         # total dos, integrated total dos
         if ISPIN == 1:
-            self.tot_dos = np.array(dos_data[:,1], dtype=float)
-            self.tot_idos = np.array(dos_data[:,2], dtype=float)
+            self.tot_dos = dos_data[:,1].copy()
+            self.tot_idos = dos_data[:,2].copy()
         elif ISPIN == 2:
-            self.tot_dos = np.array(dos_data[:,1:3], dtype=float)
-            self.tot_idos = np.array(dos_data[:,3:], dtype=float)
+            self.tot_dos = dos_data[:,1:3].copy()
+            self.tot_idos = dos_data[:,3:].copy()
+
+        # energy s py pz px dxy dyz dz2 dxz dx2 f-3 ... f3 in projected blocks
+        if len(self._atoms) != natoms or pos == -1 or pos >= len(mm):
+            raise ValueError('No projected DOS of %d atoms.' %len(self._atoms))
+        first = skip_lines(mm, pos, 1) # skip block header
+        ncols = len(mm[first:mm.find(b'\n', first)].split())
+
+        # s 1 sp 4 spd 9 spdf 16, doubled if spin-polarized
+        norbitals = int((ncols - 1) / ISPIN)
+        if norbitals not in [1, 4, 9, 16] or (ncols-1) % ISPIN != 0:
+            raise ValueError('Unrecognized DOSCAR Format.')
+        self._ncols = ncols
+        self._norbitals = norbitals
+
+        return pos
+
+    def readfile(self):
+        mm = open_mmap(self.filename)
+        pos = self.read_total(mm)
 
         # projected dos
-        atoms_dos = []
-        for i, atom in enumerate(self._atoms):
-            start, end = 6+nedos+i*(nedos+1), 6+nedos+(i+1)*(nedos+1)
-            dos_data = lines[start:end]
-            atoms_dos.append(AtomDos(atom, i+1, dos_data))
+        # every atom block is a header of 5 numbers and nedos lines,
+        # all parsed at once
+        natoms, nedos, ncols = self._natoms, self._nedos, self._ncols
+        pdos_data = np.fromstring(mm[pos:].decode(), sep=' ')
+        mm.close()
+
+        blocksize = 5 + nedos*ncols
+        if pdos_data.size != natoms*blocksize:
+            raise ValueError('Unrecognized DOSCAR Format.')
+        pdos_data = pdos_data.reshape(natoms, blocksize)[:,5:]
+        # spin channels alternate in columns, s_up s_dw py_up py_dw ...
+        doses = pdos_data.reshape(natoms, nedos, ncols)[:,:,1:]
+        doses = doses.reshape(natoms, nedos, self._norbitals, self._nspin)
 
-        return atoms_dos
+        return doses
+
+    def decode_atom(self, i):
+        """(nedos, norbitals, nspin) of the i-th atom, start from 0"""
+        offsets = self._index['offset']
+        pos = skip_lines(self._mm, offsets[i], 1) # skip block header
+        if i+1 < len(offsets):
+            end = offsets[i+1]
+        else:
+            end = skip_lines(self._mm, pos, self._nedos)
+        data = np.fromstring(self._mm[pos:end].decode(), sep=' ')
+        doses = data.reshape(self._nedos, self._ncols)[:,1:]
+        doses = doses.reshape(self._nedos, self._norbitals, self._nspin)
+        doses.flags.writeable = False # shared by the LRU cache
+
+        return doses
 
     def get_energy(self):
         """band energy"""
@@ -200,35 +342,78 @@ class DosCar(object):
     def get_tdos(self):
         return self.tot_dos
 
+    def get_atom_doses(self, number):
+        """(nedos, norbitals, nspin) of the atom with index number, start from 1"""
+        if self.lazy:
+            return self._decode_atom(number-1)
+        return self._doses[number-1]
+
+    def get_atom_dos(self, number):
+        """AtomDos of the atom with index number, start from 1"""
+        return AtomDos(self._atoms[number-1], number, self.get_atom_doses(number))
+
+    def select_atoms(self, element, number=None):
+        """mask of atoms of element, only in number (start from 1) if given"""
+        mask = self._atoms == element
+        if number:
+            selected = np.zeros(len(self._atoms), dtype=bool)
+            selected[np.array(number, dtype=int)-1] = True
+            mask &= selected
+
+        return mask
+
     def get_pdos(self, element, number=None, orbital=None, spin=None):
         """
         # all S atoms and all orbitals
-        >>> DosCar.get_pdos('S') 
+        >>> DosCar.get_pdos('S')
         # selected S atoms and all orbitals
-        >>> DosCar.get_pdos('S', [1]) 
+        >>> DosCar.get_pdos('S', [1])
         # all S atoms and selected orbitals
-        >>> DosCar.get_pdos('S', [], ['s']) 
+        >>> DosCar.get_pdos('S', [], 's')
         # all S atoms and all orbitals and selected spin
-        >>> DosCar.get_pdos('S', [], [], ['up']) ***
+        >>> DosCar.get_pdos('S', [], None, 'up')
         """
-        # sum pdos 
+        if not number:
+            return self.get_element_pdos(element, orbital, spin)
+
+        mask = self.select_atoms(element, number)
+        if not self.lazy:
+            return sum_dos(self._doses[mask], orbital, spin)
+
         pdos = np.zeros(self._nedos)
-        for ados in self._doses:
-            if ados.element == element:
-                for s in spins:
-                    pdos += ados.get_dos(orbital, s)
+        for i in np.flatnonzero(mask):
+            pdos += sum_dos(self.get_atom_doses(i+1), orbital, spin)
 
         return pdos
 
+    def get_projections(self, element):
+        """sum |dos| and sum dos of all atoms of element, cached"""
+        if element not in self._projections.keys():
+            mask = self.select_atoms(element)
+            if self.lazy:
+                shape = (self._nedos, self._norbitals, self._nspin)
+                abs_doses, sum_doses = np.zeros(shape), np.zeros(shape)
+                for i in np.flatnonzero(mask):
+                    doses = self.get_atom_doses(i+1)
+                    abs_doses += np.fabs(doses)
+                    sum_doses += doses
+            else:
+                abs_doses = np.fabs(self._doses[mask]).sum(axis=0)
+                sum_doses = self._doses[mask].sum(axis=0)
+            self._projections[element] = (abs_doses, sum_doses)
+            save_projections(self.filename, self._atoms, self._projections)
+
+        return self._projections[element]
+
     def get_element_pdos(self, element, orbital=None, spin=None):
         """
         """
-        pdos = np.zeros(self._nedos)
-        for ados in self._doses:
-            if ados.element == element:
-                pdos += ados.get_dos(orbital, spin) # orbital spin
+        abs_doses, sum_doses = self.get_projections(element)
+        absolute = select_orbitals(orbital, abs_doses.shape[1])[1]
+        if absolute:
+            return sum_dos(abs_doses, orbital, spin)
 
-        return pdos
+        return sum_dos(sum_doses, orbital, spin)
 
 
 def plot_dos(dos_data_file, dos_fig_format):
@@ -236,13 +421,9 @@ def plot_dos(dos_data_file, dos_fig_format):
     fig_name = 'DOS.png'
     print('Reas DOS data of %s. Write figure to %s.')
 
-    # read fermi energy
-    with open('DOSCAR', 'r') as reader:
-        lines = reader.readlines()
-    e_fermi = float(lines[5].strip().split()[3])
-
-    # read DOSCAR
-    doscar = DosCar()
+    # read DOSCAR, only element projections are needed
+    doscar = DosCar(lazy=True)
+    e_fermi = doscar.e_fermi
     energies = doscar.get_energy()
 
     fig, ax = plt.subplots(nrows=1, ncols=1, figsize=(8,6))
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
 import argparse
 
 import numpy as np
@@ -14,6 +15,10 @@ import matplotlib as mpl
 mpl.use('Agg') #silent mode
 from matplotlib import pyplot as plt
 
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from coreTraj import open_mmap, skip_lines
+
 """
 Author: Jiayan Xu
 """
@@ -86,55 +91,125 @@ def read_poscar(poscar='POSCAR', format='vasp5'):
     return fname, scaling, lattice, symbols, numbers, atoms, poses, fixes
 
 
-def read_thfo(filename='fort.129', natoms=2, nframes=3):
-    # get file object
-    reader = open(filename, 'r')
-        
-    nstep = 0
-    frames = []
-    while True:
-        # find MD step
-        line = reader.readline()
-        if line.startswith('--------------------    MD STEP'):
-            # count and reset data
-            nstep += 1
-            cur_frame = []
-            irbm = False # If Read Blue Moon
-
-        # read section
-        if line.startswith(' -> CURRENT POSITIONS, '):
-            for i in range(natoms):
-                cur_atom = []
-                line = reader.readline().strip().split()
-                cur_atom.extend(line) # positions, velocities
-                line = reader.readline().strip().split()
-                cur_atom.extend(line) # forces
-                cur_frame.append(cur_atom)
-            frames.append(cur_frame)
-            irbm = True
-
-        # check step
-        if nstep == nframes and irbm == True:
+THFO_MARKER = b'\n -> CURRENT POSITIONS, '
+
+CHUNK = 1000 # frames processed at once
+
+
+def iread_thfo(filename='fort.129', natoms=2, nframes=3, chunk=CHUNK):
+    """
+    yield positions (direct), velocities and forces of at most nframes steps
+    in (chunk, natoms, 3) blocks, each atom has a line of positions and
+    velocities and a line of forces after CURRENT POSITIONS
+    """
+    mm = open_mmap(filename)
+
+    pos, count = 0, 0
+    while nframes is None or count < nframes:
+        blocks = []
+        while len(blocks) < chunk and (nframes is None or count < nframes):
+            pos = mm.find(THFO_MARKER, pos)
+            if pos == -1:
+                break
+            start = skip_lines(mm, pos+1, 1)
+            end = skip_lines(mm, start, 2*natoms)
+            if end == -1:
+                pos = -1
+                break # last step is still being written
+            blocks.append(mm[start:end])
+            pos, count = end, count + 1
+        if blocks:
+            data = np.fromstring(b''.join(blocks).decode(), sep=' ')
+            data = data.reshape(len(blocks), natoms, 9)
+            yield data[:,:,0:3], data[:,:,3:6], data[:,:,6:9]
+        if pos == -1:
             break
 
-        if not line:
-            break
-    reader.close()
-
-    # check output
-    frames = np.array(frames, dtype=float)
-    poses, vels, forces = [], [], []
-    for frame in frames:
-        poses.append(frame[:,0:3])
-        vels.append(frame[:,3:6])
-        forces.append(frame[:,6:9])
-    poses = np.array(poses) # direct coordinates
-    vels = np.array(vels)
-    forces = np.array(forces)
+    mm.close()
+
+
+def read_thfo(filename='fort.129', natoms=2, nframes=3):
+    """positions (direct), velocities and forces in (nframes, natoms, 3)"""
+    blocks = list(iread_thfo(filename, natoms, nframes))
+    poses = np.concatenate([b[0] for b in blocks]) # direct coordinates
+    vels = np.concatenate([b[1] for b in blocks])
+    forces = np.concatenate([b[2] for b in blocks])
 
     return poses, vels, forces
 
-def calc_thfo(thfofile, nframes, rcs, para, potim):
+def calc_jacob(rcs, dirposes, latt, natoms):
+    """
+    jacobians (nframes, nrc, 3*natoms) and values (nframes, nrc) of
+    reaction coordinates of all frames, a linear combination (S) takes
+    over the rows of the coordinates before it
+    """
+    nframes, nrc = len(dirposes), len(rcs)
+    jacob = np.zeros((nframes,nrc,3*natoms))
+    rcvals = np.zeros((nframes,nrc))
+    for i, rcd in enumerate(rcs):
+        if rcd.tag == 'R':
+            jacob[:,i,:], rcvals[:,i] = jdis(rcd, natoms, dirposes, latt)
+        elif rcd.tag == 'S':
+            coefs = np.array(rcd.coefs[:i], dtype=float)
+            rcvals[:,i] = dot(rcvals[:,:i], coefs)
+            jacob[:,i,:] = np.einsum('j,fjk->fk', coefs, jacob[:,:i,:])
+            jacob[:,:i,:] = 0.
+        rcd.rcval = rcvals[-1,i]
+
+    return jacob, rcvals
+
+def calc_mxi(jacob, masses_inv):
+    """Z^-1 of (..., nrc, 3*natoms) jacobians, Z = J M^-1 J^T"""
+    mxi_inv = np.einsum('...ik,k,...jk->...ij', jacob, masses_inv, jacob)
+    mxi = inv(mxi_inv)
+
+    return mxi
+
+def jdis(rcd, natoms, dirposes, latt):
+    """jacobian (nframes, 3*natoms) and distance (nframes,), minimum image"""
+    dirposes = np.asarray(dirposes).reshape(-1, natoms, 3)
+    jdis = np.zeros((len(dirposes),3*natoms))
+
+    ia, ib = rcd.aindices[0], rcd.aindices[1]
+
+    pa = dirposes[:,ia]
+    pb = dirposes[:,ib]
+
+    vect = pa - pb
+    vect = dot(vect - np.round(vect), latt)
+    dis = norm(vect, axis=1)
+    
+    vect = vect / dis[:,np.newaxis] # norm
+
+    jdis[:,3*ia:3*ia+3] = vect
+    jdis[:,3*ib:3*ib+3] = -vect
+
+    return jdis, dis
+
+def print_step(nframe, rcs, rcvals, feg, feg1, feg2):
+    print('--------------------    MD STEP %8d--------------------\n' \
+            %(nframe+1))
+    print('-> REACTIVE COORDINATES\n')
+    for rcd, rcval in zip(rcs, rcvals):
+        name = '  DISTANCE' if rcd.tag == 'R' else '  COMBINITION'
+        print('{:>20s}{:>20.16f}'.format(name, rcval))
+    print('\n', end='')
+    print('-> FREE ENERGY GRADIENT (INSTANTANEOUS FORCE)\n')
+    print('{:>12s}  {:>20s}  {:>20s}  {:>20s}  '\
+            .format('        RC', '    FEG', '    FEG1', '    FEG2'))
+    for i in range(len(rcs)):
+        print('{:>8s}{:>4d}  {:>20.16f}  {:>20.16f}  {:>20.16f}  '\
+                .format('      RC', i+1, feg[i], feg1[i], feg2[i]))
+    print('\n', end='')
+
+    return
+
+def calc_thfo(thfofile, nframes, rcs, para, potim, verbose=False, \
+        datfile='ffff.dat', chunk=CHUNK):
+    """
+    free energy gradients of all frames, frames are processed in chunks with
+    batched jacobians and einsum, results are written as each chunk is done
+    """
     # general setting
     nrc = len(rcs) # number of reactive coordinates
 
@@ -143,142 +218,58 @@ def calc_thfo(thfofile, nframes, rcs, para, potim):
             symbols, numbers, atoms, poses, fixes = read_poscar('POSCAR')
     natoms = np.sum(numbers)
 
-    masses = []
-    for atom in atoms:
-        for i in range(3):
-            masses.append(MASS_DICT[atom])
-    masses = np.array(masses)
+    masses = np.repeat([MASS_DICT[atom] for atom in atoms], 3)
     masses_inv = 1.0 / masses
 
     UT, UL = 1e-15, 1e-10
     AMTOKG, EVTOJ = 1.6605402e-27, 1.60217733E-19
     FACT = AMTOKG*UL/UT**2/(EVTOJ/UL)
 
-    # read fort.129
-    poses, vels, forces = read_thfo(thfofile, natoms, nframes)
-
-    # jacobian matrix
-    fegs, rcoords = [], []
-    for nframe in range(nframes):
-        print('--------------------    MD STEP %8d--------------------\n' \
-                %(nframe+1))
-        # info
-        pos, vel, force = poses[nframe], vels[nframe], forces[nframe]
-        cur_pos, cur_vel, cur_for = pos, vel.ravel(), force.ravel()
-
+    # the last frame of the previous chunk
+    las_mj = np.zeros((1,nrc,3*natoms))
+    las_for = np.zeros((1,3*natoms))
+
+    fegs = []
+    writer = open(datfile, 'w')
+    writer.write('#step gradient\n')
+    start = 0
+    for poses, vels, forces in iread_thfo(thfofile, natoms, nframes, chunk):
+        nchunk = len(poses)
+        cur_vel = vels.reshape(nchunk,3*natoms)
         # !!!!!! scale
-        for i, force in enumerate(cur_for):
-            cur_for[i] = cur_for[i] * masses_inv[i]
-        if nframe == 0:
-            las_mj = np.zeros(nrc,3*natoms)
-            las_vel = np.zeros(3*natoms)
-            las_for = np.zeros(3*natoms)
-
-        # calculation
-        print('-> REACTIVE COORDINATES\n')
-        jacob = np.zeros((nrc,3*natoms))
-        for i, rcd in enumerate(rcs):
-            if rcd.tag == 'R':
-                jacob[i,:] = jdis(rcd, natoms, cur_pos, lattice)
-                print('{:>20s}{:>20.16f}'.format('  DISTANCE',rcd.rcval))
-                #if rcd.rctyp != 0:
-                #    jacob[i,:] = np.zeros((1,3*natoms))
-            elif rcd.tag == 'S':
-                jacob[i,:] = np.zeros((1,3*natoms))
-                rcd.rcval = 0
-                for j in range(i):
-                    rcd.rcval += rcs[j].rcval*rcd.coefs[j]
-                    jacob[i,:] += jacob[j,:]*rcd.coefs[j]
-                    jacob[j,:] = np.zeros((1,3*natoms))
-                print('{:>20s}{:>20.16f}'.format('  COMBINITION',rcd.rcval))
-        print('\n', end='')
-        rcoords.append(rcs[para].rcval)
-
-        # Mxi
-        mxi = calc_mxi(jacob, masses_inv, natoms, nrc)
-        mj = dot(mxi,jacob) # Mxi dot Jacobian
-        cur_mj = mj
-
-        #print('las_mj', np.sum(las_mj))
-        #print('cur_mj', np.sum(cur_mj))
-        #print('las_for', np.sum(las_for))
-        #print('cur_for', np.sum(cur_for))
+        cur_for = forces.reshape(nchunk,3*natoms) * masses_inv
+
+        # jacobian matrix, Mxi dot Jacobian
+        jacob, rcvals = calc_jacob(rcs, poses, lattice, natoms)
+        cur_mj = np.matmul(calc_mxi(jacob, masses_inv), jacob)
 
         # finally free energy gradients calculation
-        print('-> FREE ENERGY GRADIENT (INSTANTANEOUS FORCE)\n')
-        print('{:>12s}  {:>20s}  {:>20s}  {:>20s}  '\
-                .format('        RC', '    FEG', '    FEG1', '    FEG2'))
-        if nframe >= 1:
-            # print(cur_for)
-            feg1 = -FACT*dot(cur_mj-las_mj,cur_vel.T)/potim
-            feg2 = -0.25*dot(cur_mj+las_mj,(cur_for+las_for).T)
-            #xx = 0
-            #for j in range(3*natoms):
-            #    xx += (cur_mj+las_mj)[3,j] * (cur_for+las_for)[j]
-            #    print((cur_mj+las_mj)[3,j], (cur_for+las_for)[j], xx)
-            #print('-----')
-            #print(xx*-0.25)
-            #for cf, lf in zip(cur_for, las_for):
-            #    print(cf, lf)
-            feg = feg1 + feg2
-            # print((cur_mj+las_mj).shape)
-        else:
-            feg1 = np.zeros(nrc)
-            feg2 = np.zeros(nrc)
-            feg = np.zeros(nrc)
+        pre_mj = np.concatenate((las_mj, cur_mj[:-1]))
+        pre_for = np.concatenate((las_for, cur_for[:-1]))
+        feg1 = -FACT*np.einsum('fij,fj->fi', cur_mj-pre_mj, cur_vel)/potim
+        feg2 = -0.25*np.einsum('fij,fj->fi', cur_mj+pre_mj, cur_for+pre_for)
+        if start == 0:
+            feg1[0], feg2[0] = 0., 0.
+        feg = feg1 + feg2
         fegs.append(feg)
 
-        for i in range(nrc):
-            print('{:>8s}{:>4d}  {:>20.16f}  {:>20.16f}  {:>20.16f}  '\
-                    .format('      RC', i+1, feg[i], feg1[i], feg2[i]))
-        print('\n', end='')
+        if verbose:
+            for i in range(nchunk):
+                print_step(start+i, rcs, rcvals[i], feg[i], feg1[i], feg2[i])
+
+        writer.write(''.join('%4d %8.4f %8.4f\n' %(start+i+1, rcoord, f) \
+                for i, (rcoord, f) in enumerate(zip(rcvals[:,para], feg[:,para]))))
 
         # update las
-        las_vel, las_for, las_mj = cur_vel.copy(), cur_for.copy(), cur_mj.copy()
+        las_mj, las_for = cur_mj[-1:].copy(), cur_for[-1:].copy()
+        start += nchunk
+    writer.close()
 
-    fegs = np.array(fegs)
-    content = '#step gradient\n'
-    for i, (rcoord, feg) in enumerate(zip(rcoords, fegs[:,para])):
-        content += '%4d %8.4f %8.4f\n' %(i+1, rcoord, feg)
-    with open('ffff.dat', 'w') as writer:
-        writer.write(content)
+    fegs = np.concatenate(fegs) if fegs else np.zeros((0,nrc))
+    print('Successfully calculate %d frames and write %s.' %(len(fegs), datfile))
 
     return fegs
 
-def calc_jacob():
-    pass
-
-def calc_mxi(jacob, masses_inv, natoms, nrc):
-    jacob_trans = jacob.T
-    mijt = np.zeros((3*natoms,nrc)) # inv of mass matrix dot transpose jacob
-    for i in range(3*natoms):
-        for j in range(nrc):
-            mijt[i,j] = masses_inv[i] * jacob_trans[i,j]
-    mxi_inv = dot(jacob, mijt)
-    mxi = inv(mxi_inv)
-
-    return mxi
-
-def jdis(rcd, natoms, dirposes, latt):
-    """jacobian distance"""
-    jdis = np.zeros(3*natoms)
-
-    ia, ib = rcd.aindices[0], rcd.aindices[1]
-
-    pa = dirposes[ia]
-    pb = dirposes[ib]
-
-    vect = dot(pa-pb,latt)
-    dis = norm(vect)
-    rcd.rcval = dis
-    
-    vect = vect / dis # norm
-
-    jdis[3*ia:3*ia+3] = vect
-    jdis[3*ib:3*ib+3] = -vect
-
-    return jdis
-
 
 if __name__ == '__main__':
     '''
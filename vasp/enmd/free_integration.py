@@ -1,12 +1,20 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
+import sys
+
 import time
 import argparse
 
 import numpy as np
 from scipy import integrate
 
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from coreOUTCAR import read_trajectory
+from corePBC import unwrap_cartesian
+
 pi = np.pi
 
 norm = np.linalg.norm
@@ -25,42 +33,6 @@ Bug Fix:
 """
 
 
-def read_outcar(outcar='OUTCAR', natoms=100 , nframes=1000, wdat=False):
-    # read OUTCAR
-    frames = []
-    fopen = open(outcar, 'r')
-    count, flag = 0, True
-    while flag:
-        line = fopen.readline()
-        if line.startswith(' POSITION'):
-            fopen.readline() # segment line ---...---
-            poses, forces = [], []
-            for n in range(natoms):
-                data = fopen.readline().strip().split()
-                poses.append(data[:3]) # x y z
-                forces.append(data[3:]) # fx fy fz
-            poses = np.array(poses, dtype=float)
-            forces = np.array(forces, dtype=float)
-            frames.append([poses, forces])
-            count += 1
-        if count == nframes:
-            flag = False
-    fopen.close()
-    print('Successfully read OUTCAR, get positions and forces ...')
-    
-    # out datfile ?
-    '''
-    for i, d in enumerate(data):
-        content = '#\n'
-        for j in range(nsteps):
-            pos, force = data[i][0][j], data[i][1][j]
-            content += ('{:<12.4f}'*6+'\n').format(*pos, *force)
-        with open('atom-'+str(i+1)+'.dat', 'w') as writer:
-            writer.write(content)
-        break
-    '''
-    return frames
-
 def read_poscar(poscar='POSCAR', format='vasp5'):
     """read POSCAR"""
     with open(poscar, 'r') as reader:
@@ -86,20 +58,6 @@ def read_poscar(poscar='POSCAR', format='vasp5'):
     print('Successfully read POSCAR, taking it as the reference...')
     return fname, scaling, lattice, symbols, numbers, poses, fixes
 
-def adjust_poses(poses, refposes):
-    """poses, poses_ref should be in direct"""
-    # atoms, take last step as reference
-    for i in range(len(poses)):
-        for x in range(3):
-            move = poses[i][x] - refposes[i][x]
-            move = round(move, 0)
-            poses[i][x] -= move
-    refposes = poses.copy()
-
-    return poses, refposes
-
-
-
 def atom_integration(poses, forces, nsteps, fix):
     e_atom = []
     for i in range(nsteps):
@@ -125,27 +83,14 @@ def free_integration(poscar='POSCAR', outcar='OUTCAR', nframes=1):
     fname, scaling, lattice, symbols, numbers, refposes, fixes = read_poscar(poscar)
     natoms = np.sum(numbers)
 
-    frames = read_outcar(outcar=outcar, natoms=natoms, nframes=nframes)
-
-    for i, frame in enumerate(frames):
-        # adjust positions
-        poses = frame[0] # cartesian coordinates
-        dirposes = dot(poses, inv(lattice))
-        dirposes, refposes = adjust_poses(dirposes, refposes)
-        poses = dot(dirposes, lattice)
-        frames[i][0] = poses
-
-    # rearange data into atom
-    data = [[[],[]] for i in range(natoms)] # atoms positions and forces separate
-    for frame in frames:
-        poses, forces = frame
-        for i in range(natoms):
-            data[i][0].append(poses[i])
-            data[i][1].append(forces[i])
-
-    for i, d in enumerate(data):
-        data[i][0] = np.array(data[i][0])
-        data[i][1] = np.array(data[i][1])
+    frames, forces, energies = read_trajectory(outcar=outcar, \
+            natoms=natoms, nframes=nframes)
+
+    # adjust positions
+    frames = unwrap_cartesian(frames, lattice, refposes)
+
+    # rearange data into atom, atoms positions and forces separate
+    data = [[frames[:,i], forces[:,i]] for i in range(natoms)]
 
     # atoms need integration
     en_atoms = []
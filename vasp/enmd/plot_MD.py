@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
+import sys
 import argparse
 
 import numpy as np
@@ -10,21 +12,21 @@ mpl.use('Agg') #silent mode
 from matplotlib import pyplot as plt
 from matplotlib.ticker import MultipleLocator, FormatStrFormatter
 
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from coreOSZICAR import read_oszicar, summarize_chunks, print_summary
+
 """
 Author: Jiayan Xu
 Description:
-    Plot VASP-MD temperature and energy.
+    Plot VASP-MD temperature and energy, from MD.dat or OSZICAR.
 """
 
-def plot_MD(data_file='MD.dat', \
-        fig_title='VASP', fig_format='png'):
-    # default figure setting
-    timestep = 1.0 # time step 1 fs
-    major_interval = 2000
-    minor_interval = 1000
-
-    eq_temp = 300 # equilibrium temperature 300 K
-    fig_title = r"$\bf{Pt_{13}/CdS(100)}\ $"+"Molecular Dynamics"
+def read_md(data_file):
+    """steps, temperatures and potential energies"""
+    if 'OSZICAR' in os.path.basename(data_file):
+        data = read_oszicar(data_file)
+        return data['step'], data['T'], data['E0']
 
     # read data file, the first line is the comment
     with open(data_file, 'r') as reader:
@@ -34,9 +36,20 @@ def plot_MD(data_file='MD.dat', \
     comments = lines[0]
     data = np.array(lines[1:], dtype=float)
 
-    timesteps = data[:,0]*timestep
-    temperatures = data[:,1]
-    energies = data[:,2]
+    return data[:,0], data[:,1], data[:,2]
+
+def plot_MD(data_file='MD.dat', \
+        fig_title='VASP', fig_format='png', blocksize=1000):
+    # default figure setting
+    timestep = 1.0 # time step 1 fs
+    major_interval = 2000
+    minor_interval = 1000
+
+    eq_temp = 300 # equilibrium temperature 300 K
+    fig_title = r"$\bf{Pt_{13}/CdS(100)}\ $"+"Molecular Dynamics"
+
+    steps, temperatures, energies = read_md(data_file)
+    timesteps = steps*timestep
 
     # figure setting
     fig, ax = plt.subplots(nrows=1, ncols=1, figsize=(12,8))
@@ -48,7 +61,7 @@ def plot_MD(data_file='MD.dat', \
     ax.yaxis.set_major_locator(MultipleLocator(20.0))
     ax.yaxis.set_minor_locator(MultipleLocator(5.0))
 
-    t_min, t_max = np.min(temperatures), np.max(temperatures)
+    t_min, t_max = np.min(timesteps), np.max(timesteps)
     t_min = int(t_min/major_interval) * major_interval
     t_max = (int(t_max/major_interval)+1) * major_interval
     ax.set_xlim(t_min, t_max)
@@ -74,14 +87,20 @@ def plot_MD(data_file='MD.dat', \
 
     plt.savefig('MD.'+fig_format)
 
+    # equilibration and errors of a long run from the steps already read
+    if 'OSZICAR' in os.path.basename(data_file):
+        data = {'T': temperatures, 'E0': energies}
+        print_summary(summarize_chunks([data], ['T', 'E0'], blocksize), \
+                blocksize)
+
 if __name__ == '__main__':
-    #parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser()
 
-    #parser.add_argument('-f', '--datafile', \
-    #        default='PDOS_USER.dat', help='PDOS Data File')
-    #parser.add_argument('-o', '--out', \
-    #        default='DOS.png', help='DOS Figure')
+    parser.add_argument('-f', '--datafile', \
+            default='MD.dat', help='MD.dat or OSZICAR')
+    parser.add_argument('-b', '--blocksize', type=int, \
+            default=1000, help='Steps in Each Block of Statistics')
 
-    #args = parser.parse_args()
+    args = parser.parse_args()
 
-    plot_MD()
+    plot_MD(args.datafile, blocksize=args.blocksize)
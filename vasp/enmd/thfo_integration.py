@@ -1,13 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
 import argparse
-
-import numpy as np
-
-from scipy import integrate
-
-import argparse
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 
@@ -16,27 +12,145 @@ mpl.use('Agg') #silent mode
 from matplotlib import pyplot as plt
 from matplotlib.ticker import MultipleLocator, FormatStrFormatter
 
-def thermo_integration(datfile='THFO-1.dat', nframe=500, intv=0.1, region=None):
-    # read BM.dat file
+"""
+Author: Jiayan Xu
+Description:
+    Thermodynamic integration of blue-moon free energy gradients. Frames are
+    binned once by np.digitize and np.bincount, errors of the integrated
+    profile are estimated by block averaging and by bootstrap replicas that
+    are binned and integrated together as one array.
+"""
+
+BOOT_BATCH = 10000000 # resampled frames held in memory at once
+
+
+def read_thfo_dat(datfile, nframe):
+    """collective variables and gradients of the first nframe frames"""
     with open(datfile, 'r') as reader:
         lines = reader.readlines()
-    # lines = [line.strip().split() for line in lines if not line.startswith('#')]
 
-    lines_new = []
+    data = []
     for line in lines:
         if line.startswith('#'):
             print(line)
         else:
-            line = line.strip().split()
-            lines_new.append(line)
-    lines = lines_new
-    data = np.array(lines, dtype=float)
+            data.append(line)
+    data = np.fromstring(''.join(data), sep=' ').reshape(len(data), -1)
 
     print('Successfully read ThermoDynamic data from %s.' %datfile)
 
     coords = data[:nframe,1] # collective variable
     gradients = data[:nframe,2] # free energy gradients
 
+    return coords, gradients
+
+
+def assign_bins(coords, starts, intv):
+    """bin index of each frame, -1 if it is not inside start < coord < end"""
+    indices = np.digitize(coords, starts) - 1
+    inside = (indices >= 0) & (coords > starts[indices.clip(0)]) & \
+            (coords < starts[indices.clip(0)] + intv)
+
+    return np.where(inside, indices, -1)
+
+
+def bin_average(indices, gradients, nbins, weights=None):
+    """counts, mean and std of gradients in each bin"""
+    valid = indices >= 0
+    indices, gradients = indices[valid], gradients[valid]
+    if weights is None:
+        weights = np.ones(len(indices))
+    else:
+        weights = weights[valid]
+
+    counts = np.bincount(indices, weights=weights, minlength=nbins)
+    sums = np.bincount(indices, weights=weights*gradients, minlength=nbins)
+    sqsums = np.bincount(indices, weights=weights*gradients**2, minlength=nbins)
+
+    means = np.divide(sums, counts, out=np.zeros(nbins), where=counts>0)
+    variances = np.divide(sqsums, counts, out=np.zeros(nbins), where=counts>0)
+    stds = np.sqrt(np.clip(variances - means**2, 0., None))
+
+    return counts, means, stds
+
+
+def cumulative_trapz(grads, coords):
+    """free energies integrated to each bin along the last axis"""
+    areas = 0.5*(grads[...,1:]+grads[...,:-1])*np.diff(coords)
+    free_energies = np.zeros(grads.shape)
+    free_energies[...,1:] = np.cumsum(areas, axis=-1)
+
+    return free_energies
+
+
+def block_average(indices, gradients, nbins, nblocks):
+    """standard error of bin means from nblocks contiguous blocks"""
+    means = []
+    for block in np.array_split(np.arange(len(indices)), nblocks):
+        counts, block_means, stds = bin_average(
+            indices[block], gradients[block], nbins
+        )
+        means.append(np.where(counts > 0, block_means, np.nan))
+    means = np.array(means)
+
+    nvalid = np.sum(~np.isnan(means), axis=0)
+    errors = np.nanstd(means, axis=0) / np.sqrt(np.clip(nvalid-1, 1, None))
+
+    return np.where(nvalid > 1, errors, 0.)
+
+
+def bootstrap_batch(indices, gradients, nbins, fallback, nboot, blocksize, seed):
+    """
+    bin means of nboot replicas (nboot, nbins), each replica resamples
+    contiguous blocks of frames with replacement, bins without samples
+    take the fallback means of all frames
+    """
+    rng = np.random.default_rng(seed)
+    nblocks = len(indices) // blocksize
+    starts = rng.integers(0, nblocks, size=(nboot, nblocks)) * blocksize
+    frames = (starts[:,:,np.newaxis] + np.arange(blocksize)).reshape(nboot, -1)
+
+    # offset bins of each replica so all replicas are counted by one bincount
+    replicas = np.repeat(np.arange(nboot), frames.shape[1])
+    bins = indices[frames].ravel()
+    valid = bins >= 0
+    flat = replicas[valid]*nbins + bins[valid]
+    counts = np.bincount(flat, minlength=nboot*nbins).reshape(nboot, nbins)
+    sums = np.bincount(flat, weights=gradients[frames].ravel()[valid], \
+            minlength=nboot*nbins).reshape(nboot, nbins)
+
+    means = np.divide(sums, counts, out=np.tile(fallback, (nboot,1)), \
+            where=counts>0)
+
+    return means
+
+
+def bootstrap(indices, gradients, nbins, fallback, nboot=1000, blocksize=1, \
+        njobs=1, seed=None):
+    """bin means of nboot bootstrap replicas, batches run in parallel"""
+    if not 1 <= blocksize <= len(indices):
+        raise ValueError('Block size %d is not between 1 and %d frames.' \
+                %(blocksize, len(indices)))
+    nframes = (len(indices) // blocksize) * blocksize
+    size = max(1, min(nboot, BOOT_BATCH // max(nframes,1)))
+    sizes = [min(size, nboot-i) for i in range(0, nboot, size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    args = [(indices, gradients, nbins, fallback, n, blocksize, s) \
+            for n, s in zip(sizes, seeds)]
+    if njobs > 1:
+        with ProcessPoolExecutor(max_workers=njobs) as executor:
+            means = list(executor.map(bootstrap_batch, *zip(*args)))
+    else:
+        means = [bootstrap_batch(*arg) for arg in args]
+
+    return np.concatenate(means)
+
+
+def thermo_integration(datfile='THFO-1.dat', nframe=500, intv=0.1, region=None, \
+        nboot=0, blocksize=1, nblocks=0, njobs=1, prefix=''):
+    coords, gradients = read_thfo_dat(datfile, nframe)
+
     if coords[0] - coords[-1] > 0.0:
         findmax = 1.0
     else:
@@ -49,61 +163,47 @@ def thermo_integration(datfile='THFO-1.dat', nframe=500, intv=0.1, region=None):
 
     bins = np.arange(rc_min,rc_max,intv) # start of each bin
 
-    nintvs = int(np.ceil((rc_max - rc_min)/intv))
+    nintvs = len(bins)
     print(rc_min, rc_max, nintvs)
 
-    his = [[] for i in range(nintvs)] # accumulated gradients
-
-    for i, start in enumerate(bins):
-        for coord, grad in zip(coords, gradients):
-            if start < coord < start + intv:
-                his[i].append(grad)
-
-    grad_avg = np.zeros(nintvs)
-    std_errs = np.zeros(nintvs)
-    for i, h in enumerate(his):
-        if h:
-            grad_avg[i]=np.mean(h)
-            std_errs[i]=np.std(h)
-        else:
-            grad_avg[i]=0
-            std_errs[i]=0
-
-    coord_avg = np.zeros(nintvs)
-    for i in range(nintvs):
-        coord_avg[i] = bins[i] + intv/2.0
+    indices = assign_bins(coords, bins, intv)
+    counts, grad_avg, std_errs = bin_average(indices, gradients, nintvs)
+    coord_avg = bins + intv/2.0
 
     # remove bin without samples
-    coord_new, grad_new, std_new = [], [], []
-    for coord, grad, err in zip(coord_avg, grad_avg, std_errs):
-        if grad != 0:
-            coord_new.append(coord)
-            grad_new.append(grad)
-            std_new.append(err)
-    coord_avg, grad_avg, std_errs = coord_new, grad_new, std_new
+    kept = grad_avg != 0
     
     # set integrate and plot region
     if region:
         low, high = region[0], region[1]
-        coord_new, grad_new = [], []
-        for coord, grad in zip(coord_avg,grad_avg):
-            if low < coord < high:
-                coord_new.append(coord)
-                grad_new.append(grad)
-        coord_avg, grad_avg = coord_new, grad_new
+        kept &= (low < coord_avg) & (coord_avg < high)
         print('Set reactive coordinates between %.2f and %.2f.' %(low, high))
+
+    counts, coord_avg = counts[kept], coord_avg[kept]
+    grad_avg, std_errs = grad_avg[kept], std_errs[kept]
     # print(coord_avg)
     # print(grad_avg)
 
+    free_energies = cumulative_trapz(grad_avg, coord_avg)
+    marks = findmax*free_energies
     feind, femark = 0, 0.0
-    free_energies = []
-    for i in range(len(grad_avg)):
-        coord, grad = coord_avg[:i+1], grad_avg[:i+1]
-        v = integrate.trapz(grad, coord)
-        free_energies.append(v)
-        if findmax*v >= femark:
-            femark = findmax*v
-            feind = i
+    if np.any(marks >= 0.):
+        feind = len(marks) - 1 - np.argmax((marks >= np.max(marks))[::-1])
+        femark = marks[feind]
+
+    # errors of gradients by blocks and of free energies by bootstrap
+    if nblocks > 1:
+        block_errs = block_average(indices, gradients, nintvs, nblocks)[kept]
+        for c, e in zip(coord_avg, block_errs):
+            print('Block error of gradient at %8.4f: %12.6f' %(c, e))
+    fe_errs = None
+    if nboot > 0:
+        fallback = bin_average(indices, gradients, nintvs)[1]
+        means = bootstrap(indices, gradients, nintvs, fallback, \
+                nboot, blocksize, njobs)[:,kept]
+        fe_errs = np.std(cumulative_trapz(means, coord_avg), axis=0)
+        print('Bootstrap %d replicas, free energy error at the end %.4f eV.' \
+                %(nboot, fe_errs[-1]))
 
     # print(free_energies)
     print('Successfully carry out the thermointegration.')
@@ -132,8 +232,8 @@ def thermo_integration(datfile='THFO-1.dat', nframe=500, intv=0.1, region=None):
     ax.plot(coord_avg, [0]*len(coord_avg), ls='--', c='k')
     a, = ax.plot(coord_avg, grad_avg, ls='-', c='b', label='Thermo Force')
 
-    for c, g, h in zip(coord_avg, grad_avg, his):
-        ax.text(c*1.01,g*1.01,'%d' %len(h), fontweight='bold')
+    for c, g, n in zip(coord_avg, grad_avg, counts):
+        ax.text(c*1.01,g*1.01,'%d' %n, fontweight='bold')
 
     ax.errorbar(coord_avg, grad_avg, std_errs, \
             marker='s', mfc='g', mec='g', ecolor='g')
@@ -144,6 +244,9 @@ def thermo_integration(datfile='THFO-1.dat', nframe=500, intv=0.1, region=None):
     ax2.yaxis.set_minor_locator(MultipleLocator(0.1))
 
     b, = ax2.plot(coord_avg, free_energies, color='r', label='Free Energy / eV')
+    if fe_errs is not None:
+        ax2.fill_between(coord_avg, free_energies-fe_errs, \
+                free_energies+fe_errs, color='r', alpha=0.2)
     ax2.scatter(coord_avg[feind], findmax*femark, marker='*', c='y') # mark IS or TS
     ax2.text(coord_avg[feind]*1.01,findmax*femark*1.01,'%.2f eV' %(findmax*femark), fontweight='bold')
 
@@ -152,31 +255,55 @@ def thermo_integration(datfile='THFO-1.dat', nframe=500, intv=0.1, region=None):
 
     plt.legend(handles=[a, b], loc='best')
 
-    plt.savefig('THFO.png')
+    plt.savefig(prefix+'THFO.png')
+    plt.close(fig)
 
-    print('Successfully plot the thermointegration process to THFO.png.')
+    print('Successfully plot the thermointegration process to %sTHFO.png.' %prefix)
 
     # write free energies to file
-    content = '# step, gradient, energy\n'
-    for step, force, energy in zip(coord_avg, grad_avg, free_energies):
-        content += '{:<12.4f}{:<12.4f}{:<12.4f}\n'.format(step, force, energy)
+    if fe_errs is None:
+        content = '# step, gradient, energy\n'
+        rows = np.column_stack((coord_avg, grad_avg, free_energies))
+    else:
+        content = '# step, gradient, energy, error\n'
+        rows = np.column_stack((coord_avg, grad_avg, free_energies, fe_errs))
+    content += ''.join(('%-12.4f'*rows.shape[1]+'\n') %tuple(row) for row in rows)
 
-    with open('THFOI.dat', 'w') as writer:
+    with open(prefix+'THFOI.dat', 'w') as writer:
         writer.write(content)
 
-    print('Successfully write thermointegration data into THFOI.dat.')
+    print('Successfully write thermointegration data into %sTHFOI.dat.' %prefix)
+
+    return coord_avg, grad_avg, free_energies, fe_errs
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('-f', '--file', required=True, \
-            help='BM datfile')
+    parser.add_argument('-f', '--file', required=True, nargs='+', \
+            help='BM datfiles')
     parser.add_argument('-nf', '--nframes', required=True, \
             type=int, help='Number of Frames')
     parser.add_argument('-r', '--region', nargs='*', default=None, \
             type=float, help='Reactive Coordinates Range')
     parser.add_argument('-bw', '--binwidth', nargs='?', default=0.1, \
             type=float, help='Bin Width')
+    parser.add_argument('-nb', '--nboot', default=0, \
+            type=int, help='Number of Bootstrap Replicas')
+    parser.add_argument('-bs', '--blocksize', default=1, \
+            type=int, help='Frames per Resampled Block in Bootstrap')
+    parser.add_argument('-nk', '--nblocks', default=0, \
+            type=int, help='Number of Blocks in Block Averaging')
+    parser.add_argument('-nj', '--njobs', default=1, \
+            type=int, help='Number of Processes for Bootstrap')
     args = parser.parse_args()
-
-    thermo_integration(args.file, args.nframes, args.binwidth, args.region)
+    if args.nboot > 0 and not 1 <= args.blocksize <= args.nframes:
+        raise ValueError('Block size %d is not between 1 and %d frames.' \
+                %(args.blocksize, args.nframes))
+
+    for datfile in args.file:
+        # outputs of several files are prefixed by their names
+        prefix = ''
+        if len(args.file) > 1:
+            prefix = os.path.splitext(os.path.basename(datfile))[0] + '_'
+        thermo_integration(datfile, args.nframes, args.binwidth, args.region, \
+                args.nboot, args.blocksize, args.nblocks, args.njobs, prefix)
     # thermo_integration('THFO-1.dat', 500)
@@ -2,7 +2,8 @@
 # -*- coding: utf-8 -*-
 
 import os
-
+import sys
+import time
 import argparse
 
 import numpy as np
@@ -14,8 +15,19 @@ import matplotlib as mpl
 mpl.use('Agg') #silent mode
 from matplotlib import pyplot as plt
 
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from coreTraj import open_mmap, skip_lines, index_file
+
 """
 Author: Jiayan Xu
+Description:
+    REPORT of constrained MD (blue-moon) and umbrella sampling. The file is
+    memory-mapped and scanned once for the byte offsets of blocks of each
+    complete MD step, only the offsets are kept in a sidecar by coreTraj, so
+    a REPORT that is still growing only has its new steps scanned. Values
+    (nsteps, ncon, nfields) are decoded in chunks straight into a memory-
+    mapped .npy and text files are written from it chunk by chunk.
 """
 
 NLINTRO = 50 # number of lines in intro part
@@ -26,6 +38,188 @@ MAXFRAME = 100000
 
 BINWIDTH = 0.005
 
+CHUNK = 10000 # steps decoded at once
+
+SEED_MARKER = b'\n           RANDOM_SEED'
+
+# block marker, lines skipped before values, prefix of value lines
+US_BLOCKS = [(b'\n  >Metadynamics', 1, b'   fic_p>')]
+BM_BLOCKS = [(b'\n  >Const_coord', 1, b'   cc>'), (b'\n  >Blue_moon', 2, None)]
+
+US_FIELDS = ['coord']
+BM_FIELDS = ['coord', 'lamb', 'zdet', 'gkt', 'zg']
+
+REPORT_KEYS = ['offsets']
+
+
+def read_report_intro(mm):
+    """type of REPORT (US or BM) and the offset after intro lines"""
+    ftype, pos = None, 0
+    for i in range(NLINTRO):
+        end = mm.find(b'\n', pos)
+        if end == -1:
+            break
+        line = mm[pos:end].decode()
+        pos = end + 1
+        if line.startswith('                MDALGO'):
+            tag = (line.strip().split())[-1]
+            if tag.isdigit():
+                tag = int(tag)
+            elif tag == '**':
+                tag = 21
+            else:
+                raise ValueError('MDALGO should be an integer.')
+
+            if tag == 2 or tag == 26:
+                ftype = 'BM'
+            elif tag == 21 or tag == 27:
+                ftype = 'US'
+            else:
+                raise ValueError('Unsupported MDALGO REPROT.')
+        if line.startswith('   original number of atomic DOF'):
+            # number of constraints and active DOF
+            pos = skip_lines(mm, pos, 2)
+            break
+    else:
+        raise ValueError('Intro lines in REPORT may be incorrect.')
+
+    if ftype is None or pos == -1:
+        raise ValueError('Intro lines in REPORT may be incorrect.')
+
+    return ftype, pos
+
+
+def count_constraints(mm, pos, ftype):
+    """number of value lines in the first block"""
+    marker, nskip, prefix = (US_BLOCKS if ftype == 'US' else BM_BLOCKS)[0]
+    pos = mm.find(marker, pos)
+    if pos == -1:
+        return 0
+    pos = skip_lines(mm, pos+1, nskip)
+    for j in range(MAXCON):
+        end = mm.find(b'\n', pos)
+        if not mm[pos:end].startswith(prefix):
+            return j
+        pos = end + 1
+    raise ValueError('Too many lines in >Metadynamics.')
+
+
+def decode_blocks(mm, offsets, nskip, ncon):
+    """tokens of ncon lines after each marker, (nsteps, ncon, ntokens)"""
+    blocks = []
+    for pos in offsets:
+        start = skip_lines(mm, pos+1, nskip)
+        blocks.append(mm[start:skip_lines(mm, start, ncon)])
+    tokens = np.array(b''.join(blocks).split())
+
+    return tokens.reshape(len(offsets), ncon, -1)
+
+
+def decode_steps(mm, offsets, ftype, ncon):
+    """values of steps from block offsets, (nsteps, ncon, nfields)"""
+    if ftype == 'US':
+        # fic_p> ... coord
+        coords = decode_blocks(mm, offsets[0], 1, ncon)
+        values = coords[:,:,-1:].astype(float)
+    else:
+        # cc> tag val val tol, b_m> lamb |z| GkT |z|^*()
+        coords = decode_blocks(mm, offsets[0], 1, ncon)
+        bluemoon = decode_blocks(mm, offsets[1], 2, ncon)
+        values = np.concatenate((coords[:,:,2:3].astype(float), \
+                bluemoon[:,:,1:5].astype(float)), axis=2)
+
+    return values
+
+
+def scan_report(mm, start=0, previous=None):
+    """
+    offsets of blocks (nsteps, nblocks) of complete MD steps (ending with
+    RANDOM_SEED) after the byte offset start
+    """
+    ftype, intro = read_report_intro(mm)
+    if previous is None:
+        start = intro
+        ncon = count_constraints(mm, intro, ftype)
+    else:
+        ncon = int(previous['ncon'])
+    blocks = US_BLOCKS if ftype == 'US' else BM_BLOCKS
+
+    offsets = [[] for block in blocks]
+
+    pos, end = start, start
+    while True:
+        seed = mm.find(SEED_MARKER, pos)
+        if seed == -1:
+            break
+        step_end = skip_lines(mm, seed+1, 1)
+        if step_end == -1:
+            break # last step is still being written
+        found = [mm.find(block[0], pos, seed) for block in blocks]
+        if -1 not in found:
+            for i, p in enumerate(found):
+                offsets[i].append(p)
+        pos = end = step_end
+
+    results = {
+        'ftype': np.array(ftype),
+        'ncon': np.array(ncon, dtype=np.int64),
+        'offsets': np.array(offsets, dtype=np.int64).T.reshape(-1, len(blocks))
+    }
+
+    return results, end
+
+
+def index_report(fname='REPORT'):
+    return index_file(fname, 'report_offsets', scan_report, REPORT_KEYS)
+
+
+def iread_steps(mm, offsets, ftype, ncon):
+    """yield values of steps at offsets (nsteps, nblocks) CHUNK by CHUNK"""
+    for i in range(0, len(offsets), CHUNK):
+        yield decode_steps(mm, offsets[i:i+CHUNK].T, ftype, ncon)
+
+
+def write_npy(npyfile, fname, index, nsteps):
+    """
+    decode the first nsteps steps chunk by chunk into a memory-mapped .npy,
+    return it opened read-only
+    """
+    ftype, ncon = str(index['ftype']), int(index['ncon'])
+    nfields = len(US_FIELDS if ftype == 'US' else BM_FIELDS)
+
+    data = np.lib.format.open_memmap(npyfile, mode='w+', \
+            dtype=float, shape=(nsteps, ncon, nfields))
+    mm = open_mmap(fname)
+    start = 0
+    for values in iread_steps(mm, index['offsets'][:nsteps], ftype, ncon):
+        data[start:start+len(values)] = values
+        start += len(values)
+    mm.close()
+    data.flush()
+    del data
+
+    return np.load(npyfile, mmap_mode='r')
+
+
+def write_dat(datfile, content, columns, row_format, start=0, end='\n'):
+    """
+    write a header and rows of step and columns (nsteps, ncols) from start
+    joined by newlines, chunk by chunk
+    """
+    with open(datfile, 'w') as writer:
+        writer.write(content)
+        for i in range(start, len(columns), CHUNK):
+            if i > start:
+                writer.write('\n')
+            rows = np.column_stack((np.arange(i+1, i+1+len(columns[i:i+CHUNK])), \
+                    columns[i:i+CHUNK]))
+            writer.write('\n'.join(row_format %tuple(row) for row in rows))
+        if len(columns) > start:
+            writer.write(end)
+
+    return
+
+
 class Report(object):
     def __init__(self, fname='REPORT'):
         # self.ftype = 'US' # filetype US or BM
@@ -35,26 +229,80 @@ class Report(object):
         else:
             raise ValueError('%s does not exist.' %fname)
 
-    def parse_report(self, datfile, nframe, ndrop):
-        reader = open(self.fname, 'r')
-
-        reader, ftype, ncon = self.parse_intro(reader)
-        reader, ncon = self.parse_fstep(reader, ftype)
+    def index(self):
+        """block offsets of steps, the REPORT is only scanned if it changes"""
+        index = index_report(self.fname)
+        self.ftype, self.ncon = str(index['ftype']), int(index['ncon'])
+
+        return index
+
+    def count(self, index, nframe=-1):
+        """number of steps up to nframe (all if not positive)"""
+        nsteps = len(index['offsets'])
+        if nframe > 0:
+            nsteps = min(nsteps, nframe)
+
+        return nsteps
+
+    def read(self, nframe=-1, ndrop=0):
+        """
+        values of steps from ndrop to nframe (all if not positive) in memory,
+        (nsteps, ncon, nfields), only these steps are decoded
+        """
+        index = self.index()
+        offsets = index['offsets'][max(ndrop,0):self.count(index, nframe)]
+
+        mm = open_mmap(self.fname)
+        nfields = len(US_FIELDS if self.ftype == 'US' else BM_FIELDS)
+        values = np.concatenate([np.zeros((0, self.ncon, nfields))] + \
+                list(iread_steps(mm, offsets, self.ftype, self.ncon)))
+        mm.close()
+
+        return values
+
+    def tail(self, interval=10.0, nframe=-1):
+        """
+        yield values of new steps while the REPORT is growing, each poll
+        only scans the bytes after the last complete step
+        """
+        index = self.index()
+        previous = {'ncon': index['ncon']}
+        offsets, end = index['offsets'], int(index['end'])
+
+        nsteps = 0
+        while True:
+            if nframe > 0:
+                offsets = offsets[:nframe-nsteps]
+            if len(offsets) > 0:
+                mm = open_mmap(self.fname)
+                for values in iread_steps(mm, offsets, self.ftype, self.ncon):
+                    yield values
+                mm.close()
+                nsteps += len(offsets)
+            if nframe > 0 and nsteps >= nframe:
+                break
+            time.sleep(interval)
+            mm = open_mmap(self.fname)
+            results, end = scan_report(mm, end, previous)
+            mm.close()
+            offsets = results['offsets']
+
+    def parse_report(self, datfile, nframe, ndrop, text=True):
+        index = self.index()
+        ftype, ncon = self.ftype, self.ncon
+        nsteps = self.count(index, nframe)
+        if nsteps < nframe:
+            print('%s only has %d steps.' %(self.fname, nsteps))
+
+        if datfile:
+            bname = (datfile.split('.'))[0] # /root/home/US.dat
+        else:
+            bname = 'US' if ftype == 'US' else 'BM-'
+        # values are memory-mapped, text is written from them chunk by chunk
+        values = write_npy(bname+'.npy', self.fname, index, nsteps)
 
         if ftype == 'US':
-            #if os.path.exists(datfile):
-            #    print('%s already exists.' %datfile)
-            #    return
-            # read reaction coordinates
-            tot_coords = []
-            for i in range(nframe):
-                reader, coords, tend = self.parse_us_step(reader, ncon)
-                if tend:
-                    print('%s only has %d steps.' %(self.fname, i))
-                    break
-                tot_coords.append(coords)
-            # print(tot_coords)
-            tot_coords = np.array(tot_coords)
+            tot_coords = values[:,:,0]
 
             # write to full/drop dat
             cmins, cmaxs = [], []
@@ -67,208 +315,31 @@ class Report(object):
                 cmaxs.append(cmax)
             self.cmins, self.cmaxs = cmins, cmaxs
 
-            con_list = []
-            for i, coords in enumerate(tot_coords):
-                con_list.append(('{:<8d}'+'{:>12.8f}'*ncon)\
-                        .format(i+1, *coords))
-            if datfile:
-                bname = (datfile.split('.'))[0] # /root/home/US.dat
-            else:
-                bname = 'US'
-            with open(bname+'.dat', 'w') as writer:
-                writer.write(content+'\n'.join(con_list))
-            if ndrop > 0:
-                with open(bname+'-drop.dat', 'w') as writer:
-                    writer.write(content+'\n'.join(con_list[ndrop:]))
+            if text:
+                # no newline after the last row
+                row_format = '%-8d' + '%12.8f'*ncon
+                datfile = bname+'.dat'
+                write_dat(datfile, content, tot_coords, row_format, end='')
+                if ndrop > 0:
+                    write_dat(bname+'-drop.dat', content, tot_coords, \
+                            row_format, start=ndrop, end='')
             data = tot_coords
         elif ftype == 'BM':
-            tot_coords, tot_lambs = [], []
-            tot_zdets, tot_gkts, tot_zgs = [], [], []
-            for i in range(nframe):
-                reader, coords, lambs, zdets, gkts, zgs, tend = \
-                        self.parse_bm_step(reader, ncon)
-                if tend:
-                    print('%s only has %d steps.' %(self.fname, i))
-                    break
-                tot_coords.append(coords)
-                tot_lambs.append(lambs)
-                tot_zdets.append(zdets)
-                tot_gkts.append(gkts)
-                tot_zgs.append(zgs)
-            tot_coords = np.array(tot_coords)
-            tot_lambs = np.array(tot_lambs)
-            tot_zdets = np.array(tot_zdets)
-            tot_gkts = np.array(tot_gkts)
-            tot_zgs = np.array(tot_zgs)
+            data = [values[:,:,i] for i in range(len(BM_FIELDS))]
 
             # write to file
-            if datfile:
-                bname = (datfile.split('.'))[0] # /root/home/US.dat
-            else:
-                bname = 'BM-'
-
+            content = ('# '+'{:<8s}'*6+'\n')\
+                .format('Step', 'Coord', 'Lamb', '|Z|', 'GkT', '|Z|^*()')
             for n in range(ncon):
-                content = ('# '+'{:<8s}'*6+'\n')\
-                    .format('Step', 'Coord', 'Lamb', '|Z|', 'GkT', '|Z|^*()')
-                for i, (coord, lamb, zdet, gkt, zg) in enumerate(
-                    zip(tot_coords[:,n],tot_lambs[:,n],\
-                        tot_zdets[:,n],tot_gkts[:,n],tot_zgs[:,n])):
-                    content += ('{:<8d}'+'  {:>8.4f}'*5+'\n')\
-                        .format(i+1, coord, lamb, zdet, gkt, zg)
+                if not text:
+                    break
                 datfile = bname+str(n+1)+'.dat'
-                with open(datfile, 'w') as writer:
-                    writer.write(content)
-
-            data = [tot_coords, tot_lambs, tot_zdets, tot_gkts, tot_zgs]
+                write_dat(datfile, content, values[:,n,:], '%-8d'+'  %8.4f'*5)
 
-        reader.close()
         print('Read %s and Write %s.' %(self.fname, datfile))
 
         return ftype, data
 
-    @staticmethod
-    def parse_intro(reader):
-        """parse intro lines in REPORT"""
-        for i in range(NLINTRO):
-            line = reader.readline()
-            if line.startswith('                MDALGO'):
-                tag = (line.strip().split())[-1]
-                if tag.isdigit():
-                    tag = int(tag)
-                elif tag == '**':
-                    tag = 21
-                else:
-                    raise ValueError('MDALGO should be an integer.')
-
-                if tag == 2 or tag == 26:
-                    ftype = 'BM'
-                elif tag == 21 or tag == 27:
-                    ftype = 'US'
-                else:
-                    raise ValueError('Unsupported MDALGO REPROT.')
-            #print(line, end='')
-            if line.startswith('   original number of atomic DOF'):
-                ndof_org = int((line.strip().split())[-1])
-                #
-                line = reader.readline()
-                ncon = int((line.strip().split())[-1])
-                line = reader.readline()
-                ndof_act = int((line.strip().split())[-1])
-                #print(ndof_org, ncon, ndof_act)
-                #print(ftype)
-                break
-        else:
-            raise ValueError('Intro lines in REPORT may be incorrect.')
-
-        return reader, ftype, ncon
-
-    @staticmethod
-    def parse_fstep(reader, ftype):
-        curln = reader.tell()
-        """read first step"""
-        if ftype == 'US':
-            for i in range(NLSTEP):
-                line = reader.readline()
-                if line.startswith('  >Metadynamics'):
-                    coords = []
-                    for j in range(MAXCON):
-                        line = reader.readline()
-                        if line.startswith('   fic_p>'):
-                            coord = float((line.strip().split())[-1])
-                        else:
-                            ncon = j
-                            break
-                    else:
-                        raise ValueError('Too many lines in >Metadynamics.')
-                if line.startswith('           RANDOM_SEED'):
-                    break
-            else:
-                raise ValueError('Too many lines in =MD STEP=.')
-        elif ftype == 'BM':
-            for i in range(NLSTEP):
-                line = reader.readline()
-                if line.startswith('  >Const_coord'):
-                    coords = []
-                    for j in range(MAXCON):
-                        line = reader.readline()
-                        if line.startswith('   cc>'):
-                            # cc> tag val val tol
-                            coord = float((line.strip().split())[2])
-                        else:
-                            ncon = j
-                            break
-                    else:
-                        raise ValueError('Too many lines in >Metadynamics.')
-                if line.startswith('           RANDOM_SEED'):
-                    break
-            else:
-                raise ValueError('Too many lines in =MD STEP=.')
-
-        reader.seek(curln)
-
-        return reader, ncon
-
-    @staticmethod
-    def parse_us_step(reader, ncon):
-        """read US step"""
-        tend = False # if read to the end line
-        coords = []
-        for i in range(NLSTEP):
-            line = reader.readline()
-            if not line:
-                tend = True
-                break
-                # raise ValueError('dsad')
-            # print(line, end='')
-            if line.startswith('  >Metadynamics'):
-                for j in range(ncon):
-                    line = reader.readline()
-                    coord = float((line.strip().split())[-1])
-                    coords.append(coord)
-            #if line.startswith('           RANDOM_SEED'):
-            if line.startswith('           RANDOM_SEED'):
-                # line = reader.readline()
-                break
-        else:
-            raise ValueError('Too many lines in =MD STEP=.')
-
-        return reader, coords, tend
-
-    @staticmethod
-    def parse_bm_step(reader,ncon):
-        """read BM step"""
-        tend = False # if read to the end line
-        coords, lambs, zdets, gkts, zgs = [], [], [], [], []
-
-        for i in range(NLSTEP):
-            line = reader.readline()
-            if not line:
-                tend = True
-                break
-                # raise ValueError('dsad')
-            # print(line, end='')
-            if line.startswith('  >Const_coord'):
-                for j in range(ncon):
-                    line = reader.readline()
-                    coord = float((line.strip().split())[2])
-                    coords.append(coord)
-            if line.startswith('  >Blue_moon'):
-                line = reader.readline() # comment line
-                for j in range(ncon):
-                    line = reader.readline()
-                    vals = [float(val) for val in (line.strip().split())[1:]]
-                    lambs.append(vals[0])
-                    zdets.append(vals[1])
-                    gkts.append(vals[2])
-                    zgs.append(vals[3])
-            if line.startswith('           RANDOM_SEED'):
-                # line = reader.readline()
-                break
-        else:
-            raise ValueError('Too many lines in =MD STEP=.')
-
-        return reader, coords, lambs, zdets, gkts, zgs, tend
-
 def read_input(infile, ndrop):
     with open(infile, 'r') as reader:
         lines = reader.readlines()
@@ -321,7 +392,12 @@ def read_input2(infile, ndrop):
     return
 
 def read_usdat(datfile):
-    """"""
+    """step and coords from US.dat or the memory-mapped US.npy"""
+    if datfile.endswith('.npy'):
+        values = np.load(datfile, mmap_mode='r')
+        steps = np.arange(1, len(values)+1)
+        return np.column_stack((steps, values[:,:,0]))
+
     with open(datfile, 'r') as reader:
         lines = reader.readlines()
     lines = [line.strip().split() for line in lines \
@@ -425,8 +501,13 @@ if __name__ == '__main__':
 
     #parser.add_argument('-n', '--ncons', type=int, \
     #        help='Number of Constraints')
-    #parser.add_argument('-nf', '--nframe', type=int, \
-    #        help='Number of Steps to Average')
+    parser.add_argument('-nf', '--nframe', type=int, \
+            default=MAXFRAME, help='Number of Steps to Read, all if not positive')
+    parser.add_argument('-nt', '--notext', action='store_true', \
+            help='only write binary .npy without text .dat')
+    parser.add_argument('-f', '--follow', type=float, nargs='?', \
+            const=10.0, default=None, \
+            help='follow a growing REPORT, check every FOLLOW seconds')
     parser.add_argument('-p', '--para', type=int, nargs='*',\
             default=[-1], help='plot the p-th collective variable')
 
@@ -437,12 +518,20 @@ if __name__ == '__main__':
     #report.parse_report(nframe=3)
 
     #read_input('METADATA', ndrop=1000)
-    if args.repo:
+    if args.repo and args.follow:
+        report = Report(args.repo)
+        nsteps = 0
+        for values in report.tail(args.follow, args.nframe):
+            nsteps += len(values)
+            print('%8d steps, last %s' %(nsteps, \
+                    ' '.join('%12.8f' %v for v in values[-1,:,0])))
+    elif args.repo:
         report = Report(args.repo)
-        ftype, data = report.parse_report(None, nframe=MAXFRAME, ndrop=args.ndrop)
+        ftype, data = report.parse_report(None, nframe=args.nframe, \
+                ndrop=args.ndrop, text=not args.notext)
         if args.para[0] != -1:
             if ftype == 'US':
-                plot_usdata('US.dat', args.para)
+                plot_usdata('US.dat' if not args.notext else 'US.npy', args.para)
             elif ftype == 'BM':
                 plot_bmdata(data, args.para)
                 if args.ndrop != -1:
@@ -2,12 +2,17 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
 import time 
 
 import argparse
 
 import numpy as np
 
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from coreTraj import read_ani
+
 """
 Author: Jiayan Xu
 Description:
@@ -56,54 +61,44 @@ def mat2lat(poscar='POSCAR'):
 
 
 def ani2arc(ani='OUT.ANI', frame=None):
-    # select frame
+    # select frame, count from 1 and negative from the end
+    selection = None
     if frame:
         frame = int(frame)
+        selection = frame - 1 if frame > 0 else frame
 
     # read lattice
     lx, ly, lz, alpha, beta, gamma, trans_matrix = mat2lat()
 
-    # number of atoms
-    with open(ani, 'r') as reader:
-        natoms = int(reader.readline())
+    # read selected frames through the frame index
+    frames = read_ani(ani, selection)
 
     # read each frame
     count = 0 # number of frames
     content = '!BIOSYM archive 3\nPBC=ON\n'
-
-    reader = open(ani, 'r') 
-    for i, line in enumerate(reader):
-        # read coordinates
-        if i % (natoms+2) == 0:
-            # write time
-            cur_content = ('%80.4f\n' % 0.0)
-            cur_content += '!DATE     %s\n' \
-                    %time.asctime( time.localtime(time.time()))
-            # write crystal
-            cur_content += 'PBC%10.4f%10.4f%10.4f%10.4f%10.4f%10.4f\n' %\
-                    (lx, ly, lz, alpha, beta, gamma)
-        elif 1 < i%(natoms+2):
-            # write coordinates
-            line = line.strip().split()
-            atom = line[0]
-            coord = np.array(line[1:4], dtype=float) # a long x or b along y
-            coord = dot(trans_matrix, coord.T)
+    for atoms, coords in frames:
+        # write time
+        cur_content = ('%80.4f\n' % 0.0)
+        cur_content += '!DATE     %s\n' \
+                %time.asctime( time.localtime(time.time()))
+        # write crystal
+        cur_content += 'PBC%10.4f%10.4f%10.4f%10.4f%10.4f%10.4f\n' %\
+                (lx, ly, lz, alpha, beta, gamma)
+        # write coordinates, a long x or b along y
+        coords = dot(trans_matrix, coords.T).T
+        for atom, coord in zip(atoms, coords):
             cur_content += '%2s%16.9f%16.9f%16.9f%5s%2d%8s%8s%7.3f\n' %\
                     (atom, coord[0], coord[1], coord[2],
                     'XXXX', 1, 'xx', atom, 0.0)
         # add frame to content
-        if (i+1) % (natoms+2) == 0:
-            cur_content += 'end\nend\n'
-            count += 1
-            if frame and count == frame:
-                content = '!BIOSYM archive 3\nPBC=ON\n' + cur_content
-                print('Select Frame %d.' %count)
-                break
-            content += cur_content
-            print('Write Frame %8d ...' %count, end='\r')
+        cur_content += 'end\nend\n'
+        count += 1
+        content += cur_content
+        print('Write Frame %8d ...' %count, end='\r')
     print('Write Frame %8d ...' %count, end='\r')
 
-    reader.close()
+    if frame:
+        print('Select Frame %d.' %frame)
 
     # write arc to file
     if frame:
@@ -10,6 +10,12 @@ import argparse
 import numpy as np
 from scipy import integrate
 
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from coreOUTCAR import iread_outcar
+from coreTraj import write_chunks
+from corePBC import adjust_poses
+
 pi = np.pi
 
 norm = np.linalg.norm
@@ -26,53 +32,6 @@ This script writes arc format file using positions in OUTCAR. During
 convertion, positions will be adjusted according to the reference POSCAR.
 """
 
-MAXFRAME = 100000 # maximum steps in outcar, this is a very large number for safe
-
-def read_outcar(outcar='OUTCAR',natoms=100,verbose=True,wdat=False,**kwargs):
-    # how many steps to read
-    nframes = MAXFRAME
-    if kwargs:
-        if 'nframes' in kwargs.keys():
-            if kwargs['nframes'] > 0:
-                nframes = int(kwargs['nframes'])
-
-    # read OUTCAR
-    frames = []
-    fopen = open(outcar, 'r')
-    count, flag = 0, True
-    while flag:
-        line = fopen.readline()
-        if line.startswith(' POSITION'):
-            fopen.readline() # segment line ---...---
-            poses, forces = [], []
-            for n in range(natoms):
-                data = fopen.readline().strip().split()
-                poses.append(data[:3]) # x y z
-                forces.append(data[3:]) # fx fy fz
-            poses = np.array(poses, dtype=float)
-            forces = np.array(forces, dtype=float)
-            frames.append((poses, forces))
-            count += 1
-        if count == nframes or (not line):
-            flag = False
-    fopen.close()
-    
-    if verbose:
-        print('Successfully read OUTCAR, get positions and forces ...')
-    
-    # out datfile ?
-    if wdat:
-        for i, d in enumerate(data):
-            content = '#\n'
-            for j in range(nsteps):
-                pos, force = data[i][0][j], data[i][1][j]
-                content += ('{:<12.4f}'*6+'\n').format(*pos, *force)
-            with open('atom-'+str(i+1)+'.dat', 'w') as writer:
-                writer.write(content)
-            break
-
-    return frames
-
 def read_poscar(poscar='POSCAR',format='vasp5',verbose=True):
     """read POSCAR"""
     with open(poscar, 'r') as reader:
@@ -103,53 +62,54 @@ def read_poscar(poscar='POSCAR',format='vasp5',verbose=True):
     return fname, scaling, lattice, symbols, numbers, poses, fixes
 
 
-def adjust_poses(poses,refposes):
-    """poses, poses_ref should be in direct"""
-    # atoms, take last step as reference
-    for i in range(len(poses)):
-        for x in range(3):
-            move = round(poses[i][x] - refposes[i][x], 0)
-            poses[i][x] -= move
-    refposes = poses.copy()
-
-    return poses, refposes
-
-def write_arc(frames,refposes,atoms,lattice,cell_para,trans,arcname,adjust):
-    content = '!BIOSYM archive 3\nPBC=ON\n'
-    for i, frame in enumerate(frames):
-        # adjust positions
-        poses = frame[0] # cartesian coordinates
-        if adjust:
-            dirposes = dot(poses, inv(lattice))
-            dirposes, refposes = adjust_poses(dirposes, refposes)
-            poses = dot(dirposes, lattice)
-
-        # write time
-        content += ('%80.4f\n' % 0.0)
-        content += '!DATE     %s\n' \
-            %time.asctime( time.localtime(time.time()))
-
-        # write crystal
-        content += ('PBC'+'{:>10.4f}'*6+'\n').format(*cell_para)
-
-        for atom, coord in zip(atoms, poses):
-            coord = dot(trans, coord.T)
-            content += '%2s%16.9f%16.9f%16.9f%5s%2d%8s%8s%7.3f\n' %\
-                (atom, coord[0], coord[1], coord[2],
-                'XXXX', 1, 'xx', atom, 0.0)
-        content += 'end\nend\n'
-        print('Writing frame %d ...' %(i+1), end='\r')
-    print('Writing frame %d ...' %(i+1))
-
-    arcname = os.path.basename(os.getcwd()) + '-ref.arc'
-    with open(arcname, 'w') as writer:
-        writer.write(content)
+def adjust_frames(frames,refposes,lattice):
+    """unwrap positions frame by frame taking the previous one as reference"""
+    for frame in frames:
+        poses = frame['positions'] # cartesian coordinates
+        dirposes = dot(poses, inv(lattice))
+        dirposes, refposes = adjust_poses(dirposes, refposes)
+        frame['positions'] = dot(dirposes, lattice)
+        yield frame
+
+def write_arc(frames,refposes,atoms,lattice,cell_para,trans,arcname,adjust,\
+        chunk_size=100):
+    # adjust positions
+    if adjust:
+        frames = adjust_frames(frames, refposes, lattice)
+
+    def frame_contents(frames):
+        yield '!BIOSYM archive 3\nPBC=ON\n'
+        for i, frame in enumerate(frames):
+            poses = frame['positions'] # cartesian coordinates
+
+            # write time
+            content = ('%80.4f\n' % 0.0)
+            content += '!DATE     %s\n' \
+                %time.asctime( time.localtime(time.time()))
+
+            # write crystal
+            content += ('PBC'+'{:>10.4f}'*6+'\n').format(*cell_para)
+
+            for atom, coord in zip(atoms, dot(poses, trans.T)):
+                content += '%2s%16.9f%16.9f%16.9f%5s%2d%8s%8s%7.3f\n' %\
+                    (atom, coord[0], coord[1], coord[2],
+                    'XXXX', 1, 'xx', atom, 0.0)
+            content += 'end\nend\n'
+            print('Writing frame %d ...' %(i+1), end='\r')
+            yield content
+
+    # named after the working directory without a given name
+    if arcname is None:
+        arcname = os.path.basename(os.getcwd()) + '-ref.arc'
+    count = write_chunks(arcname, frame_contents(frames), chunk_size)
+    print('Writing frame %d ...' %(count-1))
 
     print('Successfully write positions in OUTCAR to %s.' %arcname)
 
     return
 
-def out2arc(outcar='OUTCAR',poscar='POSCAR',nframes=100,arcname='vasp.arc',adjust=False):
+def out2arc(outcar='OUTCAR',poscar='POSCAR',nframes=100,arcname=None,adjust=False,\
+        chunk_size=100):
     """ outcar to arc"""
     # read POSCAR
     fname, scaling, lattice, symbols, numbers, refposes, fixes = \
@@ -182,10 +142,11 @@ def out2arc(outcar='OUTCAR',poscar='POSCAR',nframes=100,arcname='vasp.arc',adjus
     for s, n in zip(symbols, numbers):
         atoms.extend([s]*n)
 
-    # read OUTCAR and write
-    frames = read_outcar(outcar=outcar,natoms=natoms,nframes=nframes)
+    # read OUTCAR and write, frames are streamed from reader to writer
+    frames = iread_outcar(outcar=outcar,natoms=natoms,nframes=nframes)
 
-    write_arc(frames,refposes,atoms,lattice,cell_para,trans_matrix,arcname,adjust)
+    write_arc(frames,refposes,atoms,lattice,cell_para,trans_matrix,arcname,adjust,\
+            chunk_size)
 
 
 if __name__ == '__main__':
@@ -196,14 +157,16 @@ if __name__ == '__main__':
             help='POSCAR File')
     parser.add_argument('-o', '--out', nargs='?', default='OUTCAR', \
             help='OUTCAR File')
-    parser.add_argument('-a', '--arc', nargs='?', default='vasp.arc', \
-            help='ARC File')
+    parser.add_argument('-a', '--arc', nargs='?', default=None, \
+            help='ARC File, DIRNAME-ref.arc by default')
     parser.add_argument('-ad', '--adjust', nargs=1, default=False, \
             type=bool, help='Number of Frames')
     parser.add_argument('-nf', '--nframes', nargs='?', default=-100, \
             type=int, help='Number of Frames')
+    parser.add_argument('-cs', '--chunk-size', default=100, \
+            type=int, help='Number of Frames per Write')
 
     args = parser.parse_args()
 
-    out2arc(args.out,args.pos,args.nframes,args.adjust)
+    out2arc(args.out,args.pos,args.nframes,args.arc,args.adjust,args.chunk_size)
 
@@ -129,17 +129,6 @@ def read_poscar(poscar='POSCAR',format='vasp5',verbose=True):
     return fname, scaling, lattice, symbols, numbers, poses, fixes
 
 
-def adjust_poses(poses,refposes):
-    """poses, poses_ref should be in direct"""
-    # atoms, take last step as reference
-    for i in range(len(poses)):
-        for x in range(3):
-            move = round(poses[i][x] - refposes[i][x], 0)
-            poses[i][x] -= move
-    refposes = poses.copy()
-
-    return poses, refposes
-
 def adjust_coordinates():
 
     return
@@ -13,6 +13,8 @@ from scipy import integrate
 sys.path.append(os.path.join(os.getenv("HOME"), \
         'repository/DailyScripts/common'))
 from coreXYZ import write_xyz
+from coreOUTCAR import iread_outcar
+from coreTraj import write_chunks
 
 import ase.units
 
@@ -32,104 +34,9 @@ This script writes arc format file using positions in OUTCAR. During
 convertion, positions will be adjusted according to the reference POSCAR.
 """
 
-MAXFRAME = 100000 # maximum steps in outcar, this is a very large number for safe
-
 def wrap_frame_results():
     return frame_results
 
-def read_outcar(outcar='OUTCAR',natoms=100,verbose=True,wdat=False,**kwargs):
-    """
-    in each frame,
-    coordinates, forces, stress will be read
-    """
-    # 
-    required_properties = ['positions', 'forces', 'energy', 'free_energy']
-    additional_properties = ['stress']
-
-    # how many steps to read
-    nframes = MAXFRAME
-    if kwargs:
-        if 'nframes' in kwargs.keys():
-            if kwargs['nframes'] > 0:
-                nframes = int(kwargs['nframes'])
-
-    # read OUTCAR
-    frames = []
-    cur_results = {}
-    fopen = open(outcar, 'r')
-    count, flag = 0, True
-    while True:
-        line = fopen.readline()
-        if line.strip().startswith('in kB'): # kB means kilobar equals 0.1 GPa
-            # XX YY ZZ XY YZ ZX
-            stress = -np.array([float(d) for d in line.strip().split()[2:]])
-            # vigot notation, XX YY ZZ YZ XZ XY
-            stress_vigot = stress[[0,1,2,4,5,3]]*1e-1*ase.units.GPa # in eV/AA^3
-            stress = []
-            for n in [0,5,4,5,1,3,4,3,2]:
-                stress.append(stress_vigot[n])
-            stress = np.array(stress).reshape(3,3)
-            cur_results['stress'] = stress
-            #print(stress)
-        if line.startswith(' POSITION'):
-            fopen.readline() # segment line ---...---
-            poses, forces = [], []
-            for n in range(natoms):
-                data = fopen.readline().strip().split()
-                poses.append(data[:3]) # x y z
-                forces.append(data[3:]) # fx fy fz
-            poses = np.array(poses, dtype=float)
-            forces = np.array(forces, dtype=float)
-            cur_results['positions'] = poses
-            cur_results['forces'] = forces
-        if line.strip().startswith('FREE ENERGIE OF THE ION-ELECTRON SYSTEM'):
-            fopen.readline() # segment line ---...---
-            # free energy F
-            data = fopen.readline().strip().split()
-            free_energy = float(data[-2])
-            cur_results['free_energy'] = free_energy
-            fopen.readline() # blank line
-            # energy E0
-            data = fopen.readline().strip().split()
-            energy = float(data[-1])
-            cur_results['energy'] = energy
-
-        # check if read one frame successfully 
-        for prop in required_properties:
-            if prop not in cur_results:
-                break
-        else:
-            count += 1
-            frames.append(cur_results)
-            cur_results = {}
-
-        if line:
-            if count == nframes:
-                flag = False
-                break
-        else:
-            flag = False
-            break
-            # raise ValueError('position and energy not ')
-
-    fopen.close()
-    
-    if verbose:
-        print('Successfully read OUTCAR, get positions and forces ...')
-    
-    # out datfile ?
-    #if wdat:
-    #    for i, d in enumerate(data):
-    #        content = '#\n'
-    #        for j in range(nsteps):
-    #            pos, force = data[i][0][j], data[i][1][j]
-    #            content += ('{:<12.4f}'*6+'\n').format(*pos, *force)
-    #        with open('atom-'+str(i+1)+'.dat', 'w') as writer:
-    #            writer.write(content)
-    #        break
-
-    return frames
-
 def read_poscar(poscar='POSCAR',format='vasp5',verbose=True):
     """read POSCAR"""
     with open(poscar, 'r') as reader:
@@ -160,24 +67,13 @@ def read_poscar(poscar='POSCAR',format='vasp5',verbose=True):
     return fname, scaling, lattice, symbols, numbers, poses, fixes
 
 
-def adjust_poses(poses,refposes):
-    """poses, poses_ref should be in direct"""
-    # atoms, take last step as reference
-    for i in range(len(poses)):
-        for x in range(3):
-            move = round(poses[i][x] - refposes[i][x], 0)
-            poses[i][x] -= move
-    refposes = poses.copy()
-
-    return poses, refposes
-
 def adjust_coordinates():
 
     return
 
 
 def out2xyz(outcar='OUTCAR',poscar='POSCAR',descrp='vasp',\
-        nframes=100,xyz_fname=None):
+        nframes=100,xyz_fname=None,selection=None,chunk_size=100):
     """ outcar to arc"""
     # read POSCAR
     fname, scaling, lattice, formula, numbers, refposes, fixes = \
@@ -212,32 +108,27 @@ def out2xyz(outcar='OUTCAR',poscar='POSCAR',descrp='vasp',\
     for s, n in zip(formula, numbers):
         symbols.extend([s]*n)
 
-    # read OUTCAR and write
-    frames = read_outcar(outcar=outcar,natoms=natoms,nframes=nframes)
-
-    stride = 1
-    content = ''
-    for i, results in enumerate(frames):
-        #positions = adjust_coordinates(lattice,)
-        if i%stride == 0:
-            # TODO: coordinate system, be careful with forces
-            #positions = 
-            #print(energy[i])
-            #print(results['energy'])
-            results.update(symbols=symbols)
-            results.update(Lattice=lattice)
-            results.update(pbc=['T','T','T'])
-            results.update(step=i+1)
-            if 'stress' in results.keys():
-                results.update(virial=-results['stress']*vol)
-            content += write_xyz(**results)
+    # read OUTCAR and write, frames are streamed from reader to writer
+    frames = iread_outcar(outcar=outcar,natoms=natoms,nframes=nframes,\
+            selection=selection)
+
+    def frame_contents(frames, stride=1):
+        for i, results in enumerate(frames):
+            if i%stride == 0:
+                # TODO: coordinate system, be careful with forces
+                results.update(symbols=symbols)
+                results.update(Lattice=lattice)
+                results.update(pbc=['T','T','T'])
+                if 'stress' in results.keys():
+                    results.update(virial=-results['stress']*vol)
+                yield write_xyz(**results)
 
     if not xyz_fname:
         xyz_fname = os.path.basename(os.getcwd()) + '-ref.xyz'
 
-    with open(xyz_fname, 'w') as writer:
-        writer.write(content)
+    count = write_chunks(xyz_fname, frame_contents(frames), chunk_size)
 
+    print('Successfully write %d frames to %s.' %(count, xyz_fname))
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=description)
@@ -253,8 +144,13 @@ if __name__ == '__main__':
             help='description')
     parser.add_argument('-nf', '--nframes', nargs='?', default=-100, \
             type=int, help='Number of Frames')
+    parser.add_argument('-i', '--index', default=None, \
+            help='Frame Selection, e.g. -1, 100, ::10')
+    parser.add_argument('-cs', '--chunk-size', default=100, \
+            type=int, help='Number of Frames per Write')
 
     args = parser.parse_args()
 
-    out2xyz(args.out,args.pos,args.descrp,args.nframes,args.fname)
+    out2xyz(args.out,args.pos,args.descrp,args.nframes,args.fname,args.index,\
+            args.chunk_size)
 
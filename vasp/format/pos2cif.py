@@ -8,6 +8,10 @@ import argparse
 
 import numpy as np
 
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from corePBC import adjust_poses
+
 norm = np.linalg.norm
 inv = np.linalg.inv
 dot = np.dot
@@ -61,18 +65,6 @@ def read_poscar(poscar='POSCAR', carform='vasp5'):
     return fname, scaling, lattice, symbols, numbers, poses, fixes
 
 
-def adjust_poses(poses, refposes):
-    """poses, poses_ref should be in direct"""
-    # atoms, take last step as reference
-    for i in range(len(poses)):
-        for x in range(3):
-            move = round(poses[i][x] - refposes[i][x], 0)
-            poses[i][x] -= move
-    refposes = poses.copy()
-
-    return poses, refposes
-
-
 def write_cif(poscar, cif_name):
     """"""
     fname, scaling, lattice, symbols, numbers, refposes, fixes \
@@ -10,6 +10,10 @@ import argparse
 import numpy as np
 from scipy import integrate
 
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from corePBC import adjust_poses
+
 pi = np.pi
 
 norm = np.linalg.norm
@@ -87,18 +91,6 @@ def write_poscar(poscar, lattice, symbols, numbers, poses, fixes, vels):
     
     return
 
-def adjust_poses(poses, refposes):
-    """poses, poses_ref should be in direct"""
-    # atoms, take last step as reference
-    for i in range(len(poses)):
-        for x in range(3):
-            move = round(poses[i][x] - refposes[i][x], 0)
-            poses[i][x] -= move
-    refposes = poses.copy()
-
-    return poses, refposes
-
-
 def lat2mat(lattice):
     # lattice
     a, b, c = lattice
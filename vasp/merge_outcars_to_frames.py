@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
+import sys
 import argparse
 
-from ase.io import read, write
-from ase.io.vasp import read_vasp_out
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from coreHarvest import harvest, write_frames
 
 if __name__ == '__main__':
     # args 
@@ -15,18 +18,19 @@ if __name__ == '__main__':
             default=10, help='number of bins')
     parser.add_argument('-ne', '--nequil', type=int,\
             default=300, help='number of equilibrium steps')
+    parser.add_argument('-nj', '--njobs', type=int,\
+            default=1, help='number of processes to parse OUTCARs')
 
     args = parser.parse_args()
 
     # data 
     data_files = ['mt-x1/OUTCAR', 'mt-x11/OUTCAR', 'mt-x12/OUTCAR']
 
-    frames = []
-    for file_name in data_files:
-        frames.extend(read_vasp_out(data_files[0], ':'))
-
     # set steps
-    for idx, atoms in enumerate(frames):
-        atoms.info['step'] = idx
+    def set_steps(frames):
+        for idx, atoms in enumerate(frames):
+            atoms.info['step'] = idx
+            yield atoms
 
-    write('total_outcars.xyz', frames)
+    frames = harvest(data_files, ':', args.njobs)
+    write_frames('total_outcars.xyz', set_steps(frames))
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
 import argparse
 
 import numpy as np
@@ -10,7 +11,10 @@ import ase
 import ase.io.vasp as ase_vasp
 from ase import Atom, Atoms
 
-MAXFRAME = 10000
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from coreOUTCAR import read_outcar
+from coreXYZ import format_atoms
 
 def read_poscar(poscar='POSCAR',format='vasp5',verbose=True):
     """read POSCAR"""
@@ -42,75 +46,6 @@ def read_poscar(poscar='POSCAR',format='vasp5',verbose=True):
     return fname, scaling, lattice, symbols, numbers, poses, fixes
 
 
-def read_outcar(outcar='OUTCAR',natoms=100,verbose=True,wdat=False,**kwargs):
-    """
-    in each frame,
-    coordinates, forces, stress will be read
-    """
-    # how many steps to read
-    nframes = MAXFRAME
-    if kwargs:
-        if 'nframes' in kwargs.keys():
-            if kwargs['nframes'] > 0:
-                nframes = int(kwargs['nframes'])
-
-    # read OUTCAR
-    energy, free_energy = [], []
-
-    frames = []
-    fopen = open(outcar, 'r')
-    count, flag = 0, True
-    while flag:
-        line = fopen.readline()
-        if line.strip().startswith('in kB'): # kB means kilobar equals 0.1 GPa
-            # XX YY ZZ XY YZ ZX
-            stress = -np.array([float(d) for d in line.strip().split()[2:]])
-            # vigot notation, XX YY ZZ YZ XZ XY
-            stress_vigot = stress[[0,1,2,4,5,3]]*1e-1*ase.units.GPa # in eV/AA^3
-            stress = []
-            for n in [0,5,4,5,1,3,4,3,2]:
-                stress.append(stress_vigot[n])
-            stress = np.array(stress).reshape(3,3)
-            #print(stress)
-        if line.strip().startswith('VOLUME and BASIS'):
-            fopen.readline() # segement line
-            fopen.readline() # energy-cutoff
-            fopen.readline() # volume of cell
-            fopen.readline() # title
-            cur_lat = []
-            for n in range(3):
-                data = fopen.readline().strip().split()
-                cur_lat.append(data)
-            cur_lat = np.array(cur_lat,dtype=float)[:,0:3]
-        if line.strip().startswith('POSITION'):
-            fopen.readline() # segment line ---...---
-            poses, forces = [], []
-            for n in range(natoms):
-                data = fopen.readline().strip().split()
-                poses.append(data[:3]) # x y z
-                forces.append(data[3:]) # fx fy fz
-            poses = np.array(poses, dtype=float)
-            forces = np.array(forces, dtype=float)
-            frames.append((cur_lat,poses, forces, stress))
-            count += 1
-        if line.strip().startswith('FREE ENERGIE OF THE ION-ELECTRON SYSTEM'):
-            fopen.readline() # segment line ---...---
-            # free energy F
-            data = fopen.readline().strip().split()
-            free_energy.append(float(data[-2]))
-            fopen.readline() # blank line
-            # energy E0
-            data = fopen.readline().strip().split()
-            energy.append(float(data[-1]))
-        if count == nframes or (not line):
-            flag = False
-    fopen.close()
-    
-    if verbose:
-        print('Successfully read OUTCAR, get positions and forces ...')
-
-    return frames, energy, free_energy
-
 def write_xyz(symbols,positions,forces,**kwargs):
     """positions in cartesian (AA) and forces in eV/AA"""
     # check number of atoms
@@ -148,20 +83,20 @@ def write_xyz(symbols,positions,forces,**kwargs):
     content = "{:<d}\n".format(natoms)
     content += comment_content
 
-    for i in range(natoms):
-        content += ('{:<4s} '+'{:>12.6f} '*6+'\n')\
-            .format(symbols[i],*list(positions[i]),*list(forces[i]))
+    content += format_atoms(symbols, positions, forces)
 
     return content
 
 
 def frame2xyz(symbols,outcar,molecule=False):
-    frames, energy, free_energy = \
-        read_outcar(outcar=outcar,natoms=len(symbols),verbose=False)
-    lattice = frames[0][0]
-    positions = frames[0][1]
-    forces = frames[0][2]
-    stress = frames[0][3]
+    frames = read_outcar(outcar=outcar,natoms=len(symbols),nframes=1,\
+            verbose=False)
+    lattice = frames[0]['lattice']
+    positions = frames[0]['positions']
+    forces = frames[0]['forces']
+    stress = frames[0]['stress']
+    energy = frames[0]['energy']
+    free_energy = frames[0]['free_energy']
 
     volume = np.dot(np.cross(lattice[0],lattice[1]),lattice[2])
     virial = -stress*volume
@@ -170,11 +105,11 @@ def frame2xyz(symbols,outcar,molecule=False):
     if molecule:
         content = write_xyz(symbols,positions,forces,\
                 pbc=['T','T','T'],Lattice=lattice,\
-                energy=energy[0],free_energy=free_energy[0])
+                energy=energy,free_energy=free_energy)
     else:
         content = write_xyz(symbols,positions,forces,\
                 pbc=['T','T','T'],Lattice=lattice,\
-                energy=energy[0],free_energy=free_energy[0],\
+                energy=energy,free_energy=free_energy,\
                 stress=stress,virial=virial)
 
     return content
@@ -205,13 +140,11 @@ if __name__ == '__main__':
             outcars.append(fname)
     outcars.sort(key=lambda fname:int(fname.split('_')[-1]))
 
-    content = ''
-    for outcar in outcars[1::3]:
-        print('Read %s ...' %outcar)
-        content += frame2xyz(symbols,os.path.join('./POSCARs',outcar),args.molecule)
-
     with open('data.xyz','w') as writer:
-        writer.write(content)
+        for outcar in outcars[1::3]:
+            print('Read %s ...' %outcar)
+            writer.write(frame2xyz(symbols,os.path.join('./POSCARs',outcar),\
+                    args.molecule))
 
     print('Writer data to data.xyz')
 
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
 import argparse
 
 import numpy as np
@@ -16,8 +17,30 @@ mpl.use('Agg') #silent mode
 from matplotlib import pyplot as plt
 plt.style.use("presentation")
 
+import ase.io
 from ase.io import read, write
 
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from coreStore import is_store, iread_store
+
+"""
+Author: Jiayan Xu
+Description:
+    Density profiles along the surface normal. Frames are read in chunks and
+    each chunk is binned at once by np.bincount for all selected groups
+    (elements, element sets or water), so the profile of a long trajectory
+    is averaged in one pass with block errors and constant memory.
+"""
+
+AMU2GCM3 = 1.66053907 # amu/Å^3 to g/cm^3
+
+CHUNK = 1000 # frames binned at once
+
+WATER = 'water' # O with two H within ROH and the two H
+ROH = 1.25
+
+
 def get_density(density_dict, nbins, elements=None):
     """"""
     selected_density = np.zeros(nbins)
@@ -37,40 +60,42 @@ def smooth_density(bins, density):
     bins = np.linspace(bins.min(), bins.max(), 300)
     density = spl(bins)
 
-    for i, d in enumerate(density):
-        if d < 1e-6:
-            density[i] = 0.0
+    density[density < 1e-6] = 0.0
 
     return bins, density
 
-def calc_density(atoms, merged=False):
-    # bin setting
-    bin_width = 1.0 # bin_center 0.5
+def surface_normal(cell):
+    """unit normal of the ab plane, height of the cell along it and xy area"""
+    cell = np.asarray(cell)
+    normal = cross(cell[0], cell[1])
+    area = norm(normal)
+    normal = normal / area
 
-    # calculate xy area
-    cell = atoms.get_cell()
-    nbins = int(np.ceil(cell[2][2]/bin_width))
-    xyplane_size = norm(cross(cell[0], cell[1]))
+    return normal, dot(cell[2], normal), area
 
-    bins = []
-    for i in range(nbins):
-        bins.append(bin_width/2+bin_width*i)
-    bins = np.array(bins)
+def bin_indices(heights, bin_width, nbins):
+    """bin of each height, -1 outside bins or exactly on an edge"""
+    indices = np.floor(heights/bin_width).astype(int)
+    valid = (indices >= 0) & (indices < nbins) & \
+            (heights != indices*bin_width)
 
-    # ...
-    elements = list(set(atoms.get_chemical_symbols()))
-    density_dict = {}
-    for e in elements:
-        density_dict[e] = np.zeros(nbins)
+    return np.where(valid, indices, -1)
 
-    atom_masses = atoms.get_masses()
-    chemical_symbols = atoms.get_chemical_symbols()
-    positions = atoms.get_positions()
+def calc_density(atoms, merged=False, bin_width=1.0):
+    """mass in bins along the normal of the ab plane, bin_center at 0.5"""
+    normal, height, xyplane_size = surface_normal(atoms.get_cell())
+    nbins = int(np.ceil(height/bin_width))
+    bins = bin_width/2 + bin_width*np.arange(nbins)
 
-    for s, m, p in zip(chemical_symbols, atom_masses, positions):
-        for i, bin_pos in enumerate(bins):
-            if bin_pos-bin_width/2.0 < p[2] < bin_pos+bin_width/2.0: # use z-axis
-                density_dict[s][i] += m #/ xyplane_size
+    chemical_symbols = np.array(atoms.get_chemical_symbols())
+    indices = bin_indices(dot(atoms.get_positions(), normal), bin_width, nbins)
+    valid = indices >= 0
+
+    density_dict = {}
+    for e in set(chemical_symbols):
+        mask = valid & (chemical_symbols == e)
+        density_dict[e] = np.bincount(indices[mask], \
+                weights=atoms.get_masses()[mask], minlength=nbins)
 
     if merged:
         density_data = get_density(density_dict, nbins)
@@ -79,7 +104,202 @@ def calc_density(atoms, merged=False):
 
     return density_data, bins
 
-def plot_density(density_data):
+def select_water(symbols, positions, cell, roh=ROH):
+    """mask of O with two H within roh and these H, minimum image"""
+    symbols = np.asarray(symbols)
+    o_indices = np.flatnonzero(symbols == 'O')
+    h_indices = np.flatnonzero(symbols == 'H')
+    mask = np.zeros(len(symbols), dtype=bool)
+    if len(o_indices) == 0 or len(h_indices) == 0:
+        return mask
+
+    vectors = positions[h_indices][np.newaxis,:,:] - \
+            positions[o_indices][:,np.newaxis,:]
+    frac = dot(vectors, np.linalg.inv(cell))
+    vectors = dot(frac - np.round(frac), cell)
+    bonded = norm(vectors, axis=2) < roh # (nO, nH)
+
+    waters = np.sum(bonded, axis=1) == 2
+    mask[o_indices[waters]] = True
+    mask[h_indices[np.any(bonded[waters], axis=0)]] = True
+
+    return mask
+
+def parse_groups(names, symbols):
+    """
+    membership (ngroups, natoms) of groups like Pt, Cd+S or water,
+    water is selected in every frame, default each element and all
+    """
+    symbols = np.asarray(symbols)
+    if not names:
+        names = sorted(set(symbols)) + ['all']
+
+    members = []
+    for name in names:
+        if name == 'all':
+            members.append(np.ones(len(symbols), dtype=bool))
+        elif name == WATER:
+            members.append(None)
+        else:
+            members.append(np.isin(symbols, name.split('+')))
+
+    return names, members
+
+class DensityProfile(object):
+    """
+    Description:
+        Accumulate density profiles of groups over frames, running min,
+        max, mean and means of blocks of frames for errors.
+    """
+    def __init__(self, names, nbins, blocksize=100):
+        self.names = names
+        self.nbins = nbins
+        self.blocksize = blocksize
+
+        shape = (len(names), nbins)
+        self.nframes = 0
+        self.total = np.zeros(shape)
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+        self.block_sum, self.block_count = np.zeros(shape), 0
+        self.block_means = []
+
+    def update(self, profiles):
+        """add profiles of frames (nframes, ngroups, nbins)"""
+        self.nframes += len(profiles)
+        self.total += np.sum(profiles, axis=0)
+        self.min = np.minimum(self.min, np.min(profiles, axis=0))
+        self.max = np.maximum(self.max, np.max(profiles, axis=0))
+
+        while len(profiles) > 0:
+            nfill = self.blocksize - self.block_count
+            self.block_sum += np.sum(profiles[:nfill], axis=0)
+            self.block_count += len(profiles[:nfill])
+            profiles = profiles[nfill:]
+            if self.block_count == self.blocksize:
+                self.block_means.append(self.block_sum/self.blocksize)
+                self.block_sum, self.block_count = \
+                        np.zeros(self.block_sum.shape), 0
+
+        return
+
+    def get_mean(self):
+        return self.total / self.nframes
+
+    def get_error(self):
+        """standard error of the mean from block means, 0 if few blocks"""
+        nblocks = len(self.block_means)
+        if nblocks < 2:
+            return np.zeros(self.total.shape)
+        return np.std(self.block_means, axis=0, ddof=1) / np.sqrt(nblocks)
+
+def iread_chunks(structure, chunk=CHUNK):
+    """yield lists of atoms, a frame store is read by memory maps"""
+    if is_store(structure):
+        frames = iread_store(structure)
+    else:
+        frames = ase.io.iread(structure, ':')
+
+    frames_chunk = []
+    for atoms in frames:
+        frames_chunk.append(atoms)
+        if len(frames_chunk) == chunk:
+            yield frames_chunk
+            frames_chunk = []
+    if frames_chunk:
+        yield frames_chunk
+
+def bin_frames(frames, members, bin_width, nbins, quantity='mass', \
+        per_volume=False):
+    """profiles (nframes, ngroups, nbins) of a chunk of frames"""
+    nframes, ngroups = len(frames), len(members)
+    symbols = frames[0].get_chemical_symbols()
+    weights = np.ones(len(symbols))
+    if quantity == 'mass':
+        weights = frames[0].get_masses()
+
+    positions = np.array([atoms.get_positions() for atoms in frames])
+    cells = np.array([atoms.get_cell()[:] for atoms in frames])
+    normals, heights, areas = [], [], []
+    for cell in cells:
+        normal, height, area = surface_normal(cell)
+        normals.append(normal)
+        areas.append(area)
+    normals, areas = np.array(normals), np.array(areas)
+
+    indices = bin_indices(np.einsum('fij,fj->fi', positions, normals), \
+            bin_width, nbins) # (nframes, natoms)
+
+    # frames and groups are offset so one bincount bins the whole chunk
+    profiles = np.zeros((nframes, ngroups, nbins))
+    frame_offsets = np.arange(nframes)[:,np.newaxis]*nbins
+    for g, member in enumerate(members):
+        if member is None:
+            member = np.array([select_water(symbols, p, c) \
+                    for p, c in zip(positions, cells)])
+        else:
+            member = np.tile(member, (nframes,1))
+        mask = member & (indices >= 0)
+        flat = (frame_offsets + indices)[mask]
+        profiles[:,g,:] = np.bincount(flat, \
+                weights=np.tile(weights, (nframes,1))[mask], \
+                minlength=nframes*nbins).reshape(nframes, nbins)
+
+    if per_volume:
+        # amu/Å^3 to g/cm^3 or number per Å^3
+        volumes = areas*bin_width
+        profiles /= volumes[:,np.newaxis,np.newaxis]
+        if quantity == 'mass':
+            profiles *= AMU2GCM3
+
+    return profiles
+
+def density_profile(structure, names=None, bin_width=1.0, quantity='mass', \
+        per_volume=False, blocksize=100, chunk=CHUNK, datfile='density.dat'):
+    """
+    profiles of groups over a trajectory in one pass, rows of the merged
+    profile of each frame are written to datfile as they are computed,
+    followed by its min, avg and max
+    """
+    profile = None
+    with open(datfile, 'w') as writer:
+        for frames in iread_chunks(structure, chunk):
+            if profile is None:
+                symbols = frames[0].get_chemical_symbols()
+                names, members = parse_groups(names, symbols)
+                normal, height, area = surface_normal(frames[0].get_cell())
+                nbins = int(np.ceil(height/bin_width))
+                bins = bin_width/2 + bin_width*np.arange(nbins)
+                members.append(np.ones(len(symbols), dtype=bool))
+                profile = DensityProfile(names+['merged'], nbins, blocksize)
+            profiles = bin_frames(frames, members, bin_width, nbins, \
+                    quantity, per_volume)
+            profile.update(profiles)
+            np.savetxt(writer, profiles[:,-1,:], fmt="%8.4f")
+        np.savetxt(writer, np.vstack([profile.min[-1], \
+                profile.get_mean()[-1], profile.max[-1]]), fmt="%8.4f")
+
+    return bins, profile
+
+def write_profile(profile_file, bins, profile):
+    """bin centre and average and error of each group"""
+    means, errors = profile.get_mean(), profile.get_error()
+    content = '# {:>8s}'.format('bin')
+    for name in profile.names[:-1]:
+        content += '{:>12s}{:>12s}'.format(name, 'err')
+    content += '\n'
+    for i, b in enumerate(bins):
+        content += '{:>10.4f}'.format(b)
+        for g in range(len(profile.names)-1):
+            content += '{:>12.6f}{:>12.6f}'.format(means[g,i], errors[g,i])
+        content += '\n'
+
+    with open(profile_file, 'w') as writer:
+        writer.write(content)
+
+    return
+
+def plot_density(bins, density_data, density_min, density_max, pic='dp.png'):
     # plot
     fig, ax = plt.subplots(nrows=1, ncols=1, figsize=(16,12))
 
@@ -129,7 +349,7 @@ def plot_density(density_data):
 
     plt.legend()
 
-    plt.savefig('dp.png')
+    plt.savefig(pic)
 
 
     return
@@ -143,25 +363,37 @@ def plot_density_file(density_file="./density.dat"):
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument(
-        "structure"
+        "structure", help="trajectory read by ase or a frame store"
+    )
+    parser.add_argument(
+        "-g", "--groups", nargs="*", default=None,
+        help="groups like Pt Cd+S water all, default each element and all"
+    )
+    parser.add_argument(
+        "-w", "--width", type=float, default=1.0, help="bin width [Å]"
+    )
+    parser.add_argument(
+        "-q", "--quantity", choices=["mass", "number"], default="mass",
+        help="mass [amu] or number of atoms in bins"
+    )
+    parser.add_argument(
+        "-v", "--volume", action="store_true",
+        help="divide by bin volume, g/cm^3 or 1/Å^3"
+    )
+    parser.add_argument(
+        "-b", "--blocksize", type=int, default=100,
+        help="frames in each block for errors"
+    )
+    parser.add_argument(
+        "-c", "--chunk", type=int, default=CHUNK,
+        help="frames binned at once"
     )
     args = parser.parse_args()
 
-    frames = read(args.structure, ":")
-    
-    all_data = []
-    for i, atoms in enumerate(frames):
-        density_data, bins = calc_density(atoms, True)
-        #print(density_data)
-        # print(density_data)
-        all_data.append(density_data)
-    all_data = np.array(all_data)
-    density_max = np.max(all_data, axis=0) # max along time
-    density_min = np.min(all_data, axis=0) # min along time
-    density_avg = np.mean(all_data, axis=0)
-
-    all_data = np.vstack([all_data, density_min, density_avg, density_max])
-
-    np.savetxt("density.dat", all_data, fmt="%8.4f")
+    bins, profile = density_profile(
+        args.structure, args.groups, args.width, args.quantity,
+        args.volume, args.blocksize, args.chunk
+    )
+    write_profile("density_profile.dat", bins, profile)
 
-    plot_density(density_avg)
+    plot_density(bins, profile.get_mean()[-1], profile.min[-1], profile.max[-1])
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import re
+import os
+import sys
+import argparse
 
 import numpy as np
 
@@ -10,54 +12,59 @@ matplotlib.use('Agg') #silent mode
 import matplotlib.pyplot as plt
 plt.style.use("presentation")
 
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from coreOSZICAR import read_oszicar, summarize_chunks, print_summary
+
 #from ase.io import read, write
 
 def parse_oszicar(oszicar):
-    # read lines
-    with open(oszicar, "r") as fopen:
-        lines = fopen.readlines()
+    """index T E  F E0 EK SP SK of MD steps, (nsteps, 8)"""
+    data = read_oszicar(oszicar)
 
-    # match lines
-    data_lines = []
-    for line in lines:
-        if re.match("^[\t ]*[0-9]* T=*", line):
-            data_lines.append(line)
+    return data.view(float).reshape(len(data), -1)
 
-    # index T E  F E0 EK SP SK
-    data = []
-    for line in data_lines:
-        cur_data = [x for i, x in enumerate(line.strip().split()) if i%2 == 0]
-        data.append(cur_data)
-    data = np.array(data, dtype=float)
+def plot_md(oszicar='./OSZICAR', pic='md.png', blocksize=1000):
+    data = read_oszicar(oszicar)
 
-    return data
+    steps = data['step']
+    temperatures = data['T']
+    energies = data['E0'] # potential energy
 
-data = parse_oszicar("./OSZICAR")
+    #frames = read("./OUTCAR", ":")
+    #energies = [a.get_potential_energy() for a in frames]
 
-steps = data[:, 0]
-temperatures = data[:, 1]
-energies = data[:, 4] # potential energy
+    fig, ax = plt.subplots(nrows=1, ncols=1, figsize=(16,12))
+    ax.set_title(
+        "Molecular Dynamics"
+    )
 
-#frames = read("./OUTCAR", ":")
-#energies = [a.get_potential_energy() for a in frames]
+    l1, = ax.plot(steps, temperatures, c="r", label="temperature")
+    ax.set_xlabel("MD Step")
+    ax.set_ylabel("Temperature [K]")
 
-fig, ax = plt.subplots(nrows=1, ncols=1, figsize=(16,12))
-ax.set_title(
-    "Molecular Dynamics"
-)
+    ax2 = ax.twinx()
+    l2, = ax2.plot(steps, energies, label="potential energy")
+    ax2.set_ylabel("Energy [eV]")
 
-l1, = ax.plot(steps, temperatures, c="r", label="temperature")
-ax.set_xlabel("MD Step")
-ax.set_ylabel("Temperature [K]")
+    plt.legend(handles=[l1, l2])
 
-ax2 = ax.twinx()
-l2, = ax2.plot(steps, energies, label="potential energy")
-ax2.set_ylabel("Energy [eV]")
+    plt.tight_layout()
+    plt.savefig(pic)
 
-plt.legend(handles=[l1, l2])
+    # statistics of the steps already read, OSZICAR is parsed once
+    print_summary(summarize_chunks([data], ['T', 'E0'], blocksize), blocksize)
 
-plt.tight_layout()
-plt.savefig('md.png')
+    return
 
 if __name__ == '__main__':
-    pass
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--oszicar', default='./OSZICAR', \
+            help='OSZICAR file')
+    parser.add_argument('-o', '--out', default='md.png', \
+            help='MD figure')
+    parser.add_argument('-b', '--blocksize', type=int, default=1000, \
+            help='steps in each block of statistics')
+    args = parser.parse_args()
+
+    plot_md(args.oszicar, args.out, args.blocksize)
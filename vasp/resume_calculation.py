@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
+import sys
 import time
+import getpass
 import argparse
 import subprocess
 from pathlib import Path
@@ -14,6 +17,11 @@ from joblib import Parallel, delayed
 
 import numpy as np
 
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from coreTraj import count_xyz
+from coreLedger import PENDING, RUNNING, DONE, FAILED, load_ledger, summarize
+
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
@@ -24,10 +32,6 @@ parser.add_argument(
     '-dp', '--dir_pattern', 
     default="O*", help='calculation directory pattern'
 )
-parser.add_argument(
-    '-p', '--pattern', 
-    default='vasp_0_*', help='vasp directory name pattern'
-)
 parser.add_argument(
     '-f', '--vaspfile', 
     default='vasprun.xml', help='vasp directory name pattern'
@@ -48,103 +52,106 @@ parser.add_argument(
     "--check", action="store_true",
     help="check number of converged configurations"
 )
+parser.add_argument(
+    '-u', '--user', default=getpass.getuser(),
+    help='user whose jobs are in the queue'
+)
+parser.add_argument(
+    '--squeue', default='squeue',
+    help='squeue command, a fake one can be used for tests'
+)
+parser.add_argument(
+    '-lg', '--ledger', default='calculated.ledger.json',
+    help='ledger written by compute_by_ase in each directory'
+)
 
 args = parser.parse_args()
 
-def find_job_in_queue(d):
-    """"""
-    command = "squeue --user 40247882 --format=\"%.12i %.12P %.24j %.4t %.12M %.12L %.5D %.4C\""
-    proc = subprocess.Popen(
-        command, shell=True, cwd=d,
-        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-        encoding = 'utf-8'
-    )
-    errorcode = proc.wait(timeout=10) # 10 seconds
-    if errorcode:
-        raise ValueError('Error in checking job...')
-
-    lines = proc.stdout.readlines()
-    job_ids = [
-        line.split()[0] for line in lines
-    ][1:]
-    #print(job_ids)
-
-    wds = []
-    for job_id in job_ids:
-        command = "scontrol show job {}".format(job_id)
-        proc = subprocess.Popen(
-            command, shell=True, cwd=d,
+class QueueSnapshot(object):
+    """
+    work directories of queued jobs, the scheduler is queried once by 
+    squeue (job id and WorkDir of each job) and the snapshot is used for 
+    the whole run, jobs submitted meanwhile are added to it
+    """
+    def __init__(self, user, squeue='squeue'):
+        self.user = user
+        self.squeue = squeue
+        self.workdirs = None
+
+    def query(self):
+        command = '{} --user {} --noheader --format="%i %Z"'.format(
+            self.squeue, self.user
+        )
+        proc = subprocess.run(
+            command, shell=True,
             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-            encoding = 'utf-8'
+            encoding = 'utf-8', timeout=60
         )
-        errorcode = proc.wait(timeout=10) # 10 seconds
-        if errorcode:
+        if proc.returncode:
             raise ValueError('Error in checking job...')
-        lines = proc.stdout.readlines()
-        for line in lines:
-            line = line.strip()
-            if line.startswith("WorkDir="):
-                wds.append(line[8:])
 
+        workdirs = {}
+        for line in proc.stdout.splitlines():
+            line = line.strip().split(maxsplit=1)
+            if len(line) == 2:
+                workdirs[os.path.normpath(line[1])] = line[0]
+        self.workdirs = workdirs
+
+        return
+
+    def add(self, d, job_id=None):
+        if self.workdirs is None:
+            self.query()
+        self.workdirs[os.path.normpath(str(d))] = job_id
+
+        return
+
+    def __contains__(self, d):
+        if self.workdirs is None:
+            self.query()
+        return os.path.normpath(str(d)) in self.workdirs
+
+def find_job_in_queue(d, queue):
+    """whether a job of the directory is in the queue snapshot"""
     flag = False
-    if str(d) in wds:
+    if d in queue:
         print("job already in queue...")
         flag = True
 
     return flag
 
-def find_vasp_dirs(wd):
-    cur_vasp_dirs = []
-    for p in wd.glob(args.pattern):
-        cur_vasp_dirs.append(p)
-    print('find number of vasp dirs %d in %s' %(len(cur_vasp_dirs), wd))
-
-    return cur_vasp_dirs
-
-def check_single_dir(d):
+def check_single_dir(d, queue):
+    """
+    resubmit vasp.slurm unchanged if the ledger of compute_by_ase is not
+    finished, the resubmitted run skips done jobs by the ledger itself
+    """
     # wd
     d = Path(d).absolute()
 
     # find structures
     structures_in = list(d.glob("O*.xyz"))[0]
     print(structures_in)
-    frames_in = read(structures_in, ":")
-    nframes_in = len(frames_in)
+    nframes_in = count_xyz(structures_in)
     print("Number of input structures: ", nframes_in)
-    
-    # find vasp files
-    vasp_dirs = []
-    for p in d.parent.glob(d.name+'*'):
-        if p.is_dir():
-            vasp_dirs.extend(find_vasp_dirs(p))
-    nvaspdirs = len(vasp_dirs)
-    print('total vasp dirs: %d' %(nvaspdirs))
-    
-    if nframes_in != nvaspdirs:
-        print("need to resubmit job...")
+
+    # check progress in the ledger
+    ledgerfile = d / args.ledger
+    if ledgerfile.exists():
+        ledger = load_ledger(ledgerfile)
+        counts = summarize(ledger)
+        print('jobs done %d, failed %d, running %d, pending %d' %(
+            counts[DONE], counts[FAILED], counts[RUNNING], counts[PENDING]
+        ))
+        if ledger.get('finished', False):
+            return
     else:
-        return
+        print('no ledger, the job has not started...')
+    print("need to resubmit job...")
 
     # check job if already in queue
-    if find_job_in_queue(d):
+    if find_job_in_queue(d, queue):
         return
 
-    # read job script
-    job_script = d / "vasp.slurm"
-    with open(job_script, "r") as fopen:
-        content = fopen.readlines()
-    new_content = content
-    for i, line in enumerate(content):
-        if line.startswith("./compute_by_ase.py"):
-            line_list = line.split()
-            line_list[-1] = "\"{}:\"\n".format(nvaspdirs-1)
-            new_content[i] = " ".join(line_list)
-            print(new_content[i])
-    new_content = "".join(new_content)
-
-    with open(job_script, "w") as fopen:
-        fopen.write(new_content)
-
     command = 'sbatch vasp.slurm'
     proc = subprocess.Popen(
         command, shell=True, cwd=d,
@@ -156,12 +163,14 @@ def check_single_dir(d):
         raise ValueError('Error in resubmitting job...')
 
     print(''.join(proc.stdout.readlines()))
+    queue.add(d)
 
 if __name__ == '__main__':
     cwd = Path(args.dir)
     calc_dirs = list(cwd.glob(args.dir_pattern))
     calc_dirs.sort()
     print("number of dirs: ", len(calc_dirs))
+    queue = QueueSnapshot(args.user, args.squeue)
     for d in calc_dirs:
         print("\n\n===== {} =====".format(d))
-        check_single_dir(d)
+        check_single_dir(d, queue)
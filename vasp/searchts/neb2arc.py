@@ -10,6 +10,10 @@ import argparse
 import numpy as np
 from scipy import integrate
 
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from corePBC import unwrap_direct
+
 pi = np.pi
 
 norm = np.linalg.norm
@@ -65,24 +69,12 @@ def read_poscar(poscar='POSCAR', format='vasp5'):
     return fname, scaling, lattice, symbols, numbers, atoms, poses, fixes
 
 
-def adjust_poses(poses, refposes):
-    """poses, poses_ref should be in direct"""
-    # atoms, take last step as reference
-    for i in range(len(poses)):
-        for x in range(3):
-            move = round(poses[i][x] - refposes[i][x], 0)
-            poses[i][x] -= move
-    refposes = poses.copy()
-
-    return poses, refposes
-
-
 def write_arc(frames, refposes, atoms, cell, trans):
+    # adjust positions of all images at once
+    frames = unwrap_direct(frames, refposes)
+
     content = '!BIOSYM archive 3\nPBC=ON\n'
-    for i, frame in enumerate(frames):
-        # adjust positions
-        dirposes = frame
-        dirposes, refposes = adjust_poses(dirposes, refposes)
+    for i, dirposes in enumerate(frames):
         poses = dot(dirposes, lattice)
 
         # write time
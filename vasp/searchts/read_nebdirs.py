@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
+import sys
 import argparse
 from pathlib import Path
 
@@ -9,6 +11,10 @@ import numpy as np
 from ase import Atoms
 from ase.io import read, write
 
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from coreOUTCAR import read_atoms
+
 parser = argparse.ArgumentParser()
 parser.add_argument(
     "FILE"
@@ -35,7 +41,13 @@ for nebdir in nebdirs:
     if outcar.name in ["OUTCAR", "vasprun.xml"]:
         if outcar.exists():
             print(outcar)
-            atoms = read(outcar, args.indices)
+            if outcar.name == "OUTCAR":
+                # indexed OUTCAR, only selected frames are decoded
+                atoms = read_atoms(outcar, args.indices)
+                if len(atoms) == 1 and ":" not in args.indices:
+                    atoms = atoms[0]
+            else:
+                atoms = read(outcar, args.indices)
             if isinstance(atoms, Atoms):
                 print("energy: ", atoms.get_potential_energy())
                 print("max force: ", np.max(np.fabs(atoms.get_forces(apply_constraint=True))))
@@ -3,39 +3,59 @@
 '''
     Script to convert XDATCAR to *.arc file to display in Material Studio.
 '''
+import os
+import sys
 import time 
+import argparse
 
 import numpy as np
 
-from vaspy.atomco import XdatCar
-from vaspy.functions import get_angle
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from coreTraj import read_xdatcar
 
-xdatcar = XdatCar()
+norm = np.linalg.norm
 
-x, y, z = xdatcar.bases
-# lattice info
-# angles
-alpha = get_angle(y, z)
-beta = get_angle(x, z)
-gamma = get_angle(x, y)
-# length
-lx = np.linalg.norm(x)
-ly = np.linalg.norm(y)
-lz = np.linalg.norm(z)
+
+def get_angle(v1, v2):
+    """angle between two vectors in degree"""
+    cos_angle = np.dot(v1, v2)/norm(v1)/norm(v2)
+    return np.arccos(cos_angle)/np.pi*180
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-f", "--file", default='XDATCAR', \
+        help="XDATCAR File")
+parser.add_argument("-i", "--indices", default=None, \
+        help="Frame Selection, e.g. -1, 100, ::10")
+args = parser.parse_args()
 
 content = '!BIOSYM archive 3\nPBC=ON\n'
 
-for step, data in xdatcar:
-    print("step = %s" % step)
+# only selected frames are decoded through the frame index
+for step, (bases, atom_types, atom_numbers, data) in \
+        enumerate(read_xdatcar(args.file, args.indices)):
+    x, y, z = bases
+    # lattice info
+    # angles
+    alpha = get_angle(y, z)
+    beta = get_angle(x, z)
+    gamma = get_angle(x, y)
+    # length
+    lx = np.linalg.norm(x)
+    ly = np.linalg.norm(y)
+    lz = np.linalg.norm(z)
+
+    print("step = %s" % (step+1))
     content += ('%80.4f\n' % 0.0)
     content += '!DATE     %s\n' %time.asctime( time.localtime(time.time()))
     content += 'PBC%10.4f%10.4f%10.4f%10.4f%10.4f%10.4f\n' %\
                (lx, ly, lz, alpha, beta, gamma)
     # data
-    data = xdatcar.dir2cart(xdatcar.bases, data)
+    data = np.dot(data, bases)
 
     atom_names = []
-    for n, atom in zip(xdatcar.atom_numbers, xdatcar.atom_types):
+    for n, atom in zip(atom_numbers, atom_types):
         atom_names.extend([atom]*n)
     for atom_name, coord in zip(atom_names, data):
         coord = coord.tolist()
@@ -1,18 +1,21 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
+import sys
 import time
 import argparse
 from pathlib import Path
 
 from tqdm import tqdm
-from ase.io import read, write
 from ase.constraints import FixAtoms
 
-from joblib import Parallel, delayed
-
 import numpy as np
 
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from coreHarvest import harvest, write_frames
+
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
@@ -33,7 +36,7 @@ parser.add_argument(
 )
 parser.add_argument(
     '-nj', '--njobs', type=int,
-    default=1, help='upper limit on number of directories'
+    default=1, help='number of processes to parse files'
 )
 parser.add_argument(
     '-l', '--limit', type=int,
@@ -43,6 +46,14 @@ parser.add_argument(
     "--check", action="store_true",
     help="check number of converged configurations"
 )
+parser.add_argument(
+    "--store", action="store_true",
+    help="write a binary frame store instead of xyz"
+)
+parser.add_argument(
+    "--nocache", action="store_true",
+    help="do not use or write the per-file frame cache"
+)
 
 args = parser.parse_args()
 
@@ -65,55 +76,42 @@ print('total vasp dirs: %d' %(len(vasp_dirs)))
 print("sorted by last integer number...")
 vasp_dirs_sorted = sorted(vasp_dirs, key=lambda k: int(k.name.split('_')[-1])) # sort by name
 #print(vasp_dirs_sorted) 
-def extract_atoms(p):
-    vasprun = Path(p) / args.vaspfile
-    #atoms = read(vasprun, format='vasp-xml')
-    atoms = read(vasprun, args.indices)
-    #print(atoms)
-
-    return atoms
+vasp_files = [Path(p) / args.vaspfile for p in vasp_dirs_sorted[:args.limit]]
+
+def check_frames(frames):
+    """count converged configurations while frames are written"""
+    nconverged = 0
+    for atoms in frames:
+        indices = [a.index for a in atoms if a.position[0]<1.5]
+        cons = FixAtoms(indices = indices)
+        atoms.set_constraint(cons)
+        forces = atoms.get_forces(apply_constraint=True)
+        maxforce = np.max(np.fabs(forces))
+        if maxforce < 0.05:
+            nconverged += 1
+        yield atoms
+    print("number of converged: ", nconverged)
 
 st = time.time()
 
 if args.njobs > 1:
     print('using num of jobs: ', args.njobs)
-    atoms = Parallel(n_jobs=args.njobs)(delayed(extract_atoms)(p) for p in vasp_dirs_sorted)
-    frames = []
-    if isinstance(atoms, list):
-        frames.extend(atoms)
-    else:
-        frames.append(atoms)
+frames = tqdm(harvest(
+    vasp_files, args.indices, args.njobs, use_cache=not args.nocache
+))
+if args.check:
+    frames = check_frames(frames)
+
+if args.store:
+    nframes = write_frames(d.name+'_sorted.frames', frames)
 else:
-    frames = []
-    for idx, p in tqdm(enumerate(vasp_dirs_sorted)):
-        if idx >= args.limit:
-            break
-        vasprun = Path(p) / args.vaspfile
-        #atoms = read(vasprun, format='vasp-xml')
-        atoms = read(vasprun, args.indices)
-        if isinstance(atoms, list):
-            frames.extend(atoms)
-        else:
-            frames.append(atoms)
+    nframes = write_frames(d.name+'_sorted.xyz', frames)
 
 et = time.time()
 print('cost time: ', et-st)
 
-
-if len(frames) > 0:
-    if args.check:
-        nconverged = 0
-        for atoms in frames:
-            indices = [a.index for a in atoms if a.position[0]<1.5]
-            cons = FixAtoms(indices = indices)
-            atoms.set_constraint(cons)
-            forces = atoms.get_forces(apply_constraint=True)
-            maxforce = np.max(np.fabs(forces))
-            if maxforce < 0.05:
-                nconverged += 1
-        print("number of converged: ", nconverged)
-    print("Number of frames: ", len(frames))
-    write(d.name+'_sorted.xyz', frames)
+if nframes > 0:
+    print("Number of frames: ", nframes)
 else:
     print("No frames...")
 
@@ -1,14 +1,24 @@
 #!/usr/bin/env python3
 
 import os
+import re
+import sys
 import time
 import json
+import hashlib
 import logging
 import argparse
 
 from ase.io import read, write
 from ase.calculators.vasp import Vasp2
 
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from coreLedger import PENDING, RUNNING, DONE, FAILED, \
+        load_ledger, save_ledger, register_jobs, summarize
+from coreTraj import parse_selection, count_xyz
+from coreXYZ import read_frames
+
 # logger
 logLevel = logging.INFO
 
@@ -27,18 +37,15 @@ logger.addHandler(fh)
 # VASP environments
 
 def read_structures(stru_file, indices):
-    """"""
-    frames = read(stru_file, ':')
-    if type(frames) != list:
-        frames = [frames]
-
-    # TODO: add step info
-    # for idx, atoms in enumerate(frames):
-    #     atoms.info['step'] = idx
+    """selected structures and their indices in the file"""
+    if indices:
+        indices = ','.join(indices)
+    selected = parse_selection(indices, count_xyz(stru_file)).tolist()
+    frames = read_frames(stru_file, selected)
 
     logger.info('%d structures in %s\n', len(frames), stru_file)
 
-    return frames
+    return frames, selected
 
 def parse_params(json_file):
     """pass json format params"""
@@ -100,37 +107,167 @@ def generate_calculator(calculator, command, params, directory='vasp-outputs'):
 
     return calc
 
+def hash_file(fname):
+    """sha1 of a result file"""
+    with open(fname, 'rb') as fopen:
+        return hashlib.sha1(fopen.read()).hexdigest()
+
+def check_result(job):
+    """whether the result of a done job is still there unchanged"""
+    result = job.get('result', None)
+    if result is None or not os.path.exists(result):
+        return False
+
+    return hash_file(result) == job['hash']
+
+def get_returncode(error):
+    """error code of the calculator command in the failure message"""
+    match = re.search(r'returned an error: *(-?[0-9]+)', str(error))
+    if match:
+        return int(match.group(1))
+
+    return None
+
+def run_single(atoms, calculator, calc_command, calc_params, directory, timeout):
+    """calculate one structure, the result is written in its directory"""
+    command = calc_command
+    if timeout is not None:
+        command = 'timeout %d %s' %(timeout, calc_command)
+
+    atoms = atoms.copy()
+    atoms.set_calculator(
+        generate_calculator(
+            calculator, command, calc_params.copy(), directory
+        )
+    )
+    dummy = atoms.get_forces() # just to call a calculation 
+
+    result = os.path.join(directory, 'calculated.xyz')
+    write(result, atoms)
+
+    return result
+
 def run_calculation(
-        frames, prefix, calculator, calc_command, calc_params_list
+        frames, prefix, calculator, calc_command, calc_params_list, 
+        ledgerfile='calculated.ledger.json', maxtries=1, timeout=None,
+        indices=None
     ):
-    """"""
-    # initialise few files
-    for idx in range(len(calc_params_list)):
-        with open('calculated_'+str(idx)+'.xyz', 'w') as writer:
-            writer.write('')
+    """
+    structures of each stage are the results of the previous stage, every
+    structure x stage is a job in the ledger with its status, wall time, 
+    error code and result hash, so a restart only runs unfinished jobs
+    and retries failed ones until they are attempted maxtries times,
+    indices are the structure indices in the file used in job names
+    """
+    ledger = load_ledger(ledgerfile)
+    jobs = ledger['jobs']
+    # unset until all stages are through, resume_calculation checks it
+    ledger['finished'] = False
 
+    if indices is None:
+        indices = list(range(len(frames)))
     for jdx, calc_params in enumerate(calc_params_list):
         logger.info(
             "\n===== Calculation Stage %d =====\n", jdx
         )
-        for idx, atoms in enumerate(frames):
+        names = ['%d_%d' %(jdx, idx) for idx in indices]
+        positions = {name: i for i, name in enumerate(names)}
+
+        # done jobs whose results are lost are calculated again
+        for name in names:
+            if name in jobs.keys() and jobs[name]['status'] == DONE \
+                    and not check_result(jobs[name]):
+                logger.info('Result of job %s is lost...\n', name)
+                jobs[name].update(status=PENDING, attempts=0)
+        pending = register_jobs(ledger, names, maxtries)
+
+        # later stages of structures calculated again start from new results
+        for name in pending:
+            idx = name.split('_')[1]
+            for kdx in range(jdx+1, len(calc_params_list)):
+                later = '%d_%s' %(kdx, idx)
+                if later in jobs.keys():
+                    jobs[later].update(status=PENDING, attempts=0)
+        save_ledger(ledgerfile, ledger)
+        logger.info(
+            '%d structures, %d to calculate.\n', len(names), len(pending)
+        )
+
+        stage_start = time.time()
+        for name in pending:
+            job = jobs[name]
+            directory = prefix+'_'+name
             logger.info(
-                "Structure Number %d\n", idx
-                #"Structure Number %d\n Index in XYZ is %d\n", idx, atoms.info['step']
+                "Structure Number %d\n", indices[positions[name]]
             )
-            atoms.set_calculator(
-                generate_calculator(
-                    calculator, calc_command, calc_params, 
-                    prefix+'_'+str(jdx)+'_'+str(idx)
-                    #'vasp_'+str(jdx)+'_'+str(atoms.info['step'])
+            while True:
+                job.update(
+                    status=RUNNING, attempts=job['attempts']+1, 
+                    directory=directory
                 )
-            )
-            dummy = atoms.get_forces() # just to call a calculation 
-            write('calculated_'+str(jdx)+'.xyz', atoms, append=True)
+                save_ledger(ledgerfile, ledger)
+
+                start = time.time()
+                try:
+                    result = run_single(
+                        frames[positions[name]], calculator, calc_command, 
+                        calc_params, directory, timeout
+                    )
+                    job.update(
+                        status=DONE, returncode=0, 
+                        result=result, hash=hash_file(result)
+                    )
+                    job.pop('error', None)
+                except Exception as error:
+                    returncode = get_returncode(error)
+                    job.update(status=FAILED, returncode=returncode)
+                    job['error'] = 'timeout' if returncode == 124 else str(error)
+                    logger.info(
+                        'Job %s failed (attempt %d): %s\n', 
+                        name, job['attempts'], job['error']
+                    )
+                job['walltime'] = time.time() - start
+                save_ledger(ledgerfile, ledger)
+
+                if job['status'] == DONE or job['attempts'] >= maxtries:
+                    break
+
+        # results in the structure order are the next stage structures
+        done = [(idx, name) for idx, name in zip(indices, names) \
+                if jobs[name]['status'] == DONE]
+        with open('calculated_'+str(jdx)+'.xyz', 'w') as writer:
+            for idx, name in done:
+                with open(jobs[name]['result'], 'r') as fopen:
+                    writer.write(fopen.read())
+        frames = [read(jobs[name]['result']) for idx, name in done]
+        indices = [idx for idx, name in done]
+
+        report_throughput(ledger, names, pending, time.time()-stage_start)
+
+    ledger['finished'] = True
+    save_ledger(ledgerfile, ledger)
+
+    counts = summarize(ledger)
+    logger.info(
+        'Ledger: %d done, %d failed, %d pending.\n', 
+        counts[DONE], counts[FAILED], counts[PENDING]
+    )
 
-        frames = read('calculated_'+str(jdx)+'.xyz', ':')
-        if type(frames) != list:
-            frames = [frames]
+    return
+
+def report_throughput(ledger, names, pending, elapsed):
+    """jobs done in this run and structures per hour of a stage"""
+    jobs = ledger['jobs']
+    ndone = len([name for name in pending if jobs[name]['status'] == DONE])
+    nfailed = len([name for name in names if jobs[name]['status'] == FAILED])
+    walltime = sum(jobs[name].get('walltime', 0.) for name in pending)
+
+    content = 'Stage: %d done, %d failed, %d skipped from earlier runs.\n' \
+            %(ndone, nfailed, len(names)-len(pending))
+    if ndone > 0:
+        content += 'Throughput: %.2f structures/hour, %.1f s per structure.\n' \
+                %(ndone/elapsed*3600., walltime/len(pending))
+    logger.info(content)
 
     return
 
@@ -155,19 +292,37 @@ if __name__ == '__main__':
     parser.add_argument(
         '-i', '--indices', 
         default=None, nargs='*', 
-        help='unsupported frame selection'
+        help='frame selection like 0:10 or 0:10,15,20:25'
+    )
+    parser.add_argument(
+        '-l', '--ledger', 
+        default='calculated.ledger.json', 
+        help='ledger of calculations for restarts'
+    )
+    parser.add_argument(
+        '-m', '--maxtries', 
+        default=1, type=int, 
+        help='max attempts of a failed calculation, including restarts'
+    )
+    parser.add_argument(
+        '-t', '--timeout', 
+        default=None, type=int, 
+        help='time limit of each calculation in seconds'
     )
 
     args = parser.parse_args()
 
     # read structures
-    frames = read_structures(args.structure, args.indices)
+    frames, indices = read_structures(args.structure, args.indices)
 
     # read calc params
     #calculator, calc_command, calc_params_list = parse_params('vasp_params.json')
 
     # run calculation 
-    run_calculation(frames, *parse_params(args.parameter))
+    run_calculation(
+        frames, *parse_params(args.parameter), 
+        args.ledger, args.maxtries, args.timeout, indices
+    )
 
     logger.info(
         '\nFinish at %s\n', 
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import os
+import sys
 import time
 import json
 import logging
@@ -8,6 +9,7 @@ import subprocess
 import argparse
 
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 
@@ -15,6 +17,11 @@ from ase.io import read, write
 from ase.io.vasp import write_vasp 
 from ase.calculators.vasp import Vasp2 # use Vasp in later ase version
 
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from coreTraj import parse_selection, count_xyz
+from coreXYZ import read_frames
+
 # logger
 logLevel = logging.INFO
 
@@ -75,6 +82,12 @@ def generate_calculator(calculator, kpts, command, directory='vasp-outputs'):
     return calc
 
 def create_vasp_inputs(directory, atoms, incar):
+    """
+    write inputs in a worker thread, messages are returned and logged by
+    the main thread so they stay under their structure in log.txt
+    """
+    contents = []
+
     # ===== initialise ===== 
     calc = Vasp2(
         command = VASP_COMMAND, 
@@ -95,7 +108,7 @@ def create_vasp_inputs(directory, atoms, incar):
     content = '\n>>>>> Modified ASE for VASP <<<<<\n'
     content += '    directory -> %s\n' %directory 
     #print(content)
-    logger.info(content)
+    contents.append(content)
 
     # ===== POSCAR ===== 
     poscar = os.path.join(directory, 'POSCAR')
@@ -112,7 +125,7 @@ def create_vasp_inputs(directory, atoms, incar):
     content = 'KPOINTS -->\n'
     content += "     Set k-point -> \033[1;35m{} {} {}\033[0m\n".format(*kpts)
     #print(content)
-    logger.info(content)
+    contents.append(content)
 
     # ===== INCAR and 188 ===== 
     content = 'INCAR -->\n'
@@ -123,14 +136,14 @@ def create_vasp_inputs(directory, atoms, incar):
     calc.write_incar(atoms, directory=directory)
 
     #print(content)
-    logger.info(content)
+    contents.append(content)
     
     # ===== POTCAR =====
     calc.write_potcar(directory=directory)
     content = "POTCAR -->\n"
     content += "    Using POTCAR from %s\n" %VASP_PP_PATH
     #print(content)
-    logger.info(content)
+    contents.append(content)
 
     # ===== VDW =====
     if calc.bool_params['luse_vdw']:
@@ -139,59 +152,93 @@ def create_vasp_inputs(directory, atoms, incar):
         content = "VDW -->\n"
         content += "    Using vdW Functional as %s\n" %calc.string_params['gga']
         #print(content)
-        logger.info(content)
+        contents.append(content)
 
-    return
+    return contents
+
+def read_result(directory):
+    """final structure with energy and forces in vasprun.xml"""
+    vasprun = directory / 'vasprun.xml'
+    atoms = read(vasprun, format='vasp-xml')
+    atoms.info['source'] = directory.name
+
+    return atoms
+
+def run_single(directory, atoms, incar, command, timeout):
+    """
+    prepare inputs and run one calculation in a worker thread, 
+    return messages of inputs and the error code or None if timed out
+    """
+    contents = create_vasp_inputs(directory, atoms, incar)
+
+    try:
+        proc = subprocess.run(
+            command, shell=True, cwd=directory, timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        return contents, None
+
+    return contents, proc.returncode
 
 def run_calculation(
-        stru_file, indices, prefix, incar_list
+        stru_file, indices, prefix, incar_list, 
+        njobs=1, ncores=None, timeout=300, command=None
     ):
-    """"""
+    """
+    run njobs calculations at a time with ncores each, {ncores} in the 
+    command is replaced by the cores of a job, results are appended to 
+    calculated_<stage>.xyz in the structure order whatever finishes first,
+    vasprun.xml is parsed by the main thread so a finished calculation 
+    frees its slot at once
+    """
+    if command is None:
+        command = VASP_COMMAND
+    if ncores is None:
+        ncores = max((os.cpu_count() or 1) // njobs, 1)
+    command = command.replace('{ncores}', str(ncores))
+
     # initialise few files
     for idx in range(len(incar_list)):
         with open('calculated_'+str(idx)+'.xyz', 'w') as writer:
             writer.write('')
 
     # read structures
-    frames = read(stru_file, indices)
-    start, end = indices.split(':')
-    if start == '':
-        start = 0
-    else:
-        start = int(start)
-    logger.info('%d structures in %s from %d\n', len(frames), stru_file, start)
+    selected = parse_selection(indices, count_xyz(stru_file))
+    frames = read_frames(stru_file, selected)
+    logger.info('%d structures in %s selected by %s\n', len(frames), stru_file, indices)
+    logger.info('%d calculations at a time with %d cores each\n', njobs, ncores)
 
     # run calc
-    for jdx, incar in enumerate(incar_list):
-        logger.info(
-            "\n===== Calculation Stage %d =====\n", jdx
-        )
-        for idx, atoms in enumerate(frames):
-            logger.info(
-                "\n===== Structure Number %d\n", idx+start
-                #"Structure Number %d\n Index in XYZ is %d\n", idx, atoms.info['step']
-            )
-            
-            directory = Path(prefix+'_'+str(jdx)+'_'+str(idx+start))
-            create_vasp_inputs(directory, atoms, incar)
-
-            try:
-                proc = subprocess.run(
-                    VASP_COMMAND, shell=True, cwd=directory, timeout=300,
+    with ThreadPoolExecutor(max_workers=njobs) as runner:
+        tasks = []
+        for jdx, incar in enumerate(incar_list):
+            for idx, atoms in zip(selected, frames):
+                directory = Path(prefix+'_'+str(jdx)+'_'+str(idx))
+                future = runner.submit(
+                    run_single, directory, atoms, incar, command, timeout
                 )
+                tasks.append((jdx, idx, directory, future))
 
-                if not proc.check_returncode():
-                    vasprun = directory / 'vasprun.xml'
-                    atoms = read(vasprun, format='vasp-xml')
-                    atoms.info['source'] = directory.name
-                    write('calculated_'+str(jdx)+'.xyz', atoms, append=True)
-                    logger.info('successcode %s' %(proc.returncode))
-                else:
-                    logger.info('errorcode %s' %(proc.returncode))
-            except subprocess.TimeoutExpired:
+        # collect in order, later calculations keep running meanwhile
+        for i, (jdx, idx, directory, future) in enumerate(tasks):
+            if i % len(frames) == 0:
+                logger.info(
+                    "\n===== Calculation Stage %d =====\n", jdx
+                )
+            logger.info(
+                "\n===== Structure Number %d\n", idx
+            )
+            contents, errorcode = future.result()
+            for content in contents:
+                logger.info(content)
+            if errorcode is None:
                 logger.info('Time out...')
-            except subprocess.CalledProcessError:
-                logger.info('errorcode...' )
+            elif errorcode != 0:
+                logger.info('errorcode %s' %(errorcode))
+            else:
+                atoms = read_result(directory)
+                write('calculated_'+str(jdx)+'.xyz', atoms, append=True)
+                logger.info('successcode %s' %(errorcode))
 
     return
 
@@ -216,13 +263,31 @@ if __name__ == '__main__':
     parser.add_argument(
         '-i', '--indices', 
         default=':', 
-        help='unsupported frame selection'
+        help='frame selection like 0:10 or 0:10,15,20:25'
+    )
+    parser.add_argument(
+        '-j', '--njobs', 
+        default=1, type=int, 
+        help='number of calculations running at a time'
+    )
+    parser.add_argument(
+        '-c', '--ncores', 
+        default=None, type=int, 
+        help='cores of each calculation, replace {ncores} in VASP_COMMAND'
+    )
+    parser.add_argument(
+        '-t', '--timeout', 
+        default=300, type=float, 
+        help='time limit of each calculation in seconds'
     )
 
     args = parser.parse_args()
 
     # run calculation 
-    run_calculation(args.structure, args.indices, 'vasp', args.parameter)
+    run_calculation(
+        args.structure, args.indices, 'vasp', args.parameter, 
+        args.njobs, args.ncores, args.timeout
+    )
 
     logger.info(
         '\nFinish at %s\n', 
@@ -5,13 +5,26 @@
 structure file + vasp script + job script
 """
 
+import os
+import sys
+import heapq
 import argparse
 import warnings
 import shutil
 from pathlib import Path
 
+import numpy as np
+
 from ase.io import read, write
 
+sys.path.append(os.path.join(os.getenv("HOME"), \
+        'repository/DailyScripts/common'))
+from coreTraj import format_selection, index_xyz, sidecar_name
+from coreXYZ import read_headers, read_symbols
+
+# cost of a single point ~ nkpts * nelectrons^COST_POWER (orthogonalization)
+COST_POWER = 3
+
 def current_slurm(name, stru_path, incar_name, indices=':'):
     """"""
     content = "#!/bin/bash -l\n"
@@ -36,16 +49,53 @@ def current_slurm(name, stru_path, incar_name, indices=':'):
 
     return content
 
-def create_chunks(tot, n):
-    size = int(tot/n)
-    chunks = []
-    for i in range(n-1):
-        chunks.append("\"%d:%d\"" %(i*size,(i+1)*size))
-    chunks.append("\"%d:\""%((n-1)*size))
+def read_zvals(pp_path, symbols):
+    """valence electrons of elements in PBE POTCARs"""
+    zvals = {}
+    for symbol in set(symbols):
+        potcar = Path(pp_path) / 'potpaw_PBE' / symbol / 'POTCAR'
+        if not potcar.exists():
+            raise ValueError('No POTCAR of %s in %s.' %(symbol, pp_path))
+        with open(potcar, 'r') as fopen:
+            for line in fopen:
+                if 'ZVAL' in line:
+                    zvals[symbol] = float(line.split('ZVAL')[1].split()[1])
+                    break
+        if symbol not in zvals.keys():
+            raise ValueError('No ZVAL in %s.' %potcar)
+
+    return zvals
+
+def estimate_cost(cell, natoms, symbols=None, zvals=None):
+    """
+    relative cost by the k-points of create_vasp_inputs and the number of
+    electrons, atoms are counted as electrons without POTCARs
+    """
+    kpts = np.linalg.norm(cell, axis=1).tolist()
+    kpts = [int(20./k)+1 for k in kpts] 
+
+    if zvals is None:
+        nelect = natoms
+    else:
+        nelect = sum(zvals[s] for s in symbols)
+
+    return float(np.prod(kpts)) * nelect**COST_POWER
 
-    return chunks
+def create_chunks(costs, n):
+    """
+    indices of n chunks of balanced costs by longest processing time first,
+    each structure goes to the least loaded chunk in the descending cost
+    """
+    heap = [(0., i) for i in range(n)]
+    chunks = [[] for i in range(n)]
+    for idx in np.argsort(costs, kind='stable')[::-1]:
+        load, i = heapq.heappop(heap)
+        chunks[i].append(int(idx))
+        heapq.heappush(heap, (load+costs[idx], i))
 
-def create_files(vasp_script, incar_template, stru_file, nchunk=1):
+    return [sorted(chunk) for chunk in chunks]
+
+def create_files(vasp_script, incar_template, stru_file, nchunk=1, pp_path=None):
     #vasp_script = Path('../calc_test/compute_by_ase.py')
     #incar_template = Path('../calc_temp/INCAR_OXIDE')
     #stru_file = Path('/users/40247882/projects/oxides/gdp-main/it-0009/dpmd-nvt-oxides/PtO_100-nvt/sorted/PtO_100-nvt-sel.xyz')
@@ -53,11 +103,40 @@ def create_files(vasp_script, incar_template, stru_file, nchunk=1):
     incar_template = Path(incar_template)
     stru_file = Path(stru_file)
 
-    frames = read(stru_file, ':')
-    print('numebr of frames in %s is %d' %(stru_file.name, len(frames)))
-    chunks = create_chunks(len(frames), nchunk)
+    # frames are counted and their headers read without parsing atoms
+    nframes = len(index_xyz(stru_file)['offset'])
+    print('numebr of frames in %s is %d' %(stru_file.name, nframes))
+
+    headers = read_headers(stru_file)
+    for i, (natoms, info) in enumerate(headers):
+        if 'Lattice' not in info.keys():
+            raise ValueError('No Lattice of frame %d in %s.' %(i, stru_file))
+
+    # the cost only balances chunks, atoms are counted without POTCARs
+    zvals, symbols = None, [None]*nframes
+    if pp_path is not None:
+        symbols = read_symbols(stru_file)
+        try:
+            zvals = read_zvals(
+                pp_path, [s for frame in symbols for s in set(frame)]
+            )
+        except ValueError as error:
+            warnings.warn('%s Cost by number of atoms.' %error, UserWarning)
+            zvals, symbols = None, [None]*nframes
+    costs = np.array([
+        estimate_cost(info['Lattice'], natoms, frame, zvals) \
+                for (natoms, info), frame in zip(headers, symbols)
+    ])
+    chunks = create_chunks(costs, nchunk)
+
+    loads = np.array([np.sum(costs[chunk]) for chunk in chunks])
+    print('relative cost of chunks: %s' %(' '.join(
+        '%.3f' %(load/np.max(loads)) for load in loads
+    )))
 
     for i, chunk in enumerate(chunks):
+        if not chunk:
+            continue
         wd = Path(stru_file.stem + '-' + str(i))
         print('try to create %s' %wd)
         if wd.exists():
@@ -66,11 +145,18 @@ def create_files(vasp_script, incar_template, stru_file, nchunk=1):
         else:
             wd.mkdir()
         # copy files
-        shutil.copy(stru_file, wd / stru_file.name)
+        # the index is valid for the copy with the same mtime, jobs seek
+        # to their frames directly
+        shutil.copy2(stru_file, wd / stru_file.name)
+        if os.path.exists(sidecar_name(stru_file)):
+            shutil.copy2(sidecar_name(stru_file), sidecar_name(wd / stru_file.name))
         shutil.copy(incar_template, wd / incar_template.name)
         shutil.copy(vasp_script, wd / vasp_script.name)
         # write job script
-        content = current_slurm(wd.name, stru_file.name, incar_template.name, chunk)
+        content = current_slurm(
+            wd.name, stru_file.name, incar_template.name, 
+            '\"%s\"' %format_selection(chunk)
+        )
         with open(wd / 'vasp.slurm', 'w') as fopen:
             fopen.write(content)
 
@@ -100,7 +186,12 @@ if __name__ == '__main__':
         default=1, type=int,
         help='split into separate dirs'
     )
+    parser.add_argument(
+        '--pp', 
+        default=os.environ.get('VASP_PP_PATH', None),
+        help='pseudopotential path to count electrons in the cost'
+    )
 
     args = parser.parse_args()
 
-    create_files(args.vasp, args.parameter, args.structure, args.nchunks)
+    create_files(args.vasp, args.parameter, args.structure, args.nchunks, args.pp)